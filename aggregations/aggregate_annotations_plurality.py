@@ -1,26 +1,38 @@
 """ Aggregate Zooniverse Classifications to obtain
     Labels for Subjects using the Plurality Algorithm
 """
-import csv
 import os
+import csv
+import shutil
+import tempfile
+import zlib
 import argparse
 import math
 from statistics import median_high, StatisticsError
 from collections import Counter, defaultdict, OrderedDict
+from functools import partial
+from multiprocessing import Pool
 import logging
 
+import numpy as np
 import pandas as pd
 
 from utils.logger import set_logging
 from config.cfg import cfg
 from aggregations import aggregator
 from utils.utils import (
-    print_nested_dict, set_file_permission, OrderedCounter)
+    print_nested_dict, set_file_permission, OrderedCounter,
+    read_header_and_rows, read_df, write_df)
 
 
 flags = cfg['plurality_aggregation_flags']
 flags_global = cfg['global_processing_flags']
 
+logger = logging.getLogger(__name__)
+
+# number of shards per process if aggregated in parallel
+SHARDS_PER_PROCESS = 4
+
 # args = dict()
 # args['annotations'] = '/home/packerc/shared/zooniverse/Exports/SER/SER_S1_classifications_extracted.csv'
 # args['output_csv'] = '/home/packerc/shared/zooniverse/Exports/SER/SER_S1_classifications_aggregated.csv'
@@ -177,6 +189,397 @@ def aggregate_subject_annotations(
     return record
 
 
+def aggregate_annotations(
+        subject_annotations,
+        questions,
+        question_type_map,
+        question_main_id):
+    """ Aggregate the annotations of all subjects (dict-based engine)
+        subject_annotations: dict mapping subject_ids to a list of
+            annotations (dicts)
+        Returns: list of records - one per subject and species
+    """
+    subject_species_aggregations = dict()
+    for num, (subject_id, subject_data) in enumerate(
+            subject_annotations.items()):
+        # print status
+        if ((num % 10000) == 0) and (num > 0):
+            print("Aggregated {:,} subjects".format(num))
+        record = aggregate_subject_annotations(
+                    subject_data,
+                    questions,
+                    question_type_map,
+                    question_main_id)
+        subject_species_aggregations[subject_id] = record
+
+    # Create one record per identification
+    subject_identificatons = list()
+    for subject_id, subject_agg_data in subject_species_aggregations.items():
+        # export each species
+        for sp, species_dat in subject_agg_data['species_aggregations'].items():
+            species_is_plurality_consensus = \
+                int(sp in subject_agg_data['consensus_species'])
+            record = {
+                'subject_id': subject_id,
+                question_main_id: sp,
+                **species_dat,
+                **subject_agg_data['aggregation_info'],
+                'species_is_plurality_consensus': species_is_plurality_consensus}
+            subject_identificatons.append(record)
+    return subject_identificatons
+
+
+def _median_high_by_group(groups, values):
+    """ Calculate median_high of values per group
+        Returns: Series indexed by group
+    """
+    df = pd.DataFrame({'group': groups, 'value': values})
+    df = df.sort_values(by=['group', 'value'], kind='mergesort')
+    rank_in_group = df.groupby('group').cumcount().to_numpy()
+    group_size = df.groupby('group')['value'].transform('size').to_numpy()
+    df_median = df[rank_in_group == (group_size // 2)]
+    return pd.Series(
+        df_median['value'].to_numpy(), index=df_median['group'].to_numpy())
+
+
+def _count_aggregations_by_group(groups, answers, n_groups):
+    """ Vectorized version of 'aggregator.count_aggregator' for all
+        modes in flags['COUNT_AGGREGATION_MODES']
+        Returns: dict mapping mode to a list of str (one per group)
+    """
+    counts_mapper = flags['COUNTS_TO_ORDINAL_MAPPER']
+    counts_unmapping = {int(v): k for k, v in counts_mapper.items()}
+    mapped = answers.map(
+        {k: int(v) for k, v in counts_mapper.items()}).to_numpy(
+            dtype=float, copy=True)
+    not_mapped = (~answers.isin(counts_mapper.keys()) & (answers != ''))
+    if not_mapped.any():
+        mapped[not_mapped.to_numpy()] = answers[not_mapped].astype(int)
+    has_value = ~pd.isna(mapped)
+    groups_with_value = groups[has_value]
+    values = mapped[has_value].astype(int)
+    aggs = dict()
+    for mode in flags['COUNT_AGGREGATION_MODES']:
+        if mode == 'median':
+            agg = _median_high_by_group(groups_with_value, values)
+        elif mode == 'min':
+            agg = pd.Series(values).groupby(groups_with_value).min()
+        elif mode == 'max':
+            agg = pd.Series(values).groupby(groups_with_value).max()
+        else:
+            raise ValueError("mode {} not allowed".format(mode))
+        agg_strings = [''] * n_groups
+        for group, agg_val in zip(agg.index.tolist(), agg.tolist()):
+            if agg_val in counts_unmapping:
+                agg_strings[group] = counts_unmapping[agg_val]
+            else:
+                agg_strings[group] = str(agg_val)
+        aggs[mode] = agg_strings
+    return aggs
+
+
+def _proportion_affirmative_by_group(groups, answers, n_groups):
+    """ Vectorized version of 'aggregator.proportion_affirmative'
+        Returns: list of str (one per group)
+    """
+    df = pd.DataFrame({
+        'group': groups,
+        'true': (answers == '1').to_numpy(),
+        'no_answer': (answers == '').to_numpy()})
+    grouped = df.groupby('group')
+    stats = pd.DataFrame({
+        'true': grouped['true'].sum(),
+        'no_answer': grouped['no_answer'].sum(),
+        'tot': grouped.size()}).reindex(range(n_groups))
+    return [
+        '' if no_answer == tot else '{:.2f}'.format(true / tot)
+        for true, no_answer, tot in zip(
+            stats['true'].tolist(), stats['no_answer'].tolist(),
+            stats['tot'].tolist())]
+
+
+def aggregate_annotations_vectorized(
+        df_annotations,
+        questions,
+        question_type_map,
+        question_main_id):
+    """ Aggregate the annotations of all subjects at once using grouped /
+        vectorized operations - produces exactly the same output as
+        'aggregate_annotations' (the dict-based engine), but much faster
+        df_annotations: DataFrame with one annotation per row (str values)
+        Returns: DataFrame - one row per subject and species
+    """
+    empty_answer = flags_global['QUESTION_MAIN_EMPTY']
+    subject_codes, subject_ids = pd.factorize(
+        df_annotations['subject_id'], sort=False)
+    species_codes, species_names = pd.factorize(
+        df_annotations[question_main_id], sort=False)
+    n_subjects = len(subject_ids)
+    all_subjects = range(n_subjects)
+
+    annos = pd.DataFrame({
+        'subject': subject_codes,
+        'species': species_codes,
+        'user': pd.factorize(df_annotations['user_name'])[0],
+        'classification': pd.factorize(
+            df_annotations['classification_id'])[0],
+        'is_species': (
+            df_annotations[question_main_id] != empty_answer).to_numpy(),
+        'row': np.arange(df_annotations.shape[0])})
+
+    ######################################
+    # Subject Stats
+    ######################################
+
+    grouped_subjects = annos.groupby('subject')
+    n_subject_users = grouped_subjects['user'].nunique()
+    n_subject_classifications = grouped_subjects['classification'].nunique()
+
+    # number of species identifications per user
+    user_species_ids = annos[annos['is_species']].groupby(
+        ['subject', 'user']).size()
+    user_species_subjects = user_species_ids.index.get_level_values(0)
+    n_users_id_species = user_species_ids.groupby(
+        user_species_subjects).size().reindex(all_subjects, fill_value=0)
+    n_species_ids_per_user_median = _median_high_by_group(
+        user_species_subjects.to_numpy(),
+        user_species_ids.to_numpy()).reindex(all_subjects, fill_value=0)
+    n_species_ids_per_user_max = user_species_ids.groupby(
+        user_species_subjects).max().reindex(all_subjects, fill_value=0)
+    n_users_id_empty = n_subject_users - n_users_id_species
+    subject_is_empty = (n_users_id_empty > n_users_id_species).to_numpy()
+
+    ######################################
+    # Species Stats
+    ######################################
+
+    # groups of subject / species in the order they were first seen
+    grouped_species = annos.groupby(['subject', 'species'], sort=False)
+    species_groups = grouped_species.ngroup().to_numpy()
+    n_groups = grouped_species.ngroups
+    species_stats = pd.DataFrame({
+        'n_votes': grouped_species.size(),
+        'first_row': grouped_species['row'].min(),
+        'n_users_identified_this_species':
+            grouped_species['classification'].nunique()}).reset_index()
+
+    for question in questions:
+        question_type = question_type_map[question]
+        answers = df_annotations[question].reset_index(drop=True)
+        if question_type == 'count':
+            count_aggs = _count_aggregations_by_group(
+                species_groups, answers, n_groups)
+            for agg_type in flags['COUNT_AGGREGATION_MODES']:
+                agg_name = '{}_{}'.format(question, agg_type)
+                species_stats[agg_name] = count_aggs[agg_type]
+        elif question_type == 'prop':
+            species_stats[question] = _proportion_affirmative_by_group(
+                species_groups, answers, n_groups)
+
+    # export blanks only for empty subjects, order species by
+    # frequency of identifications, ties by which species was seen first
+    is_blank = \
+        species_names.to_numpy()[species_stats['species']] == empty_answer
+    is_empty = subject_is_empty[species_stats['subject']]
+    species_stats = species_stats[is_empty | ~is_blank]
+    is_empty = subject_is_empty[species_stats['subject']]
+    is_blank = \
+        species_names.to_numpy()[species_stats['species']] == empty_answer
+    sort_order = np.lexsort((
+        species_stats['first_row'].to_numpy(),
+        -species_stats['n_votes'].to_numpy(),
+        species_stats['subject'].to_numpy()))
+    species_stats = species_stats.iloc[sort_order]
+    is_empty = is_empty[sort_order]
+    is_blank = is_blank[sort_order]
+    rank_in_subject = species_stats.groupby('subject').cumcount().to_numpy()
+    subjects = species_stats['subject'].to_numpy()
+
+    n_users_total = np.where(
+        is_empty,
+        n_subject_classifications.to_numpy()[subjects],
+        n_users_id_species.to_numpy()[subjects])
+    n_users_identified = \
+        species_stats['n_users_identified_this_species'].to_numpy()
+
+    # consensus: blank for empty subjects, otherwise the top species
+    median_ids = n_species_ids_per_user_median.to_numpy()[subjects]
+    species_is_plurality_consensus = np.where(
+        is_empty, is_blank, rank_in_subject < median_ids).astype(int)
+
+    # pielou for subjects with multiple species
+    pielou = np.zeros(n_subjects)
+    n_species_in_subject = np.bincount(subjects, minlength=n_subjects)
+    multi_species = (~is_empty) & (n_species_in_subject[subjects] > 1)
+    subjects_multi = subjects[multi_species]
+    if len(subjects_multi) > 0:
+        # rows are sorted by subject
+        boundaries = np.flatnonzero(np.diff(subjects_multi)) + 1
+        first_rows = np.concatenate([[0], boundaries])
+        for subject, votes in zip(
+                subjects_multi[first_rows].tolist(),
+                np.split(n_users_identified[multi_species], boundaries)):
+            pielou[subject] = calculate_pielou(votes.tolist())
+
+    ######################################
+    # Create Output
+    ######################################
+
+    df_out = pd.DataFrame({
+        'subject_id': subject_ids.to_numpy()[subjects],
+        question_main_id: species_names.to_numpy()[species_stats['species']]})
+    for question in questions:
+        question_type = question_type_map[question]
+        if question_type == 'count':
+            for agg_type in flags['COUNT_AGGREGATION_MODES']:
+                agg_name = '{}_{}'.format(question, agg_type)
+                df_out[agg_name] = species_stats[agg_name].to_numpy()
+        elif question_type == 'prop':
+            df_out[question] = species_stats[question].to_numpy()
+    df_out['n_users_identified_this_species'] = \
+        n_users_identified.astype(np.int64)
+    df_out['p_users_identified_this_species'] = [
+        '{:.2f}'.format(n / tot) for n, tot in zip(
+            n_users_identified.tolist(), n_users_total.tolist())]
+    df_out['n_species_ids_per_user_median'] = median_ids.astype(np.int64)
+    df_out['n_species_ids_per_user_max'] = \
+        n_species_ids_per_user_max.to_numpy()[subjects].astype(np.int64)
+    df_out['n_users_classified_this_subject'] = \
+        n_subject_users.to_numpy()[subjects].astype(np.int64)
+    df_out['n_users_saw_a_species'] = \
+        n_users_id_species.to_numpy()[subjects].astype(np.int64)
+    df_out['n_users_saw_no_species'] = \
+        n_users_id_empty.to_numpy()[subjects].astype(np.int64)
+    df_out['p_users_saw_a_species'] = [
+        '{:.2f}'.format(n / tot) for n, tot in zip(
+            n_users_id_species.to_numpy()[subjects].tolist(),
+            n_subject_users.to_numpy()[subjects].tolist())]
+    df_out['pielous_evenness_index'] = [
+        '{:.2f}'.format(x) for x in pielou[subjects].tolist()]
+    df_out['species_is_plurality_consensus'] = species_is_plurality_consensus
+    return df_out
+
+
+def read_subject_annotations(annotations_path):
+    """ Read annotations and associate them with their subject_id
+        Returns: dict mapping subject_ids to a list of annotations (dicts)
+    """
+    subject_annotations = dict()
+    header, rows = read_header_and_rows(annotations_path)
+    for line_no, line in enumerate(rows):
+        # print status
+        if ((line_no % 10000) == 0) and (line_no > 0):
+            print("Imported {:,} annotations".format(line_no))
+        # convert to dict
+        line_dict = {header[i]: x for i, x in enumerate(line)}
+        if line_dict['subject_id'] not in subject_annotations:
+            subject_annotations[line_dict['subject_id']] = list()
+        subject_annotations[line_dict['subject_id']].append(line_dict)
+    return subject_annotations
+
+
+def aggregate_annotations_file(
+        annotations_path,
+        questions,
+        question_type_map,
+        question_main_id,
+        engine='dict'):
+    """ Read and aggregate all annotations of a file
+        engine: 'dict' or 'vectorized'
+        Returns: list of records - one per subject and species
+    """
+    if engine == 'vectorized':
+        df_annotations = read_df(annotations_path)
+        logger.info("Imported {:,} annotations".format(
+            df_annotations.shape[0]))
+        if df_annotations.shape[0] == 0:
+            return list()
+        return aggregate_annotations_vectorized(
+            df_annotations,
+            questions,
+            question_type_map,
+            question_main_id).to_dict('records')
+    subject_annotations = read_subject_annotations(annotations_path)
+    return aggregate_annotations(
+        subject_annotations,
+        questions,
+        question_type_map,
+        question_main_id)
+
+
+def shard_annotations_by_subject(annotations_path, shard_dir, n_shards):
+    """ Split annotations into csv files (shards) by the hash of the
+        subject_id - all annotations of a subject are in the same shard
+        Returns: paths of the shards, subject_ids in the order first seen
+    """
+    header, rows = read_header_and_rows(annotations_path)
+    subject_id_col = header.index('subject_id')
+    shard_paths = [
+        os.path.join(shard_dir, 'shard_{}.csv'.format(i))
+        for i in range(n_shards)]
+    shard_files = [open(path, 'w') for path in shard_paths]
+    try:
+        csv_writers = [csv.writer(f, delimiter=',') for f in shard_files]
+        for csv_writer in csv_writers:
+            csv_writer.writerow(header)
+        subject_to_shard = dict()
+        for line_no, line in enumerate(rows):
+            # print status
+            if ((line_no % 10000) == 0) and (line_no > 0):
+                print("Sharded {:,} annotations".format(line_no))
+            subject_id = line[subject_id_col]
+            try:
+                shard = subject_to_shard[subject_id]
+            except KeyError:
+                shard = zlib.crc32(subject_id.encode('utf-8')) % n_shards
+                subject_to_shard[subject_id] = shard
+            csv_writers[shard].writerow(line)
+    finally:
+        for f in shard_files:
+            f.close()
+    return shard_paths, list(subject_to_shard.keys())
+
+
+def aggregate_annotations_sharded(
+        annotations_path,
+        questions,
+        question_type_map,
+        question_main_id,
+        n_processes,
+        engine='dict'):
+    """ Aggregate annotations in parallel: annotations are split into
+        shards by subject_id which are aggregated by separate processes
+        Returns: list of records in the same order as
+                 'aggregate_annotations_file'
+    """
+    n_shards = n_processes * SHARDS_PER_PROCESS
+    shard_dir = tempfile.mkdtemp(prefix='aggregate_annotations_')
+    try:
+        shard_paths, subject_ids = shard_annotations_by_subject(
+            annotations_path, shard_dir, n_shards)
+        logger.info("Split annotations of {:,} subjects into {} shards".format(
+            len(subject_ids), n_shards))
+        records_by_subject = defaultdict(list)
+        with Pool(n_processes) as pool:
+            shard_records = pool.imap_unordered(
+                partial(
+                    aggregate_annotations_file,
+                    questions=questions,
+                    question_type_map=question_type_map,
+                    question_main_id=question_main_id,
+                    engine=engine),
+                shard_paths)
+            for records in shard_records:
+                for record in records:
+                    records_by_subject[record['subject_id']].append(record)
+    finally:
+        shutil.rmtree(shard_dir)
+    # order by the first occurence of the subjects in the annotations
+    return [
+        record for subject_id in subject_ids
+        for record in records_by_subject[subject_id]]
+
+
 if __name__ == '__main__':
     # Parse command line arguments
     parser = argparse.ArgumentParser()
@@ -189,6 +592,17 @@ if __name__ == '__main__':
     parser.add_argument(
         "--export_consensus_only", action="store_true",
         help="Export only species with plurality consensus")
+    parser.add_argument(
+        "--engine", type=str, default='dict',
+        choices=['dict', 'vectorized'],
+        help="Aggregation engine: 'dict' aggregates each subject separately, \
+              'vectorized' aggregates all subjects at once using grouped \
+              DataFrame operations (much faster, identical output).")
+    parser.add_argument(
+        "--n_processes", type=int, default=1,
+        help="Number of processes to aggregate the annotations in parallel \
+              (default 1). Subjects are split into shards by the hash of \
+              their subject_id (identical output).")
     parser.add_argument(
         "--log_dir", type=str, default=None)
     parser.add_argument(
@@ -206,6 +620,11 @@ if __name__ == '__main__':
             "annotations: {} not found".format(
              args['annotations']))
 
+    if args['n_processes'] < 1:
+        raise ValueError(
+            "'n_processes' must be at least 1, is {}".format(
+             args['n_processes']))
+
     ######################################
     # Configuration
     ######################################
@@ -231,21 +650,8 @@ if __name__ == '__main__':
     # Import Annotations
     ######################################
 
-    # Read Annotations and associate with subject id
-    subject_annotations = dict()
-    with open(args['annotations'], "r") as ins:
-        csv_reader = csv.reader(ins, delimiter=',', quotechar='"')
-        header = next(csv_reader)
-        questions = [x for x in header if x.startswith(question_column_prefix)]
-        for line_no, line in enumerate(csv_reader):
-            # print status
-            if ((line_no % 10000) == 0) and (line_no > 0):
-                print("Imported {:,} annotations".format(line_no))
-            # convert to dict
-            line_dict = {header[i]: x for i, x in enumerate(line)}
-            if line_dict['subject_id'] not in subject_annotations:
-                subject_annotations[line_dict['subject_id']] = list()
-            subject_annotations[line_dict['subject_id']].append(line_dict)
+    header, _ = read_header_and_rows(args['annotations'])
+    questions = [x for x in header if x.startswith(question_column_prefix)]
 
     question_type_map = aggregator.create_question_type_map(
         questions, flags, flags_global)
@@ -254,32 +660,22 @@ if __name__ == '__main__':
     # Aggregate Annotations
     ######################################
 
-    subject_species_aggregations = dict()
-    for num, (subject_id, subject_data) in enumerate(subject_annotations.items()):
-        # print status
-        if ((num % 10000) == 0) and (num > 0):
-            print("Aggregated {:,} subjects".format(num))
-        record = aggregate_subject_annotations(
-                    subject_data,
-                    questions,
-                    question_type_map,
-                    question_main_id)
-        subject_species_aggregations[subject_id] = record
-
     # Create one record per identification
-    subject_identificatons = list()
-    for subject_id, subject_agg_data in subject_species_aggregations.items():
-        # export each species
-        for sp, species_dat in subject_agg_data['species_aggregations'].items():
-            species_is_plurality_consensus = \
-                int(sp in subject_agg_data['consensus_species'])
-            record = {
-                'subject_id': subject_id,
-                question_main_id: sp,
-                **species_dat,
-                **subject_agg_data['aggregation_info'],
-                'species_is_plurality_consensus': species_is_plurality_consensus}
-            subject_identificatons.append(record)
+    if args['n_processes'] > 1:
+        subject_identificatons = aggregate_annotations_sharded(
+            args['annotations'],
+            questions,
+            question_type_map,
+            question_main_id,
+            n_processes=args['n_processes'],
+            engine=args['engine'])
+    else:
+        subject_identificatons = aggregate_annotations_file(
+            args['annotations'],
+            questions,
+            question_type_map,
+            question_main_id,
+            engine=args['engine'])
 
     # extract all questions and order them by the original ordering
     questions_original = questions
@@ -364,7 +760,9 @@ if __name__ == '__main__':
     if args['export_consensus_only']:
         df_out = df_out[df_out['species_is_plurality_consensus'] == 1]
 
-    df_out.to_csv(args['output_csv'], index=False)
+    write_df(
+        df_out, args['output_csv'],
+        categorical_cols=flags_global['PARQUET_CATEGORICAL_COLUMNS'])
 
     logger.info("Wrote {} aggregations to {}".format(
         df_out.shape[0], args['output_csv']))
@@ -8,7 +8,7 @@ import os
 import argparse
 import math
 from statistics import median_high, StatisticsError
-from collections import defaultdict, OrderedDict
+from collections import Counter, defaultdict, OrderedDict
 import logging
 
 import pandas as pd
@@ -80,53 +80,63 @@ def calculate_pielou(votes_list):
     return sumplnp/lnS
 
 
-def aggregate_subject_annotations(
-        subject_data,
+def create_subject_stats():
+    """ Create counters to aggregate the annotations of a subject """
+    return {
+        'species_votes': OrderedCounter(),
+        'classification_ids': set(),
+        'users': set(),
+        'user_species_ids': OrderedCounter(),
+        'species_stats': dict()}
+
+
+def update_subject_stats(subject_stats, anno_dict, question_main_id):
+    """ Add an annotation to the counters of a subject """
+    species = anno_dict[question_main_id]
+    subject_stats['species_votes'].update({species})
+    subject_stats['classification_ids'].add(anno_dict['classification_id'])
+    subject_stats['users'].add(anno_dict['user_name'])
+    # store species only answers
+    if species != flags_global['QUESTION_MAIN_EMPTY']:
+        subject_stats['user_species_ids'].update({anno_dict['user_name']})
+    if species not in subject_stats['species_stats']:
+        subject_stats['species_stats'][species] = defaultdict(Counter)
+    for k, v in anno_dict.items():
+        subject_stats['species_stats'][species][k].update({v})
+
+
+def aggregate_subject_stats(
+        subject_stats,
         questions,
-        question_type_map,
-        question_main_id):
-    """ Aggregate subject annotations """
-    # initialize Counter objects
-    stat_all = defaultdict(OrderedCounter)
-    stat_species_only = defaultdict(OrderedCounter)
-    # extract and add annotations to stats counters
-    for anno_dict in subject_data:
-        for k, v in anno_dict.items():
-            stat_all[k].update({v})
-        # store species only answers
-        main_answer = anno_dict[question_main_id]
-        if main_answer != flags_global['QUESTION_MAIN_EMPTY']:
-            for k, v in anno_dict.items():
-                stat_species_only[k].update({v})
+        question_type_map):
+    """ Aggregate the counters of a subject """
+    user_species_ids = subject_stats['user_species_ids']
     # median number of species identifications per user
     # if nobody ids a species, set this to 0
     try:
         n_species_ids_per_user_median = int(
-            median_high(stat_species_only['user_name'].values()))
+            median_high(user_species_ids.values()))
     except StatisticsError:
         n_species_ids_per_user_median = 0
     # get the max number of species identified by any user
     try:
         n_species_ids_per_user_max = int(
-            max(stat_species_only['user_name'].values()))
+            max(user_species_ids.values()))
     except ValueError:
         n_species_ids_per_user_max = 0
     # Calculate some statistics
-    n_subject_classifications = len(stat_all['classification_id'])
-    n_subject_users = len(stat_all['user_name'])
-    n_users_id_species = len(stat_species_only['user_name'])
+    n_subject_classifications = len(subject_stats['classification_ids'])
+    n_subject_users = len(subject_stats['users'])
+    n_users_id_species = len(user_species_ids)
     n_users_id_empty = n_subject_users - n_users_id_species
     p_users_id_species = n_users_id_species / n_subject_users
     # order species by frequency of identifications
     # ties are ordered arbitrarily
     # (according to which species was detected first)
-    species_by_frequency = stat_all[question_main_id].most_common()
+    species_by_frequency = subject_stats['species_votes'].most_common()
     species_names_by_frequency = [x[0] for x in species_by_frequency]
-    # calc stats for all species
-    species_stats = aggregator.stats_for_species(
-            species_names_by_frequency, subject_data,
-            species_field=question_main_id
-            )
+    # stats for all species
+    species_stats = subject_stats['species_stats']
     # define empty capture if more volunteers saw nothing
     # than saw something
     is_empty = n_users_id_empty > n_users_id_species
@@ -170,6 +180,101 @@ def aggregate_subject_annotations(
     return record
 
 
+def aggregate_subject_annotations(
+        subject_data,
+        questions,
+        question_type_map,
+        question_main_id):
+    """ Aggregate subject annotations """
+    subject_stats = create_subject_stats()
+    for anno_dict in subject_data:
+        update_subject_stats(subject_stats, anno_dict, question_main_id)
+    return aggregate_subject_stats(
+        subject_stats, questions, question_type_map)
+
+
+def extract_first_n_users_annotations(subject_data, n_users=2):
+    """ Extract annotations of first n users for a subject """
+    users = OrderedDict([(x['user_name'], 0) for x in subject_data])
+    n_users_real = len(users)
+    users_to_extract = set(list(users)[0:min(n_users, n_users_real)])
+    subject_data_selected = list()
+    for annotation in subject_data:
+        if annotation['user_name'] in users_to_extract:
+            subject_data_selected.append(annotation)
+    return subject_data_selected
+
+
+def group_annotations_by_user(subject_data):
+    """ Group annotations by user in the order the users were first seen
+        Returns: list of lists of annotations or None if the annotations
+                 of a user are not contiguous
+    """
+    annotations_by_user = list()
+    users_seen = set()
+    for anno_dict in subject_data:
+        user_name = anno_dict['user_name']
+        if user_name not in users_seen:
+            users_seen.add(user_name)
+            annotations_by_user.append([anno_dict])
+        elif annotations_by_user[-1][0]['user_name'] == user_name:
+            annotations_by_user[-1].append(anno_dict)
+        else:
+            return None
+    return annotations_by_user
+
+
+def aggregate_subject_annotations_first_n_users(
+        subject_data,
+        n_users_to_use,
+        questions,
+        question_type_map,
+        question_main_id):
+    """ Aggregate the annotations of the first N users of a subject for
+        each N in n_users_to_use
+        - one pass over the annotations: the counters are updated user by
+          user and aggregated whenever N users were added
+        - if the annotations of a user are not contiguous the annotations
+          of the first N users are aggregated separately for each N
+        Returns: list of records (one per element in n_users_to_use)
+    """
+    annotations_by_user = group_annotations_by_user(subject_data)
+    records = dict()
+    if annotations_by_user is None:
+        for n_users in set(n_users_to_use):
+            subject_data_select = extract_first_n_users_annotations(
+                subject_data, n_users=n_users)
+            records[n_users] = aggregate_subject_annotations(
+                subject_data_select,
+                questions,
+                question_type_map,
+                question_main_id)
+    else:
+        subject_stats = create_subject_stats()
+        n_users_added = 0
+        record = None
+        for n_users in sorted(set(n_users_to_use)):
+            # re-use the previous aggregation if no users were added
+            if record is not None and n_users_added == len(annotations_by_user):
+                records[n_users] = dict(
+                    record, aggregation_info=dict(record['aggregation_info']))
+                continue
+            while n_users_added < min(n_users, len(annotations_by_user)):
+                for anno_dict in annotations_by_user[n_users_added]:
+                    update_subject_stats(
+                        subject_stats, anno_dict, question_main_id)
+                n_users_added += 1
+            record = aggregate_subject_stats(
+                subject_stats, questions, question_type_map)
+            records[n_users] = record
+    subject_records = list()
+    for n_users in n_users_to_use:
+        record = records[n_users]
+        record['aggregation_info']['max_users_used'] = n_users
+        subject_records.append(record)
+    return subject_records
+
+
 if __name__ == '__main__':
     # Parse command line arguments
     parser = argparse.ArgumentParser()
@@ -251,34 +356,18 @@ if __name__ == '__main__':
     # Aggregate Annotations
     ######################################
 
-    def extract_first_n_users_annotations(subject_data, n_users=2):
-        """ Extract annotations of first n users for a subject """
-        users = OrderedDict([(x['user_name'], 0) for x in subject_data])
-        n_users_real = len(users)
-        users_to_extract = set(list(users)[0:min(n_users, n_users_real)])
-        subject_data_selected = list()
-        for annotation in subject_data:
-            if annotation['user_name'] in users_to_extract:
-                subject_data_selected.append(annotation)
-        return subject_data_selected
-
     subject_species_aggregations = dict()
     for num, (subject_id, subject_data) in enumerate(subject_annotations.items()):
         # print status
         if ((num % 10000) == 0) and (num > 0):
             print("Aggregated {:,} subjects".format(num))
         # gradually select more users
-        records = list()
-        for n_users_to_extract in args['n_users_to_use']:
-            subject_data_select = extract_first_n_users_annotations(
-                subject_data, n_users=n_users_to_extract)
-            record = aggregate_subject_annotations(
-                        subject_data_select,
-                        questions,
-                        question_type_map,
-                        question_main_id)
-            record['aggregation_info']['max_users_used'] = n_users_to_extract
-            records.append(record)
+        records = aggregate_subject_annotations_first_n_users(
+            subject_data,
+            args['n_users_to_use'],
+            questions,
+            question_type_map,
+            question_main_id)
         subject_species_aggregations[subject_id] = records
 
     # Create one record per identification
@@ -301,10 +390,8 @@ if __name__ == '__main__':
     questions_original = questions
     questions_found = set()
     for row in subject_identificatons:
-        row_questions = list(row.keys())
-        questions_found = questions_found.union(
-            {x for x in row_questions
-             if x.startswith(question_column_prefix)})
+        questions_found.update(
+            [x for x in row.keys() if x.startswith(question_column_prefix)])
     questions = list(questions_found)
     questions = sorted(
         questions,
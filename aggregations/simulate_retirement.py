@@ -0,0 +1,445 @@
+""" Simulate the Effect of Retirement Limits on the Plurality Algorithm
+    - draws random user orderings (or bootstrap resamples of users) for
+      each subject and determines the plurality consensus of the first N
+      users of each replicate
+    - reports how often the consensus species (and the median count of the
+      consensus species) differs from the consensus of all annotations,
+      per N and per (reference) consensus species
+"""
+import os
+import argparse
+import random
+import math
+from statistics import median_high, StatisticsError, NormalDist
+from collections import Counter, defaultdict, OrderedDict
+from functools import partial
+from multiprocessing import Pool
+import logging
+
+import pandas as pd
+
+from utils.logger import set_logging
+from config.cfg import cfg
+from aggregations import aggregator
+from aggregations.aggregate_plurality_sim import calculate_pielou
+from utils.utils import (
+    print_nested_dict, set_file_permission, OrderedCounter,
+    read_header_and_rows)
+
+
+flags = cfg['plurality_aggregation_flags']
+flags_global = cfg['global_processing_flags']
+
+logger = logging.getLogger(__name__)
+
+
+def create_consensus_stats():
+    """ Create the counters required to determine the plurality consensus """
+    return {
+        'species_votes': OrderedCounter(),
+        'users': set(),
+        'user_species_ids': Counter(),
+        'species_classifications': defaultdict(set),
+        'species_counts': defaultdict(Counter)}
+
+
+def update_consensus_stats(consensus_stats, user_name, annotations):
+    """ Add the annotations of a user to the counters
+        annotations: list of (species, classification_id, count) tuples
+    """
+    empty_answer = flags_global['QUESTION_MAIN_EMPTY']
+    consensus_stats['users'].add(user_name)
+    for species, classification_id, count in annotations:
+        consensus_stats['species_votes'][species] += 1
+        if species != empty_answer:
+            consensus_stats['user_species_ids'][user_name] += 1
+        consensus_stats['species_classifications'][species].add(
+            classification_id)
+        consensus_stats['species_counts'][species][count] += 1
+
+
+def determine_consensus(consensus_stats):
+    """ Determine the plurality consensus (same logic as
+        'aggregate_subject_annotations')
+        Returns: tuple of consensus species, tuple of the median counts
+                 of the consensus species, pielou evenness index
+    """
+    empty_answer = flags_global['QUESTION_MAIN_EMPTY']
+    user_species_ids = consensus_stats['user_species_ids']
+    try:
+        n_species_ids_per_user_median = int(
+            median_high(user_species_ids.values()))
+    except StatisticsError:
+        n_species_ids_per_user_median = 0
+    n_users_id_species = len(user_species_ids)
+    n_users_id_empty = len(consensus_stats['users']) - n_users_id_species
+    if n_users_id_empty > n_users_id_species:
+        return (empty_answer, ), ('', ), 0
+    species_names_no_empty = [
+        x[0] for x in consensus_stats['species_votes'].most_common()
+        if x[0] != empty_answer]
+    pielou = calculate_pielou(
+        [len(consensus_stats['species_classifications'][x])
+         for x in species_names_no_empty])
+    consensus_species = tuple(
+        species_names_no_empty[0:n_species_ids_per_user_median])
+    consensus_counts = tuple(
+        aggregator.count_aggregator(
+            consensus_stats['species_counts'][x], flags, mode='median')
+        for x in consensus_species)
+    return consensus_species, consensus_counts, pielou
+
+
+def group_user_annotations(subject_annotations):
+    """ Group annotations by user in the order the users were first seen
+        Returns: list of (user_name, annotations) tuples
+    """
+    user_annotations = OrderedDict()
+    for user_name, annotation in subject_annotations:
+        if user_name not in user_annotations:
+            user_annotations[user_name] = list()
+        user_annotations[user_name].append(annotation)
+    return list(user_annotations.items())
+
+
+def consensus_of_first_n_users(users, n_users_to_use):
+    """ Determine the consensus of the first N users for each N
+        users: list of (user_name, annotations) tuples
+        n_users_to_use: sorted list of N
+        Returns: list of consensus results (one per N)
+    """
+    consensus_stats = create_consensus_stats()
+    results = list()
+    n_users_added = 0
+    for n_users in n_users_to_use:
+        if n_users_added == len(users) and len(results) > 0:
+            results.append(results[-1])
+            continue
+        while n_users_added < min(n_users, len(users)):
+            update_consensus_stats(consensus_stats, *users[n_users_added])
+            n_users_added += 1
+        results.append(determine_consensus(consensus_stats))
+    return results
+
+
+def draw_replicate(users, rng, mode):
+    """ Draw a random ordering / bootstrap resample of the users """
+    if mode == 'permutation':
+        replicate = list(users)
+        rng.shuffle(replicate)
+        return replicate
+    elif mode == 'bootstrap':
+        # users drawn multiple times are treated as different users
+        replicate = list()
+        for i in range(len(users)):
+            user_name, annotations = users[rng.randrange(len(users))]
+            replicate.append((
+                '{}#{}'.format(user_name, i),
+                [(species, '{}#{}'.format(classification_id, i), count)
+                 for species, classification_id, count in annotations]))
+        return replicate
+    else:
+        raise ValueError("mode {} not allowed".format(mode))
+
+
+def simulate_subject(
+        subject, n_users_to_use, n_replicates, mode, seed):
+    """ Simulate the consensus of the first N users for random replicates
+        of a subject - the random number generator is seeded per subject
+        such that the results do not depend on the order / the process
+        subject: (subject_id, list of (user_name, annotation) tuples)
+        Returns: dict with the reference consensus and the simulation
+                 results per N
+    """
+    subject_id, subject_annotations = subject
+    users = group_user_annotations(subject_annotations)
+    # reference: consensus of all users
+    reference_species, reference_counts, _ = consensus_of_first_n_users(
+        users, [len(users)])[0]
+    reference_counts = dict(zip(reference_species, reference_counts))
+    rng = random.Random('{}#{}'.format(seed, subject_id))
+    n_consensus_flips = [0] * len(n_users_to_use)
+    n_count_flips = [0] * len(n_users_to_use)
+    pielou_sum = [0.0] * len(n_users_to_use)
+    reference_set = set(reference_species)
+    for _ in range(n_replicates):
+        replicate = draw_replicate(users, rng, mode)
+        results = consensus_of_first_n_users(replicate, n_users_to_use)
+        for i, (species, counts, pielou) in enumerate(results):
+            if set(species) != reference_set:
+                n_consensus_flips[i] += 1
+            elif dict(zip(species, counts)) != reference_counts:
+                n_count_flips[i] += 1
+            pielou_sum[i] += pielou
+    return {
+        'subject_id': subject_id,
+        'n_users': len(users),
+        'reference_consensus': reference_species,
+        'n_consensus_flips': n_consensus_flips,
+        'n_count_flips': n_count_flips,
+        'pielou_sum': pielou_sum}
+
+
+def read_subject_annotations(path, question_main_id, question_count_id=None):
+    """ Read annotations and group them by subject
+        Returns: dict with subject_id: list of
+                 (user_name, (species, classification_id, count)) tuples
+    """
+    header, rows = read_header_and_rows(path)
+    subject_index = header.index('subject_id')
+    user_index = header.index('user_name')
+    classification_index = header.index('classification_id')
+    species_index = header.index(question_main_id)
+    count_index = None
+    if question_count_id is not None:
+        count_index = header.index(question_count_id)
+    subject_annotations = dict()
+    for line_no, row in enumerate(rows):
+        if ((line_no % 100000) == 0) and (line_no > 0):
+            print("Imported {:,} annotations".format(line_no))
+        count = row[count_index] if count_index is not None else ''
+        annotation = (
+            row[species_index], row[classification_index], count)
+        subject_id = row[subject_index]
+        if subject_id not in subject_annotations:
+            subject_annotations[subject_id] = list()
+        subject_annotations[subject_id].append((row[user_index], annotation))
+    return subject_annotations
+
+
+def simulate_subjects(
+        subject_annotations, n_users_to_use, n_replicates,
+        mode='permutation', seed=0, n_processes=1):
+    """ Simulate all subjects, in parallel if n_processes > 1
+        Returns: list of simulation results (ordered as the subjects)
+    """
+    simulator = partial(
+        simulate_subject,
+        n_users_to_use=sorted(set(n_users_to_use)),
+        n_replicates=n_replicates, mode=mode, seed=seed)
+    subjects = list(subject_annotations.items())
+    subject_results = list()
+    if n_processes > 1:
+        chunksize = max(1, len(subjects) // (n_processes * 16))
+        with Pool(processes=n_processes) as pool:
+            for subject_result in pool.imap(
+                    simulator, subjects, chunksize=chunksize):
+                subject_results.append(subject_result)
+                if (len(subject_results) % 1000) == 0:
+                    print("Simulated {:,} subjects".format(
+                        len(subject_results)))
+    else:
+        for subject in subjects:
+            subject_results.append(simulator(subject))
+            if (len(subject_results) % 1000) == 0:
+                print("Simulated {:,} subjects".format(len(subject_results)))
+    return subject_results
+
+
+def _mean_confidence_interval(values, z):
+    """ Mean and normal approximation confidence interval """
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, mean, mean
+    sd = math.sqrt(sum((x - mean) ** 2 for x in values) / (n - 1))
+    half_width = z * sd / math.sqrt(n)
+    return mean, max(0.0, mean - half_width), min(1.0, mean + half_width)
+
+
+def summarize_simulations(
+        subject_results, n_users_to_use, n_replicates, confidence=0.95):
+    """ Summarize the simulations per N, for all subjects and
+        per consensus species (of all users)
+        - confidence intervals are based on the variation of the
+          flip proportions between subjects
+        Returns: list of dicts (one per group and N)
+    """
+    n_users_to_use = sorted(set(n_users_to_use))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    groups = OrderedDict([('all', list())])
+    for subject_result in subject_results:
+        groups['all'].append(subject_result)
+        for species in sorted(subject_result['reference_consensus']):
+            groups.setdefault(species, list()).append(subject_result)
+    summary = list()
+    for group, group_results in groups.items():
+        for i, n_users in enumerate(n_users_to_use):
+            p_consensus_flip, ci_low, ci_high = _mean_confidence_interval(
+                [x['n_consensus_flips'][i] / n_replicates
+                 for x in group_results], z)
+            p_count_flip = sum(
+                x['n_count_flips'][i] for x in group_results) / \
+                (n_replicates * len(group_results))
+            pielou_mean = sum(
+                x['pielou_sum'][i] for x in group_results) / \
+                (n_replicates * len(group_results))
+            summary.append(OrderedDict([
+                ('consensus_species', group),
+                ('max_users_used', n_users),
+                ('n_subjects', len(group_results)),
+                ('n_replicates', n_replicates),
+                ('p_consensus_flip', '{:.4f}'.format(p_consensus_flip)),
+                ('p_consensus_flip_ci_low', '{:.4f}'.format(ci_low)),
+                ('p_consensus_flip_ci_high', '{:.4f}'.format(ci_high)),
+                ('p_count_flip', '{:.4f}'.format(p_count_flip)),
+                ('pielous_evenness_index_mean',
+                 '{:.2f}'.format(pielou_mean))]))
+    return summary
+
+
+def subject_simulation_records(subject_results, n_users_to_use, n_replicates):
+    """ Create one record per subject and N """
+    n_users_to_use = sorted(set(n_users_to_use))
+    records = list()
+    for subject_result in subject_results:
+        for i, n_users in enumerate(n_users_to_use):
+            records.append(OrderedDict([
+                ('subject_id', subject_result['subject_id']),
+                ('n_users_classified_this_subject', subject_result['n_users']),
+                ('consensus_species',
+                 '|'.join(subject_result['reference_consensus'])),
+                ('max_users_used', n_users),
+                ('p_consensus_flip', '{:.4f}'.format(
+                    subject_result['n_consensus_flips'][i] / n_replicates)),
+                ('p_count_flip', '{:.4f}'.format(
+                    subject_result['n_count_flips'][i] / n_replicates)),
+                ('pielous_evenness_index_mean', '{:.2f}'.format(
+                    subject_result['pielou_sum'][i] / n_replicates))]))
+    return records
+
+
+if __name__ == '__main__':
+    # Parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--annotations", type=str, required=True,
+        help="Path to extracted annotations (csv or parquet)")
+    parser.add_argument(
+        "--output_csv", type=str, required=True,
+        help="Path to file to store the simulation summary.")
+    parser.add_argument(
+        "--subject_output_csv", type=str, default=None,
+        help="Path to file to store the simulation results per subject \
+              (optional).")
+    parser.add_argument(
+        "--n_users_to_use", nargs='+', type=int,
+        default=[1, 2, 3, 5, 10, 15, 20, 99],
+        help="Numbers of users (N) to simulate.")
+    parser.add_argument(
+        "--n_replicates", type=int, default=1000,
+        help="Number of random replicates per subject.")
+    parser.add_argument(
+        "--mode", type=str, default='permutation',
+        choices=['permutation', 'bootstrap'],
+        help="permutation: random orderings of the users, \
+              bootstrap: resample users with replacement")
+    parser.add_argument(
+        "--seed", type=int, default=123,
+        help="Random seed (combined with the subject_id per subject)")
+    parser.add_argument(
+        "--confidence", type=float, default=0.95,
+        help="Confidence level of the confidence intervals")
+    parser.add_argument(
+        "--n_processes", type=int, default=1,
+        help="Number of processes to simulate subjects in parallel")
+    parser.add_argument(
+        "--log_dir", type=str, default=None)
+    parser.add_argument(
+        "--log_filename", type=str,
+        default='simulate_retirement')
+
+    args = vars(parser.parse_args())
+
+    ######################################
+    # Check Input
+    ######################################
+
+    if not os.path.isfile(args['annotations']):
+        raise FileNotFoundError(
+            "annotations: {} not found".format(
+             args['annotations']))
+
+    ######################################
+    # Configuration
+    ######################################
+
+    # logging
+    set_logging(args['log_dir'], args['log_filename'])
+
+    logger = logging.getLogger(__name__)
+
+    for k, v in args.items():
+        logger.info("Argument {}: {}".format(k, v))
+
+    # logging flags
+    print_nested_dict('', flags)
+
+    question_main_id = flags_global['QUESTION_DELIMITER'].join(
+        [flags_global['QUESTION_PREFIX'], flags_global['QUESTION_MAIN']])
+    question_column_prefix = '{}{}'.format(
+        flags_global['QUESTION_PREFIX'],
+        flags_global['QUESTION_DELIMITER'])
+
+    # determine the count question (if any)
+    header, _ = read_header_and_rows(args['annotations'])
+    questions = [x for x in header if x.startswith(question_column_prefix)]
+    question_type_map = aggregator.create_question_type_map(
+        questions, flags, flags_global)
+    count_questions = [
+        x for x in questions if question_type_map[x] == 'count']
+    question_count_id = count_questions[0] if count_questions else None
+    logger.info("Using question {} to determine count flips".format(
+        question_count_id))
+
+    ######################################
+    # Import Annotations
+    ######################################
+
+    subject_annotations = read_subject_annotations(
+        args['annotations'], question_main_id, question_count_id)
+
+    logger.info("Imported annotations of {} subjects".format(
+        len(subject_annotations)))
+
+    ######################################
+    # Simulate
+    ######################################
+
+    subject_results = simulate_subjects(
+        subject_annotations,
+        args['n_users_to_use'],
+        args['n_replicates'],
+        mode=args['mode'],
+        seed=args['seed'],
+        n_processes=args['n_processes'])
+
+    ######################################
+    # Export to CSV
+    ######################################
+
+    summary = summarize_simulations(
+        subject_results, args['n_users_to_use'],
+        args['n_replicates'], args['confidence'])
+
+    df_out = pd.DataFrame(summary)
+    df_out.to_csv(args['output_csv'], index=False)
+    set_file_permission(args['output_csv'])
+
+    logger.info("Wrote {} records to {}".format(
+        df_out.shape[0], args['output_csv']))
+
+    for row in summary:
+        if row['consensus_species'] == 'all':
+            logger.info(
+                "N={max_users_used}: p_consensus_flip {p_consensus_flip} "
+                "({p_consensus_flip_ci_low}-{p_consensus_flip_ci_high}) "
+                "p_count_flip {p_count_flip}".format(**row))
+
+    if args['subject_output_csv'] is not None:
+        df_subjects = pd.DataFrame(subject_simulation_records(
+            subject_results, args['n_users_to_use'], args['n_replicates']))
+        df_subjects.to_csv(args['subject_output_csv'], index=False)
+        set_file_permission(args['subject_output_csv'])
+        logger.info("Wrote {} records to {}".format(
+            df_subjects.shape[0], args['subject_output_csv']))
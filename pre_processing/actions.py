@@ -2,8 +2,11 @@
 import logging
 import os
 from collections import namedtuple
+from collections.abc import Mapping
 from datetime import datetime, timedelta
 
+import pandas as pd
+
 logger = logging.getLogger(__name__)
 
 # Format of an Action
@@ -11,21 +14,29 @@ Action = namedtuple(
     'Action',
     ['image', 'action', 'reason', 'shift_time_by_seconds'])
 
+# Columns of the audit trail of applied actions
+AUDIT_COLUMNS = [
+    'image', 'action', 'reason', 'column', 'old_value', 'new_value']
+
 
 def _concat_string(old, new):
     """ Concatenate by # """
     return '#'.join(old.split('#') + [new])
 
 
+def _to_action(action_dict):
+    """ Convert to Action """
+    if isinstance(action_dict, Mapping):
+        return Action(**action_dict)
+    elif isinstance(action_dict, Action):
+        return action_dict
+    raise ValueError("action_dict has wrong type: {}".format(
+        type(action_dict)))
+
+
 def apply_action(image_data, action_dict, flags):
     """ apply an action to an image """
-    if isinstance(action_dict, dict):
-        action = Action(**action_dict)
-    elif isinstance(action_dict, Action):
-        action = action_dict
-    else:
-        raise ValueError("action_dict has wrong type: {}".format(
-            type(action_dict)))
+    action = _to_action(action_dict)
     # create empty flags
     for flag in flags['image_flags_to_create']:
         if flag not in image_data:
@@ -56,9 +67,11 @@ def _delete(image_data, action):
         os.remove(image_path)
         logger.info("Reason: {:20} Action: deleted image: {}".format(
             action.reason, image_path))
+        return True
     except FileNotFoundError:
         logger.warning(
             "Failed to remove {} - file not found".format(image_path))
+        return False
 
 
 def _change_time(image_data, action, flags):
@@ -93,3 +106,114 @@ def _create_flag(image_data, action, flags):
                 action.reason,
                 flag_col
                 ))
+
+
+def _shift_times(date_times, seconds_to_add, format):
+    """ Add seconds to (formatted) times of multiple images - invalid
+        (e.g. empty) times raise a ValueError as in '_change_time'
+    """
+    try:
+        from_times = pd.to_datetime(
+            pd.Series(date_times, dtype=object), format=format)
+        # empty times are parsed as NaT
+        if not from_times.isna().any():
+            shifted_times = from_times + pd.to_timedelta(
+                pd.Series(seconds_to_add, dtype=float), unit='s')
+            return shifted_times.dt.strftime(format).tolist()
+    except (ValueError, OverflowError):
+        pass
+    # invalid times (raise) or times pandas can't represent
+    return [
+        _add_seconds_to_time(x, s, format).strftime(format)
+        for x, s in zip(date_times, seconds_to_add)]
+
+
+def apply_actions_batch(captures, actions, flags):
+    """ Apply all actions at once - actions are grouped by type and
+        applied column-wise (same result as 'apply_action' for each
+        action in turn)
+        captures: ImageInventory (keys: image names)
+        actions: Actions / action dicts
+        Returns: audit trail - list of tuples (AUDIT_COLUMNS)
+    """
+    actions = [_to_action(x) for x in actions]
+    audit = list()
+    actions_by_type = dict()
+    actions_by_image = dict()
+    for action in actions:
+        if action.image not in captures:
+            raise KeyError(action.image)
+        actions_by_type.setdefault(action.action, list()).append(action)
+        actions_by_image.setdefault(action.image, list()).append(action)
+    images = list(actions_by_image.keys())
+    # create empty flags
+    for flag in flags['image_flags_to_create']:
+        values = captures.get_values(flag, images, default=None)
+        missing = [image for image, x in zip(images, values) if x is None]
+        captures.set_values(flag, missing, [''] * len(missing))
+    # delete images
+    for action in actions_by_type.get('delete', list()):
+        deleted = _delete(captures[action.image], action)
+        audit.append((
+            action.image, action.action, action.reason, '',
+            captures[action.image]['image_path'],
+            'deleted' if deleted else 'not found'))
+    # shift times - the n-th shifts of all images are applied together
+    # (in order, the time is formatted after each shift)
+    if 'timechange' in actions_by_type:
+        time_format = flags['time_formats']['output_datetime_format']
+        shift_rounds = list()
+        n_shifts = dict()
+        for action in actions_by_type['timechange']:
+            shift_round = n_shifts.get(action.image, 0)
+            n_shifts[action.image] = shift_round + 1
+            if shift_round == len(shift_rounds):
+                shift_rounds.append(list())
+            shift_rounds[shift_round].append(action)
+        for round_actions in shift_rounds:
+            shift_images = [x.image for x in round_actions]
+            old_times = captures.get_values(
+                'datetime', shift_images, default=None)
+            if None in old_times:
+                raise KeyError('datetime')
+            new_times = _shift_times(
+                old_times, [x.shift_time_by_seconds for x in round_actions],
+                time_format)
+            captures.set_values('datetime', shift_images, new_times)
+            for action, old_time, new_time in zip(
+                    round_actions, old_times, new_times):
+                logger.info(
+                    "Changed datetime for image {} from {} to {}".format(
+                        action.image, old_time, new_time))
+                audit.append((
+                    action.image, action.action, action.reason, 'datetime',
+                    old_time, new_time))
+    # set flags
+    for action_type, type_actions in actions_by_type.items():
+        if action_type not in flags['map_actions_to_flags']:
+            continue
+        type_images = [x.image for x in type_actions]
+        for flag_col in flags['map_actions_to_flags'][action_type]:
+            old_values = captures.get_values(flag_col, type_images)
+            captures.set_values(
+                flag_col, type_images, ['1'] * len(type_images))
+            for action, old_value in zip(type_actions, old_values):
+                logger.info(
+                    "Image: {:20} - Reason: {:15} - Action set: {} to '1'"
+                    .format(action.image, action.reason, flag_col))
+                audit.append((
+                    action.image, action.action, action.reason, flag_col,
+                    old_value, '1'))
+    # add actions taken
+    for column, field in [
+            ('action_taken', 'action'), ('action_taken_reason', 'reason')]:
+        old_values = captures.get_values(column, images, default=None)
+        new_values = list()
+        for image, old_value in zip(images, old_values):
+            taken = '#'.join([
+                getattr(x, field) for x in actions_by_image[image]])
+            if old_value is not None:
+                taken = '{}#{}'.format(old_value, taken)
+            new_values.append(taken)
+        captures.set_values(column, images, new_values)
+    return audit
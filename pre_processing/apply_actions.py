@@ -3,10 +3,14 @@ import os
 import argparse
 import logging
 
+import pandas as pd
+
 from utils.logger import set_logging
 from pre_processing.utils import read_image_inventory, export_inventory_to_csv
-from pre_processing.actions import apply_action
+from pre_processing.actions import (
+    apply_action, apply_actions_batch, AUDIT_COLUMNS)
 from config.cfg import cfg
+from utils.utils import set_file_permission
 
 # args = dict()
 # args['actions_to_perform'] = '/home/packerc/shared/season_captures/MAD/captures/MAD_S1_actions_to_perform.csv'
@@ -21,6 +25,17 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--actions_to_perform", type=str, required=True)
     parser.add_argument("--captures", type=str, required=True)
+    parser.add_argument(
+        "--engine", type=str, default='per_action',
+        choices=['per_action', 'batch'],
+        help="Engine to apply actions: 'per_action' applies one action \
+              after the other, 'batch' groups actions by type and \
+              updates the captures column-wise (identical output)")
+    parser.add_argument(
+        "--audit_csv", type=str, default=None,
+        help="Path to export the changes made by the actions to \
+              (batch engine only, default: \
+              <captures>_actions_audit.csv)")
     parser.add_argument("--log_dir", type=str, default=None)
     parser.add_argument(
         "--log_filename", type=str, default='apply_actions')
@@ -49,13 +64,27 @@ if __name__ == '__main__':
     captures = read_image_inventory(
         args['captures'], unique_id='image_name')
 
+    audit = None
     try:
-        for _id, action in actions.items():
-            apply_action(captures[action['image']], action, flags)
+        if args['engine'] == 'batch':
+            audit = apply_actions_batch(captures, actions.values(), flags)
+        else:
+            for _id, action in actions.items():
+                apply_action(captures[action['image']], action, flags)
         logger.info("Successfully applied actions")
     except Exception as e:
         logger.error("Failed to apply actions", exc_info=True)
 
+    if audit is not None:
+        if args['audit_csv'] is None:
+            args['audit_csv'] = '{}_actions_audit.csv'.format(
+                os.path.splitext(args['captures'])[0])
+        df = pd.DataFrame(audit, columns=AUDIT_COLUMNS)
+        df.to_csv(args['audit_csv'], index=False)
+        set_file_permission(args['audit_csv'])
+        logger.info("Exported {} changes to {}".format(
+            df.shape[0], args['audit_csv']))
+
     export_inventory_to_csv(captures, args['captures'])
 
     logger.info("Updated captures file at: {}".format(args['captures']))
@@ -3,24 +3,27 @@ import os
 import argparse
 import logging
 import time
+import random
 import numpy as np
-import copy
-import traceback
-from multiprocessing import Process, Manager
+from functools import partial
+from multiprocessing import Pool
 from PIL import Image
 
 from utils.logger import set_logging
 from pre_processing.utils import (
-    datetime_file_creation, image_check_stats, p_pixels_above_threshold,
-    p_pixels_below_threshold, export_inventory_to_csv, read_image_inventory,
+    datetime_file_creation, image_check_stats,
+    p_pixels_below_and_above_threshold,
+    export_inventory_to_csv, read_image_inventory,
     convert_ctime_to_datetime, convert_datetime_utc_to_timezone)
-from utils.utils import (
-    slice_generator, estimate_remaining_time)
+from utils.utils import estimate_remaining_time
+from pre_processing.scan_season_directory import get_scan_records
 from config.cfg import cfg
 
 
 flags = cfg['pre_processing_flags']
 
+logger = logging.getLogger(__name__)
+
 # args = dict()
 # args['root_dir'] = '/home/packerc/shared/albums/ENO/ENO_S1'
 # args['output_csv'] = '/home/packerc/shared/season_captures/ENO/ENO_S1_captures_raw.csv'
@@ -29,24 +32,157 @@ flags = cfg['pre_processing_flags']
 # args['n_processes'] = 16
 
 
-def _image_is_black(pixel_data, flags):
-    black_percent = \
-        flags['image_check_parameters']['all_black']['percent']
-    black_thresh = \
-        flags['image_check_parameters']['all_black']['thresh']
-    p_pixels_black = p_pixels_below_threshold(
-        pixel_data, black_thresh)
-    return (p_pixels_black > black_percent)
+def uniform_pixel_shares(img, scale=1):
+    """ Calculate the share of black and white pixels of an image -
+        JPEGs are decoded at reduced resolution (1/scale) if scale > 1
+    """
+    if scale > 1:
+        img.draft('RGB', (img.size[0] // scale, img.size[1] // scale))
+    pixel_data = np.asarray(img)
+    return p_pixels_below_and_above_threshold(
+        pixel_data,
+        flags['image_check_parameters']['all_black']['thresh'],
+        flags['image_check_parameters']['all_white']['thresh'])
+
+
+def _uniform_image_checks(p_pixels_black, p_pixels_white):
+    """ Determine failed all_black / all_white checks """
+    failed_checks = list()
+    if p_pixels_black > \
+            flags['image_check_parameters']['all_black']['percent']:
+        failed_checks.append('all_black')
+    if p_pixels_white > \
+            flags['image_check_parameters']['all_white']['percent']:
+        failed_checks.append('all_white')
+    return failed_checks
+
 
+def compare_check_scales(image_paths, scale):
+    """ Compare uniform pixel shares of reduced and full resolution
+        Returns: dict with max. absolute differences and the number of
+                 images with different all_black / all_white results
+    """
+    comparison = {
+        'n_images': 0, 'max_diff_p_pixels_black': 0.0,
+        'max_diff_p_pixels_white': 0.0, 'n_images_different_result': 0}
+    for image_path in image_paths:
+        try:
+            with Image.open(image_path) as img:
+                shares_full = uniform_pixel_shares(img)
+            with Image.open(image_path) as img:
+                shares_scaled = uniform_pixel_shares(img, scale)
+        except Exception:
+            continue
+        comparison['n_images'] += 1
+        comparison['max_diff_p_pixels_black'] = max(
+            comparison['max_diff_p_pixels_black'],
+            abs(shares_full[0] - shares_scaled[0]))
+        comparison['max_diff_p_pixels_white'] = max(
+            comparison['max_diff_p_pixels_white'],
+            abs(shares_full[1] - shares_scaled[1]))
+        if _uniform_image_checks(*shares_full) != \
+                _uniform_image_checks(*shares_scaled):
+            comparison['n_images_different_result'] += 1
+    return comparison
 
-def _image_is_white(pixel_data, flags):
-    white_percent = \
-        flags['image_check_parameters']['all_white']['percent']
-    white_thresh = \
-        flags['image_check_parameters']['all_white']['thresh']
-    p_pixels_white = p_pixels_above_threshold(
-        pixel_data, white_thresh)
-    return (p_pixels_white > white_percent)
+
+def check_image(image_path, target_tz, scale=1, file_creation_time=None):
+    """ Check an image - the file creation time is read from the file
+        system if 'file_creation_time' is not specified
+        Returns: tuple of image_path, file creation datetime (str),
+                 tuple of failed checks
+    """
+    failed_checks = list()
+    # try to open the image
+    try:
+        img = Image.open(image_path)
+    except:
+        img = None
+        failed_checks.append('corrupt_file')
+        logger.debug(
+            "Failed to open file {}".format(
+             image_path))
+    # get file creation date
+    try:
+        if file_creation_time is not None:
+            img_creation_date = file_creation_time
+        else:
+            img_creation_date = datetime_file_creation(image_path)
+        img_creation_date_dt = \
+            convert_ctime_to_datetime(img_creation_date)
+        if target_tz != '':
+            img_creation_date_local = \
+                convert_datetime_utc_to_timezone(
+                    img_creation_date_dt, target_tz)
+        else:
+            img_creation_date_local = img_creation_date_dt
+        img_creation_date_str = img_creation_date_local.strftime(
+            flags['time_formats']['output_datetime_format'])
+    except Exception:
+        logger.error(
+            "Failed to read file creation date for {}".format(
+             image_path), exc_info=True)
+        img_creation_date_str = ''
+    # check for uniformly colored images
+    try:
+        failed_checks += _uniform_image_checks(
+            *uniform_pixel_shares(img, scale))
+    except:
+        logger.debug(
+            "Failed to check all_white/all_black for {}".format(
+             image_path))
+    finally:
+        if img is not None:
+            img.close()
+    return image_path, img_creation_date_str, tuple(failed_checks)
+
+
+def _check_image_with_creation_time(
+        image_path_and_creation_time, target_tz, scale):
+    image_path, file_creation_time = image_path_and_creation_time
+    return check_image(
+        image_path, target_tz, scale=scale,
+        file_creation_time=file_creation_time)
+
+
+def check_images(
+        image_paths, target_tz, n_processes=4, chunksize=None, scale=1,
+        file_creation_times=None):
+    """ Check images using a pool of processes - images are
+        distributed in chunks to the next free process
+        file_creation_times: dict with image_path: file creation time
+            (e.g. from a scan manifest) to avoid reading it again
+        Returns: generator of check_image results (in input order)
+    """
+    n_images_total = len(image_paths)
+    if chunksize is None:
+        chunksize = max(1, min(
+            100, n_images_total // (max(n_processes, 1) * 16)))
+    if file_creation_times is None:
+        file_creation_times = dict()
+    checker = partial(
+        _check_image_with_creation_time, target_tz=target_tz, scale=scale)
+    to_check = (
+        (x, file_creation_times.get(x)) for x in image_paths)
+    start_time = time.time()
+    if n_processes > 1:
+        pool = Pool(processes=n_processes)
+        results = pool.imap(checker, to_check, chunksize=chunksize)
+    else:
+        pool = None
+        results = map(checker, to_check)
+    try:
+        for img_no, result in enumerate(results):
+            if (img_no % 1000) == 0:
+                est_t = estimate_remaining_time(
+                    start_time, n_images_total, img_no)
+                print("Processed {}/{} images - ETA: {}".format(
+                      img_no, n_images_total, est_t))
+            yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 if __name__ == '__main__':
@@ -56,6 +192,24 @@ if __name__ == '__main__':
     parser.add_argument("--inventory", type=str, required=True)
     parser.add_argument("--output_csv", type=str, required=True)
     parser.add_argument("--n_processes", type=int, default=4)
+    parser.add_argument(
+        "--chunksize", type=int, default=None,
+        help="Number of images sent to a process at once (default: \
+              determined by the number of images and processes)")
+    parser.add_argument(
+        "--check_scale", type=int, default=1, choices=[1, 2, 4, 8],
+        help="Decode JPEGs at 1/check_scale resolution for the \
+              all_black / all_white checks (faster)")
+    parser.add_argument(
+        "--check_scale_validation_sample", type=int, default=100,
+        help="Number of images to compare reduced and full resolution \
+              all_black / all_white checks (if check_scale > 1)")
+    parser.add_argument(
+        "--scan_manifest", type=str, default=None,
+        help="Path to a scan manifest (see scan_season_directory) -- \
+              file creation times are taken from it (the directory of \
+              the manifest is scanned again if the manifest is not \
+              current)")
     parser.add_argument("--timezone", type=str, default=None)
     parser.add_argument(
         "--log_dir", type=str, default=None)
@@ -72,12 +226,15 @@ if __name__ == '__main__':
         raise FileNotFoundError("inventory: {} not found".format(
                                 args['inventory']))
 
+    if args['scan_manifest'] is not None and \
+            not os.path.isfile(args['scan_manifest']):
+        raise FileNotFoundError("scan_manifest: {} not found".format(
+                                args['scan_manifest']))
+
     ######################################
     # Configuration
     ######################################
 
-    msg_width = 99
-
     # logging
     set_logging(args['log_dir'], args['log_filename'])
 
@@ -112,85 +269,48 @@ if __name__ == '__main__':
     # Process Inventory Images
     ######################################
 
-    def process_image_batch(i, image_paths_batch, image_inventory, results):
-        n_images_total = len(image_paths_batch)
-        start_time = time.time()
-        for img_no, image_path in enumerate(image_paths_batch):
-            current_data = copy.deepcopy(image_inventory[image_path])
-            # try to open the image
-            try:
-                img = Image.open(image_path)
-            except:
-                img = None
-                current_data['image_check__corrupt_file'] = 1
-                logger.debug(
-                    "Failed to open file {}".format(
-                     image_path))
-            # get file creation date
-            try:
-                img_creation_date = datetime_file_creation(image_path)
-                img_creation_date_dt = \
-                    convert_ctime_to_datetime(img_creation_date)
-                target_tz = flags['time_formats']['default_timezone']
-                if target_tz != '':
-                    img_creation_date_local = \
-                        convert_datetime_utc_to_timezone(
-                            img_creation_date_dt, target_tz)
-                else:
-                    img_creation_date_local = img_creation_date_dt
-                img_creation_date_str = img_creation_date_local.strftime(
-                    flags['time_formats']['output_datetime_format'])
-                current_data['datetime_file_creation'] = img_creation_date_str
-            except Exception:
-                logger.error(
-                    "Failed to read file creation date for {}".format(
-                     image_path), exc_info=True)
-                current_data['datetime_file_creation'] = ''
-            # check for uniformly colored images
-            try:
-                pixel_data = np.asarray(img)
-                if _image_is_black(pixel_data, flags):
-                    current_data['image_check__all_black'] = 1
-                if _image_is_white(pixel_data, flags):
-                    current_data['image_check__all_white'] = 1
-            except:
-                logger.debug(
-                    "Failed to check all_white/all_black for {}".format(
-                     image_path))
-            results[image_path] = current_data
-            if (img_no % 100) == 0:
-                est_t = estimate_remaining_time(
-                    start_time, n_images_total, img_no)
-                print("Process {:2} - Processed {}/{} images - ETA: {}".format(
-                      i, img_no, n_images_total, est_t))
-        print("Process {:2} - Finished".format(i))
-
     # Loop over all images
     image_paths_all = list(image_inventory.keys())
-    n_images_total = len(image_paths_all)
 
-    # parallelize image checking into 'n_processes'
-    manager = Manager()
-    results = manager.dict()
-    try:
-        processes_list = list()
-        n_processes = min(args['n_processes'], n_images_total)
-        slices = slice_generator(n_images_total, n_processes)
-        for i, (start_i, end_i) in enumerate(slices):
-            pr = Process(target=process_image_batch,
-                         args=(i, image_paths_all[start_i:end_i],
-                               image_inventory,
-                               results))
-            pr.start()
-            processes_list.append(pr)
-        for p in processes_list:
-            p.join()
-    except Exception:
-        print(traceback.format_exc())
+    # compare reduced and full resolution checks on a sample
+    if args['check_scale'] > 1 and \
+            args['check_scale_validation_sample'] > 0:
+        sample = random.Random(123).sample(
+            image_paths_all,
+            min(args['check_scale_validation_sample'], len(image_paths_all)))
+        comparison = compare_check_scales(sample, args['check_scale'])
+        logger.info(
+            "Comparison of check_scale {} with full resolution on {} "
+            "images: max. abs. difference of share of black pixels: "
+            "{:.4f}, of white pixels: {:.4f}, images with different "
+            "all_black / all_white results: {}".format(
+                args['check_scale'], comparison['n_images'],
+                comparison['max_diff_p_pixels_black'],
+                comparison['max_diff_p_pixels_white'],
+                comparison['n_images_different_result']))
+
+    # file creation times from the scan manifest
+    file_creation_times = None
+    if args['scan_manifest'] is not None:
+        file_creation_times = {
+            x['path']: x['file_creation_time']
+            for x in get_scan_records(None, args['scan_manifest'])
+            if x['level'] == 'file' and x['file_creation_time'] != ''}
+        logger.info("Read file creation times of {} files from {}".format(
+            len(file_creation_times), args['scan_manifest']))
 
-    # update data
-    for image_path, image_data in image_inventory.items():
-        image_inventory[image_path] = results[image_path]
+    # check images in chunks using 'n_processes'
+    target_tz = flags['time_formats']['default_timezone']
+    for image_path, img_creation_date_str, failed_checks in check_images(
+            image_paths_all, target_tz,
+            n_processes=args['n_processes'],
+            chunksize=args['chunksize'],
+            scale=args['check_scale'],
+            file_creation_times=file_creation_times):
+        current_data = image_inventory[image_path]
+        current_data['datetime_file_creation'] = img_creation_date_str
+        for check in failed_checks:
+            current_data['image_check__{}'.format(check)] = 1
 
     image_check_stats(image_inventory)
 
@@ -11,16 +11,31 @@ import argparse
 import logging
 
 from utils.logger import set_logging
-from utils.utils import get_hash
+from utils.hash_index import open_hash_index, get_indexed_hashes
+from utils.utils import HASH_ALGORITHMS
+from pre_processing.scan_season_directory import get_scan_records
 
 
-def check_for_duplicates(paths, hash=hashlib.sha1):
+logger = logging.getLogger(__name__)
+
+
+def check_for_duplicates(
+        paths, hash=hashlib.sha1, hash_index=None, n_threads=8,
+        file_sizes=None):
+    """ Find duplicate files - hashes are read from / stored in
+        'hash_index' (if specified), files are hashed using 'n_threads'
+        threads, file sizes are taken from 'file_sizes' (if specified)
+        Returns: list of (path, duplicate_path) tuples
+    """
     hashes_by_size = {}
     hashes_on_1k = {}
     hashes_full = {}
     n_tot = len(paths)
     for i, path in enumerate(paths):
-        file_size = os.path.getsize(path)
+        if file_sizes is not None:
+            file_size = file_sizes[path]
+        else:
+            file_size = os.path.getsize(path)
         duplicate = hashes_by_size.get(file_size)
         if duplicate:
             hashes_by_size[file_size].append(path)
@@ -33,45 +48,47 @@ def check_for_duplicates(paths, hash=hashlib.sha1):
     # For all files with the same file size, get their
     # hash on the 1st 1024 bytes
     logger.info("Checking for duplication by comparing small hashes ..")
-    for __, files in hashes_by_size.items():
-        if len(files) < 2:
+    files_to_hash = [
+        filename for files in hashes_by_size.values() if len(files) > 1
+        for filename in files]
+    small_hashes = get_indexed_hashes(
+        hash_index, files_to_hash, first_chunk_only=True, hash=hash,
+        n_threads=n_threads)
+    for filename, small_hash in zip(files_to_hash, small_hashes):
+        # the file access might've changed till the exec point got here
+        if small_hash is None:
             continue
-        for filename in files:
-            try:
-                small_hash = get_hash(filename, first_chunk_only=True)
-            except (OSError,):
-                # the file access might've changed till the exec point got here
-                continue
-            duplicate = hashes_on_1k.get(small_hash)
-            if duplicate:
-                hashes_on_1k[small_hash].append(filename)
-            else:
-                # create the list for this 1k hash
-                hashes_on_1k[small_hash] = []
-                hashes_on_1k[small_hash].append(filename)
+        duplicate = hashes_on_1k.get(small_hash)
+        if duplicate:
+            hashes_on_1k[small_hash].append(filename)
+        else:
+            # create the list for this 1k hash
+            hashes_on_1k[small_hash] = []
+            hashes_on_1k[small_hash].append(filename)
     # For all files with the hash on the 1st 1024 bytes, get their
     # hash on the full file - collisions will be duplicates
-    n_duplicates = 0
+    duplicates = list()
     logger.info("Checking for duplication by comparing full hashes ..")
-    for __, files in hashes_on_1k.items():
-        # this hash of fist 1k file bytes is unique, no need to
-        # spend cpy cycles on it
-        if len(files) < 2:
+    # this hash of fist 1k file bytes is unique, no need to
+    # spend cpy cycles on it
+    files_to_hash = [
+        filename for files in hashes_on_1k.values() if len(files) > 1
+        for filename in files]
+    full_hashes = get_indexed_hashes(
+        hash_index, files_to_hash, first_chunk_only=False, hash=hash,
+        n_threads=n_threads)
+    for filename, full_hash in zip(files_to_hash, full_hashes):
+        if full_hash is None:
             continue
-        for filename in files:
-            try:
-                full_hash = get_hash(filename, first_chunk_only=False)
-            except (OSError,):
-                # the file access might've changed till the exec point got here
-                continue
-            duplicate = hashes_full.get(full_hash)
-            if duplicate:
-                logger.info("Duplicate found: %s and %s" %
-                            (filename, duplicate))
-                n_duplicates += 1
-            else:
-                hashes_full[full_hash] = filename
-    logger.info("Found {} duplicates".format(n_duplicates))
+        duplicate = hashes_full.get(full_hash)
+        if duplicate:
+            logger.info("Duplicate found: %s and %s" %
+                        (filename, duplicate))
+            duplicates.append((filename, duplicate))
+        else:
+            hashes_full[full_hash] = filename
+    logger.info("Found {} duplicates".format(len(duplicates)))
+    return duplicates
 
 
 if __name__ == '__main__':
@@ -82,6 +99,22 @@ if __name__ == '__main__':
         "--root_dir", type=str, required=True,
         help="Root directory of the organized camera-trap data -- \
         contains the site folders.")
+    parser.add_argument(
+        "--hash_index", type=str, default=None,
+        help="Path to a (SQLite) index of file hashes -- is created if it \
+        does not exist and re-used to avoid re-calculating file hashes.")
+    parser.add_argument(
+        "--hash_algorithm", type=str, default='sha1',
+        choices=list(HASH_ALGORITHMS.keys()),
+        help="Hash algorithm to compare files (--hash_index requires sha1)")
+    parser.add_argument(
+        "--n_threads", type=int, default=8,
+        help="Number of threads to scan directories / hash files in \
+        parallel")
+    parser.add_argument(
+        "--scan_manifest", type=str, default=None,
+        help="Path to a scan manifest (see scan_season_directory) -- \
+        is read if it exists, otherwise created.")
     parser.add_argument(
         "--log_dir", type=str, default=None)
     parser.add_argument(
@@ -89,6 +122,9 @@ if __name__ == '__main__':
         default='check_for_duplicates')
     args = vars(parser.parse_args())
 
+    if args['hash_index'] is not None and args['hash_algorithm'] != 'sha1':
+        raise ValueError("--hash_index requires --hash_algorithm sha1")
+
     # check existence of root dir
     if not os.path.isdir(args['root_dir']):
         raise FileNotFoundError(
@@ -98,25 +134,25 @@ if __name__ == '__main__':
     # logging
     set_logging(args['log_dir'], args['log_filename'])
 
-    logger = logging.getLogger(__name__)
+    scan_records = get_scan_records(
+        args['root_dir'], args['scan_manifest'], n_threads=args['n_threads'])
 
-    site_directory_names = os.listdir(args['root_dir'])
-
-    all_image_paths = list()
-
-    # Collect all image paths
-    for site_directory_name in site_directory_names:
-        site_full_path = os.path.join(
-            args['root_dir'], site_directory_name)
-        roll_directory_names = os.listdir(site_full_path)
-        for roll_directory_name in roll_directory_names:
-            roll_directory_path = os.path.join(
-                site_full_path, roll_directory_name)
-            image_file_names = os.listdir(roll_directory_path)
-            for image_file_name in image_file_names:
-                all_image_paths.append(
-                    os.path.join(roll_directory_path, image_file_name))
+    # Collect all image paths and sizes
+    file_sizes = {
+        x['path']: x['size'] for x in scan_records
+        if x['level'] == 'file' and not x['is_dir'] and x['size'] != ''}
+    all_image_paths = list(file_sizes.keys())
     logger.info("Found {} images".format(len(all_image_paths)))
 
+    hash_index = None
+    if args['hash_index'] is not None:
+        hash_index = open_hash_index(args['hash_index'])
+
     # check for duplicates
-    check_for_duplicates(all_image_paths, hash=hashlib.sha1)
+    check_for_duplicates(
+        all_image_paths, hash=HASH_ALGORITHMS[args['hash_algorithm']],
+        hash_index=hash_index, n_threads=args['n_threads'],
+        file_sizes=file_sizes)
+
+    if hash_index is not None:
+        hash_index.close()
@@ -0,0 +1,200 @@
+""" Check for near-duplicate images (e.g. re-encoded or resized copies)
+    in a directory tree using perceptual hashes (dHash)
+    - hashes are stored in a BK-tree to find all hashes within a
+      Hamming distance without comparing all pairs of images
+"""
+import os
+import argparse
+import logging
+import time
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+from utils.logger import set_logging
+from utils.utils import list_pictures, estimate_remaining_time
+
+
+logger = logging.getLogger(__name__)
+
+
+def difference_hash(image_path, hash_size=8):
+    """ Calculate the difference hash (dHash) of an image -
+        compares the brightness of adjacent pixels of a downscaled
+        grayscale image
+        Returns: tuple of image_path, hash (int, None if the image
+                 could not be read)
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft('L', ((hash_size + 1) * 8, hash_size * 8))
+            pixels = np.asarray(img.convert('L').resize(
+                (hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    except Exception:
+        logger.debug("Failed to hash file {}".format(image_path))
+        return image_path, None
+    image_hash = 0
+    for bit in (pixels[:, :-1] > pixels[:, 1:]).flatten():
+        image_hash = (image_hash << 1) | int(bit)
+    return image_path, image_hash
+
+
+def hamming_distance(hash1, hash2):
+    """ Number of different bits """
+    return bin(hash1 ^ hash2).count('1')
+
+
+def create_bk_tree():
+    """ Create an empty BK-tree (metric tree for the Hamming distance) """
+    return {'root': None}
+
+
+def bk_tree_add(tree, value, item):
+    """ Add an item with (hash) value to a BK-tree """
+    if tree['root'] is None:
+        tree['root'] = {'value': value, 'items': [item], 'children': {}}
+        return
+    node = tree['root']
+    while True:
+        distance = hamming_distance(value, node['value'])
+        if distance == 0:
+            node['items'].append(item)
+            return
+        child = node['children'].get(distance)
+        if child is None:
+            node['children'][distance] = {
+                'value': value, 'items': [item], 'children': {}}
+            return
+        node = child
+
+
+def bk_tree_query(tree, value, max_distance):
+    """ Find all items with a (hash) value within 'max_distance'
+        Returns: list of (distance, item) tuples
+    """
+    matches = list()
+    if tree['root'] is None:
+        return matches
+    nodes_to_check = [tree['root']]
+    while len(nodes_to_check) > 0:
+        node = nodes_to_check.pop()
+        distance = hamming_distance(value, node['value'])
+        if distance <= max_distance:
+            matches += [(distance, item) for item in node['items']]
+        # triangle inequality: only these children can contain matches
+        for child_distance, child in node['children'].items():
+            if abs(child_distance - distance) <= max_distance:
+                nodes_to_check.append(child)
+    return matches
+
+
+def _find_cluster_root(parents, item):
+    while parents[item] != item:
+        parents[item] = parents[parents[item]]
+        item = parents[item]
+    return item
+
+
+def check_for_near_duplicates(
+        paths, max_distance=4, hash_size=8, n_processes=4):
+    """ Find clusters of near-duplicate images
+        Returns: list of clusters (lists of paths)
+    """
+    n_tot = len(paths)
+    hasher = partial(difference_hash, hash_size=hash_size)
+    start_time = time.time()
+    if n_processes > 1:
+        pool = Pool(processes=n_processes)
+        chunksize = max(1, min(100, n_tot // (n_processes * 16)))
+        hashes = pool.imap(hasher, paths, chunksize=chunksize)
+    else:
+        pool = None
+        hashes = map(hasher, paths)
+    tree = create_bk_tree()
+    parents = dict()
+    n_pairs = 0
+    logger.info("Checking for near-duplicates by comparing image hashes ..")
+    try:
+        for i, (path, image_hash) in enumerate(hashes):
+            if ((i % 10000) == 0) and i > 0:
+                est_t = estimate_remaining_time(start_time, n_tot, i)
+                print("Checked {}/{} files - ETA: {}".format(i, n_tot, est_t))
+            if image_hash is None:
+                continue
+            parents[path] = path
+            for distance, duplicate in bk_tree_query(
+                    tree, image_hash, max_distance):
+                logger.info(
+                    "Near-duplicate found: %s and %s (distance: %s)" %
+                    (path, duplicate, distance))
+                n_pairs += 1
+                parents[_find_cluster_root(parents, path)] = \
+                    _find_cluster_root(parents, duplicate)
+            bk_tree_add(tree, image_hash, path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    clusters = dict()
+    for path in parents.keys():
+        clusters.setdefault(
+            _find_cluster_root(parents, path), list()).append(path)
+    clusters = [x for x in clusters.values() if len(x) > 1]
+    for cluster in clusters:
+        logger.info("Near-duplicate cluster: {}".format(', '.join(cluster)))
+    logger.info(
+        "Found {} near-duplicates in {} clusters".format(
+            n_pairs, len(clusters)))
+    return clusters
+
+
+if __name__ == '__main__':
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--root_dir", type=str, required=True,
+        help="Root directory of the camera-trap images -- all images \
+        in the directory tree are compared.")
+    parser.add_argument(
+        "--max_distance", type=int, default=4,
+        help="Max. number of different bits of the image hashes of \
+        near-duplicate images")
+    parser.add_argument(
+        "--hash_size", type=int, default=8,
+        help="Hashes have hash_size * hash_size bits")
+    parser.add_argument(
+        "--n_processes", type=int, default=4,
+        help="Number of processes to hash images in parallel")
+    parser.add_argument(
+        "--log_dir", type=str, default=None)
+    parser.add_argument(
+        "--log_filename", type=str,
+        default='check_for_near_duplicates')
+    args = vars(parser.parse_args())
+
+    # check existence of root dir
+    if not os.path.isdir(args['root_dir']):
+        raise FileNotFoundError(
+            "root_dir {} does not exist -- must be a directory".format(
+                args['root_dir']))
+
+    # logging
+    set_logging(args['log_dir'], args['log_filename'])
+
+    for k, v in args.items():
+        logger.info("Argument {}: {}".format(k, v))
+
+    # Collect all image paths
+    all_image_paths = sorted(list_pictures(
+        args['root_dir'], ext=('jpg', 'jpeg')))
+    logger.info("Found {} images".format(len(all_image_paths)))
+
+    # check for near-duplicates
+    check_for_near_duplicates(
+        all_image_paths,
+        max_distance=args['max_distance'],
+        hash_size=args['hash_size'],
+        n_processes=args['n_processes'])
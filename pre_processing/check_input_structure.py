@@ -12,13 +12,13 @@
     - Code checks for correct structure and naming
     - Prints error messages if input is invalid
 """
-import os
 import argparse
 import logging
 import textwrap
 
 from utils.logger import set_logging
 from utils.utils import check_dir_existence
+from pre_processing.scan_season_directory import get_scan_records
 
 
 def is_ok_site_code(site):
@@ -103,6 +103,13 @@ if __name__ == '__main__':
         "--root_dir", type=str, required=True,
         help="Root directory of the organized camera-trap data -- \
         contains the site folders.")
+    parser.add_argument(
+        "--scan_manifest", type=str, default=None,
+        help="Path to a scan manifest (see scan_season_directory) -- \
+        is read if it exists, otherwise created.")
+    parser.add_argument(
+        "--n_threads", type=int, default=8,
+        help="Number of threads to scan site directories in parallel")
     parser.add_argument(
         "--log_dir", type=str, default=None)
     parser.add_argument(
@@ -118,13 +125,17 @@ if __name__ == '__main__':
 
     msg_width = 250
 
-    site_directory_names = os.listdir(args['root_dir'])
+    scan_records = get_scan_records(
+        args['root_dir'], args['scan_manifest'], n_threads=args['n_threads'])
 
     # check each site directory
-    for site_directory_name in site_directory_names:
+    for site_record in scan_records:
+        if site_record['level'] != 'site':
+            continue
+        site_directory_name = site_record['name']
         # check if file is a directory
-        dir_full_path = os.path.join(args['root_dir'], site_directory_name)
-        if not os.path.isdir(dir_full_path):
+        dir_full_path = site_record['path']
+        if not site_record['is_dir']:
             logger.error("site_directory_name {} is not a directory, \
                 remove file {}".format(site_directory_name, dir_full_path))
         # check site directory name
@@ -133,16 +144,14 @@ if __name__ == '__main__':
                 site_directory_name,
                 msg_width)
             logger.error(msg)
-    # check each roll in a site directory
-    for site_directory_name in site_directory_names:
-        # get all roll directories in a site directory
-        current_dir_full_path = os.path.join(
-            args['root_dir'], site_directory_name)
-        roll_directory_names = os.listdir(current_dir_full_path)
-        # check rolls
-        for roll_directory_name in roll_directory_names:
-            roll_directory_path = os.path.join(
-                current_dir_full_path, roll_directory_name)
+    # check each roll in a site directory and each file in a roll
+    # directory (files follow their roll directory in the scan records)
+    valid_roll_directories = set()
+    for record in scan_records:
+        if record['level'] == 'roll':
+            site_directory_name = record['site_directory']
+            roll_directory_name = record['name']
+            roll_directory_path = record['path']
             if not is_ok_roll_directory_name(roll_directory_name):
                 msg = _create_invalid_roll_msg(
                     roll_directory_name,
@@ -159,16 +168,19 @@ if __name__ == '__main__':
                         site_directory_name,
                         msg_width)
                     logger.error(msg)
-                # check each file in a roll directory
-                image_file_names = os.listdir(roll_directory_path)
-                for image_file_name in image_file_names:
-                    # check file ending
-                    if not image_file_name.lower().endswith('.jpg'):
-                        image_path = os.path.join(
-                            roll_directory_path, image_file_name)
-                        msg = _create_invalid_image_msg(
-                            image_file_name,
-                            roll_directory_name,
-                            msg_width)
-                        logger.error(msg)
+                valid_roll_directories.add(
+                    (site_directory_name, roll_directory_name))
+        elif record['level'] == 'file':
+            roll_directory_name = record['roll_directory']
+            if (record['site_directory'], roll_directory_name) not in \
+                    valid_roll_directories:
+                continue
+            image_file_name = record['name']
+            # check file ending
+            if not image_file_name.lower().endswith('.jpg'):
+                msg = _create_invalid_image_msg(
+                    image_file_name,
+                    roll_directory_name,
+                    msg_width)
+                logger.error(msg)
     logger.info("Finished checking input structure")
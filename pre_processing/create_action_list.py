@@ -7,7 +7,6 @@ import os
 import argparse
 from collections import OrderedDict
 import logging
-import pandas as pd
 
 from pre_processing.utils import (
     plot_site_roll_timelines, read_image_inventory,
@@ -192,7 +191,7 @@ if __name__ == '__main__':
 
     # create plot for site/roll timelines
     if args['plot_timelines']:
-        df = pd.DataFrame.from_dict(inventory, orient='index')
+        df = inventory.to_dataframe()
         plot_file_name = 'site_roll_timelines.pdf'
         plot_file_path = os.path.join(
             os.path.dirname(args['captures']), plot_file_name)
@@ -10,6 +10,7 @@ from utils.utils import check_dir_existence
 from pre_processing.utils import (
     image_check_stats, export_inventory_to_csv,
     get_rollnum_from_roll_directory)
+from pre_processing.scan_season_directory import get_scan_records
 from config.cfg import cfg
 
 
@@ -25,6 +26,13 @@ if __name__ == '__main__':
         "--season_id", type=str, default="",
         help="identifier that is exported to the inventory")
     parser.add_argument("--output_csv", type=str, required=True)
+    parser.add_argument(
+        "--scan_manifest", type=str, default=None,
+        help="Path to a scan manifest (see scan_season_directory) -- \
+        is read if it exists, otherwise created.")
+    parser.add_argument(
+        "--n_threads", type=int, default=8,
+        help="Number of threads to scan site directories in parallel")
     parser.add_argument("--log_dir", type=str, default=None)
     parser.add_argument(
         "--log_filename", type=str, default='create_image_inventory')
@@ -45,37 +53,32 @@ if __name__ == '__main__':
         logger.info("Updating 'season_id' with {}".format(
             args['season_id']))
 
-    site_directory_names = os.listdir(args['root_dir'])
+    scan_records = get_scan_records(
+        args['root_dir'], args['scan_manifest'], n_threads=args['n_threads'])
 
     image_inventory = OrderedDict()
 
-    # Loop over site directories
-    for site_directory_name in site_directory_names:
-        current_dir_full_path = os.path.join(
-            args['root_dir'], site_directory_name)
-        roll_directory_names = os.listdir(current_dir_full_path)
-        # Loop over roll directories
-        for roll_directory_name in roll_directory_names:
-            roll = get_rollnum_from_roll_directory(roll_directory_name)
-            roll_directory_path = os.path.join(
-                current_dir_full_path, roll_directory_name)
-            roll_directory_path_rel = os.path.join(
-                site_directory_name, roll_directory_name)
-            image_file_names = os.listdir(roll_directory_path)
-            # Loop over image files
-            for image_file_name in image_file_names:
-                image_path = os.path.join(roll_directory_path, image_file_name)
-                image_path_rel = os.path.join(
-                    last_dir,
-                    roll_directory_path_rel,
-                    image_file_name)
-                image_inventory[image_path] = {
-                    'season': args['season_id'],
-                    'site': site_directory_name,
-                    'roll': roll,
-                    'image_name_original': image_file_name,
-                    'image_path_original': image_path,
-                    'image_path_original_rel': image_path_rel}
+    # Loop over image files in roll directories
+    for record in scan_records:
+        if record['level'] != 'file':
+            continue
+        site_directory_name = record['site_directory']
+        roll_directory_name = record['roll_directory']
+        roll = get_rollnum_from_roll_directory(roll_directory_name)
+        image_file_name = record['name']
+        image_path = record['path']
+        image_path_rel = os.path.join(
+            last_dir,
+            site_directory_name,
+            roll_directory_name,
+            image_file_name)
+        image_inventory[image_path] = {
+            'season': args['season_id'],
+            'site': site_directory_name,
+            'roll': roll,
+            'image_name_original': image_file_name,
+            'image_path_original': image_path,
+            'image_path_original_rel': image_path_rel}
 
     image_check_stats(image_inventory)
 
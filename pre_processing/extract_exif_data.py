@@ -6,8 +6,11 @@ import time
 import traceback
 import textwrap
 import copy
+import json
+import glob
+import shutil
 from datetime import datetime
-from multiprocessing import Process, Manager
+from multiprocessing import Process
 
 import exiftool
 import pandas as pd
@@ -22,6 +25,8 @@ from utils.utils import (
 
 flags = cfg['pre_processing_flags']
 
+logger = logging.getLogger(__name__)
+
 
 def _create_datetime(image_data):
     """ Create best possible datetime """
@@ -83,6 +88,90 @@ def _extract_time_info_from_exif(exif_tags, flags):
     raise ValueError("Failed to extract datetime info.")
 
 
+def exif_checkpoint_dir(inventory):
+    """ Default directory to store intermediate EXIF results """
+    return '{}_exif_checkpoint'.format(os.path.splitext(inventory)[0])
+
+
+def read_exif_checkpoint(checkpoint_dir):
+    """ Read EXIF results of all (previous) workers - results of later
+        runs replace earlier ones (e.g. of retried failed extractions)
+        Returns: dict with image_path: tags (None if extraction failed)
+    """
+    results = dict()
+    for path in sorted(glob.glob(os.path.join(checkpoint_dir, '*.jsonl'))):
+        with open(path, 'r') as f:
+            for line in f:
+                # the last line may be incomplete if a worker crashed
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                results[result['image_path']] = result['tags']
+    return results
+
+
+def exif_images_to_extract(image_paths, results):
+    """ Images without EXIF data in 'results' (of read_exif_checkpoint) -
+        failed extractions are retried
+    """
+    return [x for x in image_paths if results.get(x) is None]
+
+
+def _execute_exiftool_batch(et, image_paths):
+    """ Extract exif data of multiple images with one exiftool call -
+        images not in the batch result are extracted one by one
+        Returns: dict with image_path: tags (None if extraction failed)
+    """
+    results = dict()
+    try:
+        for tags in et.execute_json(*image_paths):
+            results[tags['SourceFile']] = tags
+    except Exception:
+        logger.warning(
+            "Failed to extract EXIF data from batch starting with {}".format(
+                image_paths[0]), exc_info=True)
+    for img_path in image_paths:
+        if img_path in results:
+            continue
+        try:
+            results[img_path] = et.execute_json(img_path)[0]
+        except Exception:
+            logger.warning(
+                "Failed to extract EXIF data from {}".format(img_path),
+                exc_info=True)
+            results[img_path] = None
+    return {img_path: results[img_path] for img_path in image_paths}
+
+
+def extract_exif_image_list(
+        i, image_paths, exif_exec, checkpoint_path, batch_size=100,
+        msg_width=99):
+    """ Extract exif data from a list of images -
+        append results to 'checkpoint_path' (one json record per line)
+    """
+    n_images_total = len(image_paths)
+    start_time = time.time()
+    with open(checkpoint_path, 'a') as f_out:
+        with exiftool.ExifTool(executable_=exif_exec) as et:
+            for start_i in range(0, n_images_total, batch_size):
+                batch = image_paths[start_i:start_i + batch_size]
+                batch_results = _execute_exiftool_batch(et, batch)
+                for img_path, tags in batch_results.items():
+                    f_out.write(json.dumps(
+                        {'image_path': img_path, 'tags': tags}) + '\n')
+                f_out.flush()
+                img_no = start_i + len(batch)
+                est_t = estimate_remaining_time(
+                    start_time, n_images_total, img_no)
+                msg = textwrap.shorten(
+                    "Process {:2} - Processed {}/{} images - \
+                     ETA: {}".format(
+                     i, img_no, n_images_total, est_t), width=msg_width)
+                print(msg)
+    print("Process {:2} - Finished".format(i))
+
+
 if __name__ == '__main__':
 
     # Parse command line arguments
@@ -91,6 +180,13 @@ if __name__ == '__main__':
     parser.add_argument("--update_inventory", action='store_true')
     parser.add_argument("--output_csv", type=str, default=None)
     parser.add_argument("--n_processes", type=int, default=4)
+    parser.add_argument(
+        "--batch_size", type=int, default=100,
+        help="Number of images to process per exiftool call")
+    parser.add_argument(
+        "--checkpoint_dir", type=str, default=None,
+        help="Directory to store intermediate results to resume crashed \
+              runs (default: <inventory>_exif_checkpoint)")
     parser.add_argument(
         "--exiftool_path", type=str,
         default='/home/packerc/shared/programs/Image-ExifTool-11.31/exiftool')
@@ -135,47 +231,41 @@ if __name__ == '__main__':
     # Process Inventory
     ######################################
 
-    def extract_exif_image_list(i, image_paths_batch, results, exif_exec):
-        """ Extract exif data from a list of images -
-            write result into 'results' dictionary
-        """
-        n_images_total = len(image_paths_batch)
-        start_time = time.time()
-        with exiftool.ExifTool(executable_=exif_exec) as et:
-            for img_no, img_path in enumerate(image_paths_batch):
-                try:
-                    tags = et.execute_json(img_path)[0]
-                except Exception:
-                    logger.warning(
-                        "Failed to extract EXIF data from {}".format(img_path),
-                        exc_info=True)
-                    tags = None
-                results[img_path] = tags
-                if (img_no % 100) == 0:
-                    est_t = estimate_remaining_time(
-                        start_time, n_images_total, img_no)
-                    msg = textwrap.shorten(
-                        "Process {:2} - Processed {}/{} images - \
-                         ETA: {}".format(
-                         i, img_no, n_images_total, est_t), width=msg_width)
-                    print(msg)
-        print("Process {:2} - Finished".format(i))
-
     # Loop over all images
     image_paths_all = list(image_inventory.keys())
     n_images_total = len(image_paths_all)
 
-    # parallelize image checking into 'n_processes'
-    manager = Manager()
-    results = manager.dict()
+    # resume from results of a previous (crashed) run
+    checkpoint_dir = args['checkpoint_dir']
+    if checkpoint_dir is None:
+        checkpoint_dir = exif_checkpoint_dir(args['inventory'])
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    results = read_exif_checkpoint(checkpoint_dir)
+    if len(results) > 0:
+        n_failed = sum([x is None for x in results.values()])
+        logger.info(
+            "Found EXIF data of {} images in {} - resuming (retrying {} "
+            "failed images)".format(
+                len(results) - n_failed, checkpoint_dir, n_failed))
+    image_paths_to_process = exif_images_to_extract(image_paths_all, results)
+    n_images_to_process = len(image_paths_to_process)
+    logger.info("Extracting EXIF data of {}/{} images".format(
+        n_images_to_process, n_images_total))
+
+    # parallelize exif extraction into 'n_processes' - each process
+    # writes its results to a separate file in 'checkpoint_dir'
+    run_id = int(time.time())
     try:
         processes_list = list()
-        n_processes = min(args['n_processes'], n_images_total)
-        slices = slice_generator(n_images_total, n_processes)
+        n_processes = min(args['n_processes'], n_images_to_process)
+        slices = slice_generator(n_images_to_process, n_processes)
         for i, (start_i, end_i) in enumerate(slices):
+            checkpoint_path = os.path.join(
+                checkpoint_dir, 'exif_{}_{:03d}.jsonl'.format(run_id, i))
             pr = Process(target=extract_exif_image_list,
-                         args=(i, image_paths_all[start_i:end_i],
-                               results, args['exiftool_path']))
+                         args=(i, image_paths_to_process[start_i:end_i],
+                               args['exiftool_path'], checkpoint_path,
+                               args['batch_size'], msg_width))
             pr.start()
             processes_list.append(pr)
         for p in processes_list:
@@ -183,8 +273,14 @@ if __name__ == '__main__':
     except Exception:
         print(traceback.format_exc())
 
-    # copy the shared dictionary
-    exif_all = {k: v for k, v in results.items()}
+    results = read_exif_checkpoint(checkpoint_dir)
+    exif_all = {k: results[k] for k in image_paths_all if k in results}
+
+    n_images_missing = n_images_total - len(exif_all)
+    if n_images_missing > 0:
+        logger.warning(
+            "EXIF data of {} images not extracted - re-run to resume from "
+            "{}".format(n_images_missing, checkpoint_dir))
 
     # Extract relevant EXIF tags
     exif_extracted = dict()
@@ -255,3 +351,7 @@ if __name__ == '__main__':
         df.to_csv(args['output_csv'], index=True)
         # change permmissions to read/write for group
         set_file_permission(args['output_csv'])
+
+    # remove intermediate results after a complete run
+    if n_images_missing == 0:
+        shutil.rmtree(checkpoint_dir)
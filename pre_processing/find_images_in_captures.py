@@ -7,10 +7,12 @@
 import os
 import argparse
 import logging
+from collections import OrderedDict
 
 import pandas as pd
 
-from utils.utils import list_pictures, get_hash
+from utils.utils import list_pictures
+from utils.hash_index import open_hash_index, get_indexed_hashes
 from pre_processing.utils import (
     read_image_inventory)
 from utils.logger import set_logging
@@ -21,7 +23,7 @@ logger = logging.getLogger(__name__)
 
 # # example path:
 # args = dict()
-# args['captures_csv'] = '/home/packerc/shared/season_captures/ENO/captures/ENO_S1_captures_updated.csv'
+# args['captures'] = '/home/packerc/shared/season_captures/ENO/captures/ENO_S1_captures_updated.csv'
 # args['images_to_match_path'] = '/home/packerc/will5448/data/pre_processing_tests/test_images/'
 # args['output_csv'] = '/home/packerc/will5448/data/pre_processing_tests/image_matches.csv'
 
@@ -35,22 +37,28 @@ def path_to_size(paths):
     return path_to_size
 
 
-def eliminate_ambigous_size_matches(matches):
+def eliminate_ambigous_size_matches(matches, hash_index=None, n_threads=8):
     """ Eliminate ambigous matches (same size) by comparing file hashes """
+    ambiguous_matches = {
+        path: size_matches for path, size_matches in matches.items()
+        if len(size_matches) > 1}
+    # hash each file only once (in parallel)
+    files_to_hash = list(OrderedDict.fromkeys(
+        [path for path in ambiguous_matches.keys()] +
+        [file for size_matches in ambiguous_matches.values()
+         for file in size_matches]))
+    file_hashes = dict(zip(
+        files_to_hash,
+        get_indexed_hashes(
+            hash_index, files_to_hash, first_chunk_only=False,
+            n_threads=n_threads)))
     # eliminate ambiguous matches
-    for path in matches.keys():
-        size_matches = matches[path]
-        hash_matches = list()
-        if len(size_matches) > 1:
-            hash_to_find = get_hash(path, first_chunk_only=False)
-            for file in size_matches:
-                try:
-                    hash_to_match = get_hash(file, first_chunk_only=False)
-                except (OSError,):
-                    continue
-                if hash_to_match == hash_to_find:
-                    hash_matches.append(file)
-            matches[path] = hash_matches
+    for path, size_matches in ambiguous_matches.items():
+        hash_to_find = file_hashes[path]
+        matches[path] = [
+            file for file in size_matches
+            if file_hashes[file] is not None and
+            file_hashes[file] == hash_to_find]
 
 
 if __name__ == '__main__':
@@ -60,6 +68,13 @@ if __name__ == '__main__':
     parser.add_argument("--captures", type=str, required=True)
     parser.add_argument("--images_to_match_path", type=str, required=True)
     parser.add_argument("--output_csv", type=str, default=None)
+    parser.add_argument(
+        "--hash_index", type=str, default=None,
+        help="Path to a (SQLite) index of file hashes -- is created if it \
+        does not exist and re-used to avoid re-calculating file hashes.")
+    parser.add_argument(
+        "--n_threads", type=int, default=8,
+        help="Number of threads to read / hash files in parallel")
     args = vars(parser.parse_args())
 
     # Check Input
@@ -83,11 +98,11 @@ if __name__ == '__main__':
         len(images_to_find), args['images_to_match_path']))
 
     captures = read_image_inventory(
-        args['captures_csv'],
+        args['captures'],
         unique_id='image_path')
 
     logger.info("Read {} with {} images".format(
-        args['captures_csv'], len(captures.keys())))
+        args['captures'], len(captures.keys())))
 
     images_to_search_in = list(captures.keys())
 
@@ -114,7 +129,15 @@ if __name__ == '__main__':
             for files_to_find in files_to_find:
                 matches[files_to_find] += size_matches
 
-    eliminate_ambigous_size_matches(matches)
+    hash_index = None
+    if args['hash_index'] is not None:
+        hash_index = open_hash_index(args['hash_index'])
+
+    eliminate_ambigous_size_matches(
+        matches, hash_index=hash_index, n_threads=args['n_threads'])
+
+    if hash_index is not None:
+        hash_index.close()
 
     # all duplicates
     logger.info(
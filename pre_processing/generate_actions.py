@@ -231,49 +231,66 @@ def generate_actions_for_images(action, image_list):
     return actions_list
 
 
+def create_captures_index(inventory):
+    """ Index the images of the inventory to resolve action scopes
+        without scanning the inventory for each action
+        Returns: dict with
+            - 'image_names': list of image names (inventory order)
+            - 'positions': image name -> position in 'image_names'
+            - 'sites': site -> {'positions': [...],
+                                'rolls': roll -> [...]}
+              (ordered positions of the images of a site / roll)
+    """
+    image_names = list()
+    positions = dict()
+    sites = dict()
+    for position, (image_name, image_data) in enumerate(inventory.items()):
+        image_names.append(image_name)
+        positions[image_name] = position
+        site = sites.setdefault(
+            image_data.get('site'), {'positions': list(), 'rolls': dict()})
+        site['positions'].append(position)
+        site['rolls'].setdefault(
+            image_data.get('roll'), list()).append(position)
+    return {'image_names': image_names, 'positions': positions,
+            'sites': sites}
+
+
 def find_all_images_for_start_end_image(
-        first_image, last_image, inventory):
+        first_image, last_image, captures_index):
     """ Generate list of all images in a range
         first_image: name of first image in the range
         last_image: name of last image in the range
     """
-    images_list = list()
-    fetch_images = False
-    for image_name, image_data in inventory.items():
-        if image_name == first_image:
-            fetch_images = True
-        if fetch_images:
-            images_list.append(image_name)
-        if image_name == last_image:
-            fetch_images = False
-    return images_list
-
-
-def find_images_for_site_roll(site, roll, inventory):
+    first_position = captures_index['positions'].get(first_image)
+    if first_position is None:
+        return list()
+    last_position = captures_index['positions'].get(last_image)
+    # range is open-ended if last_image is not after first_image
+    if last_position is None or last_position < first_position:
+        return captures_index['image_names'][first_position:]
+    return captures_index['image_names'][first_position:last_position + 1]
+
+
+def find_images_for_site_roll(site, roll, captures_index):
     """ Find a list of images for a site or a roll """
-    images_list = list()
-    for image_name, image_data in inventory.items():
-        site_match = (image_data['site'] == site)
-        roll_match = (image_data['roll'] == roll)
-        if site_match and roll_match:
-            images_list.append(image_name)
-    return images_list
+    site_index = captures_index['sites'].get(site, {'rolls': dict()})
+    image_names = captures_index['image_names']
+    return [image_names[i] for i in site_index['rolls'].get(roll, list())]
 
 
-def find_images_for_site(site, inventory):
+def find_images_for_site(site, captures_index):
     """ Find a list of images for a site """
-    images_list = list()
-    for image_name, image_data in inventory.items():
-        site_match = (image_data['site'] == site)
-        if site_match:
-            images_list.append(image_name)
-    return images_list
+    site_index = captures_index['sites'].get(site, {'positions': list()})
+    image_names = captures_index['image_names']
+    return [image_names[i] for i in site_index['positions']]
 
 
 def generate_actions(action_list, captures):
     """ Generate individual actions from action list """
     actions_inventory = list()
     image_to_action = set()
+    captures_index = create_captures_index(captures)
     for _id, action in action_list.items():
         # check action file
         try:
@@ -292,16 +309,16 @@ def generate_actions(action_list, captures):
             images = find_all_images_for_start_end_image(
                 action['action_from_image'],
                 action['action_to_image'],
-                captures)
+                captures_index)
         elif action_scope == 'site_roll':
             images = find_images_for_site_roll(
                 action['action_site'],
                 action['action_roll'],
-                captures)
+                captures_index)
         elif action_scope == 'site':
             images = find_images_for_site(
                 action['action_site'],
-                captures)
+                captures_index)
         else:
             logger.error(
                 "action_scope {} not recognized".format(
@@ -1,19 +1,27 @@
 """ Group Input into Captures """
 import numpy as np
+import pandas as pd
 import os
+import csv
+import json
+import hashlib
 import argparse
 from datetime import datetime
 import logging
+from collections import OrderedDict
 
 from pre_processing.utils import (
     image_check_stats, read_image_inventory,
     export_inventory_to_csv, update_time_checks)
 from config.cfg import cfg
 from utils.logger import set_logging
+from utils.utils import set_file_permission
 
 
 flags = cfg['pre_processing_flags']
 
+logger = logging.getLogger(__name__)
+
 
 # args = dict()
 # args['inventory'] = '/home/packerc/will5448/data/pre_processing_tests/ENO_S1_inventory.csv'
@@ -169,6 +177,123 @@ def group_images_into_captures(inventory, flags):
     return image_to_capture
 
 
+def _roll_codes(inventory):
+    """ Integer code of the season / site / roll of each image """
+    return pd.factorize(pd.Series([
+        '#'.join([x['season'], x['site'], x['roll']])
+        for x in inventory.values()]))[0]
+
+
+def _group_start_index(is_group_start):
+    """ Index of the first element of the group of each element
+        (elements of a group must be consecutive)
+    """
+    index = np.arange(len(is_group_start))
+    return np.maximum.accumulate(np.where(is_group_start, index, 0))
+
+
+def _format_days(delta_seconds):
+    """ Format time deltas in seconds as days (each distinct value
+        is formatted only once)
+    """
+    unique_deltas, inverse = np.unique(delta_seconds, return_inverse=True)
+    formatted = np.array(
+        ['{:.2f}'.format((x / (60*60*24))) for x in unique_deltas.tolist()])
+    return formatted[inverse.reshape(-1)]
+
+
+def calculate_time_deltas_vectorized(inventory, flags):
+    """ Calulate time deltas between subsequent images - same output as
+        'calculate_time_deltas' but all images are processed at once
+    """
+    image_ids = np.array(list(inventory.keys()))
+    if len(image_ids) == 0:
+        return dict()
+    datetimes = pd.to_datetime(
+        pd.Series([x['datetime'] for x in inventory.values()]),
+        format=flags['time_formats']['output_datetime_format'])
+    times_seconds = (
+        (datetimes - pd.Timestamp(1970, 1, 1)) // pd.Timedelta(seconds=1)
+        ).to_numpy(dtype=np.int64)
+    roll_codes = _roll_codes(inventory)
+    # Define the order of the images by 1) roll, 2) time and 3) by name
+    ordered_indexes = np.lexsort((image_ids, times_seconds, roll_codes))
+    paths_ordered = image_ids[ordered_indexes]
+    times_ordered = times_seconds[ordered_indexes].astype(np.float64)
+    rolls_ordered = roll_codes[ordered_indexes]
+    is_roll_start = np.ones(len(rolls_ordered), dtype=bool)
+    is_roll_start[1:] = rolls_ordered[1:] != rolls_ordered[:-1]
+    is_roll_end = np.roll(is_roll_start, -1)
+    # Calculate time deltas between subsequent images
+    # (next and previous) in seconds and days
+    delta_seconds_next = np.zeros(len(times_ordered))
+    delta_seconds_next[:-1] = times_ordered[1:] - times_ordered[:-1]
+    delta_seconds_last = np.zeros(len(times_ordered))
+    delta_seconds_last[1:] = np.abs(times_ordered[1:] - times_ordered[:-1])
+    delta_days_next = _format_days(delta_seconds_next)
+    delta_days_last = _format_days(delta_seconds_last)
+    image_rank_in_roll = \
+        np.arange(len(rolls_ordered)) - \
+        _group_start_index(is_roll_start) + 1
+    image_time_deltas = dict()
+    for i, (path, rank, next_s, last_s, next_d, last_d) in enumerate(zip(
+            paths_ordered.tolist(), image_rank_in_roll.tolist(),
+            delta_seconds_next.tolist(), delta_seconds_last.tolist(),
+            delta_days_next.tolist(), delta_days_last.tolist())):
+        # the last / first image of a roll has no next / last image
+        if is_roll_end[i]:
+            next_s, next_d = 0, 0
+        if is_roll_start[i]:
+            last_s, last_d = 0, 0
+        image_time_deltas[path] = {
+            'image_rank_in_roll': rank,
+            'seconds_to_next_image_taken': next_s,
+            'seconds_to_last_image_taken': last_s,
+            'days_to_last_image_taken': last_d,
+            'days_to_next_image_taken': next_d}
+    return image_time_deltas
+
+
+def group_images_into_captures_vectorized(inventory, flags):
+    """ Group images into capture events by time deltas - same output
+        as 'group_images_into_captures' but all images are processed
+        at once
+    """
+    image_ids = np.array(list(inventory.keys()))
+    if len(image_ids) == 0:
+        return dict()
+    ranks = np.array(
+        [int(x['image_rank_in_roll']) for x in inventory.values()])
+    deltas = np.array(
+        [float(x['seconds_to_last_image_taken'])
+         for x in inventory.values()])
+    roll_codes = _roll_codes(inventory)
+    # order images by roll and time (rank in roll)
+    ordered_indexes = np.lexsort((ranks, roll_codes))
+    rolls_ordered = roll_codes[ordered_indexes]
+    deltas_ordered = deltas[ordered_indexes]
+    is_roll_start = np.ones(len(rolls_ordered), dtype=bool)
+    is_roll_start[1:] = rolls_ordered[1:] != rolls_ordered[:-1]
+    max_delta = flags['image_check_parameters']['capture_delta_max_seconds']
+    is_capture_start = is_roll_start | (deltas_ordered > max_delta)
+    # number captures within each roll
+    n_captures_started = np.cumsum(is_capture_start)
+    capture_ids = \
+        n_captures_started - \
+        n_captures_started[_group_start_index(is_roll_start)] + 1
+    image_rank_in_capture = \
+        np.arange(len(rolls_ordered)) - \
+        _group_start_index(is_capture_start) + 1
+    image_to_capture = dict()
+    for image_name, capture, rank in zip(
+            image_ids[ordered_indexes].tolist(), capture_ids.tolist(),
+            image_rank_in_capture.tolist()):
+        image_to_capture[image_name] = {
+            'capture': capture,
+            'image_rank_in_capture': rank}
+    return image_to_capture
+
+
 def update_inventory_with_capture_data(inventory, image_to_capture):
     """ update inventory with capture data """
     # merge capture info with inventory
@@ -206,6 +331,131 @@ def update_time_checks_inventory(inventory, flags):
             pass
 
 
+def _season_site_roll_key(image_data):
+    return '#'.join(
+        [image_data['season'], image_data['site'], image_data['roll']])
+
+
+# columns calculated per roll (and their types)
+ROLL_GROUPING_COLUMNS = OrderedDict([
+    ('image_rank_in_roll', int),
+    ('seconds_to_next_image_taken', float),
+    ('seconds_to_last_image_taken', float),
+    ('days_to_last_image_taken', str),
+    ('days_to_next_image_taken', str),
+    ('capture', int),
+    ('image_rank_in_capture', int),
+    ('capture_id', str)])
+
+IMAGE_NAME_COLUMNS = ['image_path', 'image_name', 'image_path_rel']
+
+
+def calculate_roll_hashes(inventory, flags):
+    """ Content hash of each roll - changes if images, their datetimes
+        or grouping parameters change
+        Returns: dict - season#site#roll key: hash
+    """
+    settings = json.dumps({
+        'image_check_parameters': flags['image_check_parameters'],
+        'time_formats': flags['time_formats']}, sort_keys=True)
+    roll_images = dict()
+    for image_data in inventory.values():
+        roll_images.setdefault(
+            _season_site_roll_key(image_data), list()).append(
+            (image_data['image_path_original'], image_data['datetime']))
+    roll_hashes = dict()
+    for season_site_roll_key, images in roll_images.items():
+        roll_hash = hashlib.sha1(settings.encode('utf-8'))
+        for image_path_original, image_datetime in sorted(images):
+            roll_hash.update('{}\t{}\n'.format(
+                image_path_original, image_datetime).encode('utf-8'))
+        roll_hashes[season_site_roll_key] = roll_hash.hexdigest()
+    return roll_hashes
+
+
+def read_roll_hashes(path):
+    """ Read roll hashes from a csv """
+    with open(path, 'r', newline='') as f:
+        return {row['season_site_roll']: row['roll_hash']
+                for row in csv.DictReader(f)}
+
+
+def write_roll_hashes(roll_hashes, path):
+    """ Write roll hashes to a csv """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['season_site_roll', 'roll_hash'])
+        for season_site_roll_key in sorted(roll_hashes.keys()):
+            writer.writerow(
+                [season_site_roll_key, roll_hashes[season_site_roll_key]])
+    set_file_permission(path)
+
+
+def find_changed_rolls(
+        inventory, roll_hashes, previous_roll_hashes,
+        required_columns=ROLL_GROUPING_COLUMNS.keys()):
+    """ Find rolls that have to be re-grouped: rolls with a changed
+        hash or with images without grouping data
+    """
+    changed_rolls = {
+        k for k, v in roll_hashes.items()
+        if previous_roll_hashes.get(k) != v}
+    for image_data in inventory.values():
+        season_site_roll_key = _season_site_roll_key(image_data)
+        if season_site_roll_key in changed_rolls:
+            continue
+        if any(image_data.get(x, '') == '' for x in required_columns):
+            changed_rolls.add(season_site_roll_key)
+    return changed_rolls
+
+
+def select_rolls(inventory, season_site_roll_keys):
+    """ Select the images of some rolls - rows are shared with
+        'inventory' (updates are visible in both)
+    """
+    return OrderedDict(
+        (image_id, image_data) for image_id, image_data in inventory.items()
+        if _season_site_roll_key(image_data) in season_site_roll_keys)
+
+
+def group_rolls_into_captures(
+        inventory, flags, changed_rolls=None,
+        time_delta_calculator=calculate_time_deltas,
+        capture_grouper=group_images_into_captures,
+        update_image_names=False):
+    """ Calculate time deltas, group images into captures, update
+        capture ids (and image names) and time checks
+        changed_rolls: set of season#site#roll keys to re-group, images
+            of other rolls keep their (previously calculated) values
+            (all rolls if None)
+    """
+    if changed_rolls is None:
+        to_group = inventory
+    else:
+        to_group = select_rolls(inventory, changed_rolls)
+        logger.info("Re-grouping {} images of {} changed rolls".format(
+            len(to_group), len(changed_rolls)))
+    time_deltas = time_delta_calculator(to_group, flags)
+    update_inventory_with_capture_data(to_group, time_deltas)
+    image_to_capture = capture_grouper(to_group, flags)
+    update_inventory_with_capture_data(to_group, image_to_capture)
+    update_inventory_with_capture_id(to_group)
+    if update_image_names:
+        update_inventory_with_image_names(to_group)
+    update_time_checks_inventory(to_group, flags)
+    if changed_rolls is None:
+        return
+    # values of unchanged rolls were read from csv (strings)
+    for image_data in inventory.values():
+        if _season_site_roll_key(image_data) in changed_rolls:
+            continue
+        for column, column_type in ROLL_GROUPING_COLUMNS.items():
+            if column_type is int:
+                image_data[column] = int(float(image_data[column]))
+            elif column_type is float:
+                image_data[column] = float(image_data[column])
+
+
 if __name__ == '__main__':
 
     # Parse command line arguments
@@ -214,6 +464,18 @@ if __name__ == '__main__':
     parser.add_argument("--output_csv", type=str, required=True)
     parser.add_argument("--no_older_than_year", type=int, default=1970)
     parser.add_argument("--no_newer_than_year", type=int, default=9999)
+    parser.add_argument(
+        "--engine", type=str, default='dict',
+        choices=['dict', 'vectorized'],
+        help="Grouping engine: 'dict' processes each roll separately, \
+              'vectorized' processes all images at once (faster, \
+              identical output)")
+    parser.add_argument(
+        "--roll_hashes", type=str, default=None,
+        help="Path to a csv with content hashes of all rolls - if it \
+              exists only rolls whose images or datetimes changed \
+              are re-grouped (requires an already grouped \
+              inventory), it is created / updated after grouping")
     parser.add_argument("--log_dir", type=str, default=None)
     parser.add_argument(
         "--log_filename", type=str, default='group_inventory_into_captures')
@@ -236,19 +498,29 @@ if __name__ == '__main__':
         args['inventory'],
         unique_id='image_path_original')
 
-    # calculate time_deltas
-    time_deltas = calculate_time_deltas(inventory, flags)
-    update_inventory_with_capture_data(inventory, time_deltas)
-
-    # group images into captures
-    image_to_capture = group_images_into_captures(inventory, flags)
-    update_inventory_with_capture_data(inventory, image_to_capture)
-
-    update_inventory_with_capture_id(inventory)
-
-    update_inventory_with_image_names(inventory)
-
-    update_time_checks_inventory(inventory, flags)
+    if args['engine'] == 'vectorized':
+        time_delta_calculator = calculate_time_deltas_vectorized
+        capture_grouper = group_images_into_captures_vectorized
+    else:
+        time_delta_calculator = calculate_time_deltas
+        capture_grouper = group_images_into_captures
+
+    # find rolls that changed since the last grouping
+    changed_rolls = None
+    if args['roll_hashes'] is not None:
+        roll_hashes = calculate_roll_hashes(inventory, flags)
+        if os.path.isfile(args['roll_hashes']):
+            changed_rolls = find_changed_rolls(
+                inventory, roll_hashes, read_roll_hashes(args['roll_hashes']),
+                required_columns=list(ROLL_GROUPING_COLUMNS.keys()) +
+                IMAGE_NAME_COLUMNS)
+
+    # calculate time_deltas, group images into captures
+    group_rolls_into_captures(
+        inventory, flags, changed_rolls=changed_rolls,
+        time_delta_calculator=time_delta_calculator,
+        capture_grouper=capture_grouper,
+        update_image_names=True)
 
     image_check_stats(inventory)
 
@@ -266,3 +538,6 @@ if __name__ == '__main__':
             inventory,
             args['output_csv'],
             first_cols=first_cols_to_export)
+
+    if args['roll_hashes'] is not None:
+        write_roll_hashes(roll_hashes, args['roll_hashes'])
@@ -0,0 +1,202 @@
+""" Column Store of an Image Inventory
+    - values are stored per column (one list per column) instead of one
+      dict per image, repeated values (site, roll, flags, ..) share
+      one string object
+    - images are accessed by their unique id (e.g. image_path_original
+      or image_name), rows are dict-like views on the columns
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+import pandas as pd
+
+
+# marks cells of rows that do not have a value for a column
+_MISSING = object()
+# marks positions of deleted rows
+_DELETED = object()
+
+
+class InventoryRow(MutableMapping):
+    """ Dict-like view on one row of an ImageInventory """
+    __slots__ = ('_inventory', '_position')
+
+    def __init__(self, inventory, position):
+        self._inventory = inventory
+        self._position = position
+
+    def __getitem__(self, column):
+        value = self._inventory._columns[column][self._position]
+        if value is _MISSING:
+            raise KeyError(column)
+        return value
+
+    def __setitem__(self, column, value):
+        self._inventory._set_value(self._position, column, value)
+
+    def __delitem__(self, column):
+        if column not in self:
+            raise KeyError(column)
+        self._inventory._columns[column][self._position] = _MISSING
+
+    def __contains__(self, column):
+        values = self._inventory._columns.get(column)
+        return values is not None and values[self._position] is not _MISSING
+
+    def __iter__(self):
+        for column, values in self._inventory._columns.items():
+            if values[self._position] is not _MISSING:
+                yield column
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        """ Copy of the row as dict (detached from the inventory) """
+        return dict(self)
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return dict(self)
+
+
+class ImageInventory(MutableMapping):
+    """ Image inventory - maps unique ids of images to rows
+        - rows are InventoryRow views, setting a (new) key to a dict
+          stores its values in the columns
+        - iteration order is insertion order (as with an OrderedDict)
+    """
+    def __init__(self, data=None):
+        self._columns = OrderedDict()
+        self._keys = list()
+        self._index = dict()
+        if data is not None:
+            self.update(data)
+
+    @classmethod
+    def from_dataframe(cls, df, unique_id='image_path_original'):
+        """ Create an inventory from a DataFrame (no missing values)
+            unique_id: column with the ids of the images, row number
+                       if None
+            - rows with duplicate ids: the last row is kept at the
+              position of the first (as with an OrderedDict)
+        """
+        if unique_id is not None:
+            # ids in order of first occurrence, mapped to their last row
+            last_rows = {k: i for i, k in enumerate(df[unique_id])}
+            if len(last_rows) < df.shape[0]:
+                df = df.iloc[list(last_rows.values())]
+        inventory = cls()
+        for column in df.columns:
+            # share one object per distinct value
+            codes, uniques = pd.factorize(df[column])
+            inventory._columns[column] = \
+                np.asarray(uniques, dtype=object)[codes].tolist()
+        if unique_id is None:
+            inventory._keys = list(range(df.shape[0]))
+        else:
+            inventory._keys = list(inventory._columns[unique_id])
+        inventory._index = {k: i for i, k in enumerate(inventory._keys)}
+        return inventory
+
+    def _set_value(self, position, column, value):
+        if column not in self._columns:
+            self._columns[column] = [_MISSING] * len(self._keys)
+        self._columns[column][position] = value
+
+    def __getitem__(self, key):
+        return InventoryRow(self, self._index[key])
+
+    def __setitem__(self, key, data):
+        if isinstance(data, InventoryRow):
+            data = dict(data)
+        if key in self._index:
+            position = self._index[key]
+            for values in self._columns.values():
+                values[position] = _MISSING
+        else:
+            position = len(self._keys)
+            self._keys.append(key)
+            self._index[key] = position
+            for values in self._columns.values():
+                values.append(_MISSING)
+        for column, value in data.items():
+            self._set_value(position, column, value)
+
+    def __delitem__(self, key):
+        position = self._index.pop(key)
+        self._keys[position] = _DELETED
+        for values in self._columns.values():
+            values[position] = _MISSING
+
+    def __iter__(self):
+        for key in self._keys:
+            if key is not _DELETED:
+                yield key
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __repr__(self):
+        return '{}({} images, {} columns)'.format(
+            type(self).__name__, len(self), len(self._columns))
+
+    @property
+    def columns(self):
+        """ Names of all columns """
+        return list(self._columns.keys())
+
+    def column(self, column, default=''):
+        """ Values of a column (inventory order) """
+        values = self._columns.get(column)
+        if values is None:
+            return [default] * len(self)
+        return [default if v is _MISSING else v
+                for k, v in zip(self._keys, values) if k is not _DELETED]
+
+    def get_values(self, column, keys, default=''):
+        """ Values of a column for the rows of 'keys' """
+        values = self._columns.get(column)
+        if values is None:
+            return [default] * len(keys)
+        return [default if values[i] is _MISSING else values[i]
+                for i in (self._index[k] for k in keys)]
+
+    def set_values(self, column, keys, values):
+        """ Set values of a column for the rows of 'keys' """
+        if column not in self._columns:
+            self._columns[column] = [_MISSING] * len(self._keys)
+        column_values = self._columns[column]
+        for key, value in zip(keys, values):
+            column_values[self._index[key]] = value
+
+    def subset(self, keys):
+        """ New inventory with the rows of 'keys' (values are shared) """
+        positions = [self._index[k] for k in keys]
+        inventory = type(self)()
+        inventory._keys = list(keys)
+        inventory._index = {k: i for i, k in enumerate(inventory._keys)}
+        for column, values in self._columns.items():
+            column_values = [values[i] for i in positions]
+            if any(v is not _MISSING for v in column_values):
+                inventory._columns[column] = column_values
+        return inventory
+
+    def to_dataframe(self):
+        """ Convert to a DataFrame (index: image ids, missing: NaN) """
+        data = OrderedDict()
+        for column in self._columns.keys():
+            values = self.column(column, default=_MISSING)
+            # columns without any value are not part of the inventory
+            if all(v is _MISSING for v in values):
+                continue
+            data[column] = [np.nan if v is _MISSING else v for v in values]
+        return pd.DataFrame(data, index=list(self), columns=list(data.keys()))
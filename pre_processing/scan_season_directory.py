@@ -0,0 +1,207 @@
+""" Scan a Season Directory
+    - expected input, one root directory with:
+        - site_folder:
+            - site_roll_folder:
+                - image files
+    - walks the site directories in parallel threads using os.scandir
+      and stats each entry once
+    - the result (manifest) can be stored and re-used by
+      check_input_structure, create_image_inventory, check_for_duplicates
+      and basic_inventory_checks - it is re-created if the directories
+      changed since the scan
+"""
+import os
+import csv
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.logger import set_logging
+from utils.utils import check_dir_existence, set_file_permission
+from pre_processing.utils import file_creation_time_from_stat
+
+
+logger = logging.getLogger(__name__)
+
+
+SCAN_MANIFEST_COLUMNS = [
+    'level', 'site_directory', 'roll_directory', 'name', 'path',
+    'is_dir', 'size', 'mtime', 'file_creation_time']
+
+
+def _entry_record(entry, level, site_directory, roll_directory=''):
+    """ Create a manifest record from an os.DirEntry """
+    try:
+        stat = entry.stat()
+        size = stat.st_size
+        mtime = stat.st_mtime
+        file_creation_time = file_creation_time_from_stat(stat)
+    except OSError:
+        size, mtime, file_creation_time = '', '', ''
+    return {
+        'level': level,
+        'site_directory': site_directory,
+        'roll_directory': roll_directory,
+        'name': entry.name,
+        'path': entry.path,
+        'is_dir': int(entry.is_dir()),
+        'size': size,
+        'mtime': mtime,
+        'file_creation_time': file_creation_time}
+
+
+def _scan_site_directory(site_entry):
+    """ Scan roll directories and files of a site directory """
+    records = list()
+    with os.scandir(site_entry.path) as roll_entries:
+        roll_entries = list(roll_entries)
+    for roll_entry in roll_entries:
+        records.append(
+            _entry_record(roll_entry, 'roll', site_entry.name))
+        if not roll_entry.is_dir():
+            continue
+        with os.scandir(roll_entry.path) as file_entries:
+            for file_entry in file_entries:
+                records.append(_entry_record(
+                    file_entry, 'file', site_entry.name, roll_entry.name))
+    return records
+
+
+def scan_season_directory(root_dir, n_threads=8):
+    """ Scan site / roll / file entries of a season directory
+        Returns: list of dicts (one per entry) in the order of
+                 os.listdir: all sites, then rolls and files of each site
+    """
+    with os.scandir(root_dir) as site_entries:
+        site_entries = list(site_entries)
+    records = [_entry_record(x, 'site', x.name) for x in site_entries]
+    site_dir_entries = [x for x in site_entries if x.is_dir()]
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        for site_records in executor.map(
+                _scan_site_directory, site_dir_entries):
+            records += site_records
+    logger.info("Scanned {} sites, {} rolls, {} files in {}".format(
+        sum([x['level'] == 'site' for x in records]),
+        sum([x['level'] == 'roll' for x in records]),
+        sum([x['level'] == 'file' for x in records]),
+        root_dir))
+    return records
+
+
+def write_scan_manifest(records, path):
+    """ Write scan records to a csv """
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SCAN_MANIFEST_COLUMNS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(
+                {k: repr(v) if isinstance(v, float) else v
+                 for k, v in record.items()})
+    set_file_permission(path)
+
+
+def read_scan_manifest(path):
+    """ Read scan records from a csv """
+    records = list()
+    with open(path, 'r', newline='') as f:
+        for record in csv.DictReader(f):
+            record['is_dir'] = int(record['is_dir'])
+            if record['size'] != '':
+                record['size'] = int(record['size'])
+                record['mtime'] = float(record['mtime'])
+                record['file_creation_time'] = \
+                    float(record['file_creation_time'])
+            records.append(record)
+    return records
+
+
+def scan_manifest_is_current(records, root_dir):
+    """ Check if scan records are a scan of 'root_dir' and no directory
+        changed since the scan - compares the entries of 'root_dir' and
+        the modification times of the site / roll directories (these
+        change if files are added, removed or renamed, but not if files
+        are re-written in place)
+    """
+    site_records = [x for x in records if x['level'] == 'site']
+    try:
+        site_names = os.listdir(root_dir)
+    except OSError:
+        return False
+    if sorted(site_names) != sorted([x['name'] for x in site_records]):
+        return False
+    for record in site_records:
+        if record['path'] != os.path.join(root_dir, record['name']):
+            return False
+    for record in records:
+        if record['level'] == 'file' or not record['is_dir']:
+            continue
+        try:
+            if os.stat(record['path']).st_mtime != record['mtime']:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def scan_root_dir(records):
+    """ Root directory of scan records (None if there are no sites) """
+    for record in records:
+        if record['level'] == 'site':
+            return os.path.dirname(record['path'])
+    return None
+
+
+def get_scan_records(root_dir, scan_manifest=None, n_threads=8):
+    """ Read the scan records from 'scan_manifest' if it exists and is
+        current (see scan_manifest_is_current), otherwise scan 'root_dir'
+        (and store the manifest)
+        root_dir: None to use the root directory of the manifest
+    """
+    if scan_manifest is not None and os.path.isfile(scan_manifest):
+        records = read_scan_manifest(scan_manifest)
+        if root_dir is None:
+            root_dir = scan_root_dir(records)
+            if root_dir is None:
+                return records
+        if scan_manifest_is_current(records, root_dir):
+            logger.info("Reading scan manifest {}".format(scan_manifest))
+            return records
+        logger.info(
+            "Scan manifest {} is not a current scan of {} - "
+            "re-scanning".format(scan_manifest, root_dir))
+    records = scan_season_directory(root_dir, n_threads=n_threads)
+    if scan_manifest is not None:
+        write_scan_manifest(records, scan_manifest)
+        logger.info("Wrote scan manifest {}".format(scan_manifest))
+    return records
+
+
+if __name__ == '__main__':
+
+    # Parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--root_dir", type=str, required=True,
+        help="Root directory of the organized camera-trap data -- \
+        contains the site folders.")
+    parser.add_argument(
+        "--scan_manifest", type=str, required=True,
+        help="Path to the csv to store the scan results.")
+    parser.add_argument(
+        "--n_threads", type=int, default=8,
+        help="Number of threads to scan site directories in parallel")
+    parser.add_argument(
+        "--log_dir", type=str, default=None)
+    parser.add_argument(
+        "--log_filename", type=str,
+        default='scan_season_directory')
+    args = vars(parser.parse_args())
+
+    check_dir_existence(args['root_dir'])
+
+    set_logging(args['log_dir'], args['log_filename'])
+
+    records = scan_season_directory(
+        args['root_dir'], n_threads=args['n_threads'])
+    write_scan_manifest(records, args['scan_manifest'])
+    logger.info("Wrote scan manifest {}".format(args['scan_manifest']))
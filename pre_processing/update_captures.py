@@ -2,18 +2,18 @@
 import os
 import argparse
 import logging
-from collections import OrderedDict
 
 from utils.logger import set_logging
 from config.cfg import cfg
 from pre_processing.utils import (
     read_image_inventory, export_inventory_to_csv, image_check_stats)
+from pre_processing.inventory import ImageInventory
 from pre_processing.group_inventory_into_captures import (
-    group_images_into_captures,
-    update_inventory_with_capture_data,
-    update_time_checks_inventory,
-    calculate_time_deltas,
-    update_inventory_with_capture_id
+    group_rolls_into_captures,
+    calculate_roll_hashes,
+    find_changed_rolls,
+    read_roll_hashes,
+    write_roll_hashes
 )
 
 
@@ -37,12 +37,12 @@ def include_image(image_data):
 
 def select_valid_images(captures):
     """ Select valid images """
-    captures_updated = OrderedDict()
-    for image_name, image_data in captures.items():
-        if not include_image(image_data):
-            continue
-        captures_updated[image_name] = {k: v for k, v in image_data.items()}
-    return captures_updated
+    if not isinstance(captures, ImageInventory):
+        captures = ImageInventory(captures)
+    valid_images = [
+        image_name for image_name, image_data in captures.items()
+        if include_image(image_data)]
+    return captures.subset(valid_images)
 
 
 if __name__ == '__main__':
@@ -53,6 +53,12 @@ if __name__ == '__main__':
     parser.add_argument("--captures_updated", type=str, required=True)
     parser.add_argument("--no_older_than_year", type=int, default=1970)
     parser.add_argument("--no_newer_than_year", type=int, default=9999)
+    parser.add_argument(
+        "--roll_hashes", type=str, default=None,
+        help="Path to a csv with content hashes of all rolls - if it \
+              exists only rolls whose images or datetimes changed \
+              (e.g. by deletions or timechanges) are re-grouped, \
+              it is created / updated after grouping")
     parser.add_argument("--log_dir", type=str, default=None)
     parser.add_argument(
         "--log_filename", type=str, default='update_captures')
@@ -80,17 +86,18 @@ if __name__ == '__main__':
 
     captures_updated = select_valid_images(captures)
 
-    # re-calculate time_deltas
-    time_deltas = calculate_time_deltas(captures_updated, flags)
-    update_inventory_with_capture_data(captures_updated, time_deltas)
-
-    # update grouping of images into captures
-    image_to_capture = group_images_into_captures(captures_updated, flags)
-    update_inventory_with_capture_data(captures_updated, image_to_capture)
+    # find rolls that changed since the last grouping
+    changed_rolls = None
+    if args['roll_hashes'] is not None:
+        roll_hashes = calculate_roll_hashes(captures_updated, flags)
+        if os.path.isfile(args['roll_hashes']):
+            changed_rolls = find_changed_rolls(
+                captures_updated, roll_hashes,
+                read_roll_hashes(args['roll_hashes']))
 
-    update_inventory_with_capture_id(captures_updated)
-
-    update_time_checks_inventory(captures_updated, flags)
+    # re-calculate time_deltas and grouping of images into captures
+    group_rolls_into_captures(
+        captures_updated, flags, changed_rolls=changed_rolls)
 
     image_check_stats(captures_updated)
 
@@ -104,3 +111,6 @@ if __name__ == '__main__':
             captures_updated,
             args['captures_updated'],
             first_cols=first_cols_to_export)
+
+    if args['roll_hashes'] is not None:
+        write_roll_hashes(roll_hashes, args['roll_hashes'])
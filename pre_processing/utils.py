@@ -12,6 +12,7 @@ import csv
 
 from collections import defaultdict, Counter, OrderedDict
 from utils.utils import set_file_permission
+from pre_processing.inventory import ImageInventory
 
 logger = logging.getLogger(__name__)
 
@@ -37,10 +38,16 @@ def datetime_file_creation(path_to_file):
     See http://stackoverflow.com/a/39501288/1709587 for explanation.
     https://stackoverflow.com/questions/237079/how-to-get-file-creation-modification-date-times-in-python
     """
+    return file_creation_time_from_stat(os.stat(path_to_file))
+
+
+def file_creation_time_from_stat(stat):
+    """ File creation time (see 'datetime_file_creation') from the
+        result of os.stat / os.DirEntry.stat
+    """
     if platform.system() == 'Windows':
-        return os.path.getctime(path_to_file)
+        return stat.st_ctime
     else:
-        stat = os.stat(path_to_file)
         try:
             return stat.st_birthtime
         except AttributeError:
@@ -103,6 +110,31 @@ def p_pixels_below_threshold(pixel_data, pixel_threshold):
     return p_pixels_below_threshold
 
 
+def p_pixels_below_and_above_threshold(
+        pixel_data, below_threshold, above_threshold, block_rows=128):
+    """ Calculate share of pixels below and above thresholds in one pass
+        over blocks of rows (a pixel is below / above a threshold if
+        all its channels are)
+    """
+    n_pixels_total = np.multiply(pixel_data.shape[0], pixel_data.shape[1])
+    n_pixels_below_threshold = 0
+    n_pixels_above_threshold = 0
+    for start_row in range(0, pixel_data.shape[0], block_rows):
+        block = pixel_data[start_row:start_row + block_rows]
+        # min / max over channels (faster than reducing the channel axis)
+        block_max = block[..., 0].copy()
+        block_min = block[..., 0].copy()
+        for channel in range(1, block.shape[2]):
+            np.maximum(block_max, block[..., channel], out=block_max)
+            np.minimum(block_min, block[..., channel], out=block_min)
+        n_pixels_below_threshold += np.count_nonzero(
+            block_max < below_threshold)
+        n_pixels_above_threshold += np.count_nonzero(
+            block_min > above_threshold)
+    return (n_pixels_below_threshold / n_pixels_total,
+            n_pixels_above_threshold / n_pixels_total)
+
+
 def get_rollnum_from_roll_directory(roll_dir_name):
     """ Extract roll number from roll directory """
     return roll_dir_name.split('_')[1].split('R')[1]
@@ -153,16 +185,12 @@ def read_image_inventory_old(path, unique_id='image_path_original'):
 
 
 def read_image_inventory(path, unique_id='image_path_original'):
+    """ Import image inventory into an ImageInventory (column store)
+        unique_id: column to identify images, row number if None
+    """
     df = pd.read_csv(path, dtype='str')
     df.fillna('', inplace=True)
-    inventory = df.to_dict('index', into=OrderedDict)
-    inventory_with_index_as_col = OrderedDict()
-    for i, (_id, data) in enumerate(inventory.items()):
-        if unique_id is not None:
-            inventory_with_index_as_col[data[unique_id]] = data
-        else:
-            inventory_with_index_as_col[i] = data
-    return inventory_with_index_as_col
+    return ImageInventory.from_dataframe(df, unique_id=unique_id)
 
 
 def export_inventory_to_csv(
@@ -172,10 +200,13 @@ def export_inventory_to_csv(
                     'capture', 'image_rank_in_capture'],
         return_df=False):
     """ Export Inventory to CSV
-        inventory: dict
+        inventory: ImageInventory or dict
         output_path: path to a file that is being created
     """
-    df = pd.DataFrame.from_dict(inventory, orient='index')
+    if isinstance(inventory, ImageInventory):
+        df = inventory.to_dataframe()
+    else:
+        df = pd.DataFrame.from_dict(inventory, orient='index')
 
     # re-arrange columns
     cols = df.columns.tolist()
@@ -7,7 +7,7 @@ import pandas as pd
 
 from utils.logger import set_logging
 from utils.utils import (
-    set_file_permission,
+    set_file_permission, read_df, write_df,
     read_cleaned_season_file_df, remove_images_from_df)
 from reporting.utils import create_season_dict, exclude_cols
 from config.cfg import cfg
@@ -112,8 +112,7 @@ if __name__ == '__main__':
     ###############################
 
     # import aggregations
-    df_aggregated = pd.read_csv(args['aggregated_csv'], dtype='str')
-    df_aggregated.fillna('', inplace=True)
+    df_aggregated = read_df(args['aggregated_csv'])
     df_aggregated.loc[df_aggregated.season == '', 'season'] = \
         args['default_season_id']
 
@@ -302,7 +301,9 @@ if __name__ == '__main__':
     df_report = df_report[cols_to_export]
 
     # export df
-    df_report.to_csv(args['output_csv'], index=False)
+    write_df(
+        df_report, args['output_csv'],
+        categorical_cols=flags_global['PARQUET_CATEGORICAL_COLUMNS'])
 
     logger.info("Wrote {} records to {}".format(
         df_report.shape[0], args['output_csv']))
@@ -1,9 +1,17 @@
 """ Test Plurality Aggregations """
 import unittest
 import logging
+import random
+import os
+import csv
+import tempfile
+import shutil
+
+import pandas as pd
 
 from aggregations.aggregate_annotations_plurality import (
-    aggregate_subject_annotations)
+    aggregate_subject_annotations, aggregate_annotations,
+    aggregate_annotations_vectorized, aggregate_annotations_sharded)
 from config.cfg import cfg_default as cfg
 from aggregations import aggregator
 
@@ -329,6 +337,75 @@ class AggregateAnnotationsPluralityTests(unittest.TestCase):
                'question__standing': '0.33'}}
         self.assertEqual(actual_species_aggs, expected_spcies_aggs)
 
+    def assertVectorizedEqualsDictEngine(self, subject_annotations):
+        expected = pd.DataFrame(aggregate_annotations(
+            subject_annotations,
+            self.questions,
+            self.question_type_map,
+            self.question_main_id))
+        df_annotations = pd.DataFrame(
+            [{'subject_id': subject_id, **anno}
+             for subject_id, annos in subject_annotations.items()
+             for anno in annos])
+        actual = aggregate_annotations_vectorized(
+            df_annotations,
+            self.questions,
+            self.question_type_map,
+            self.question_main_id)
+        pd.testing.assert_frame_equal(actual, expected)
+
+    def testVectorizedEngineTestSubjects(self):
+        self.assertVectorizedEqualsDictEngine(self.test_subjects)
+
+    def testVectorizedEngineRandomSubjects(self):
+        random.seed(123)
+        species = ['zebra', 'eland', 'lion', 'blank']
+        counts = ['', '1', '2', '4', '10', '11-50', '51+']
+        subject_annotations = dict()
+        for subject_no in range(300):
+            annos = list()
+            for user_no in random.sample(range(20), random.randint(1, 8)):
+                user = 'u{}'.format(user_no)
+                cid = 'c{}_{}'.format(subject_no, user_no)
+                for sp in random.sample(species, random.randint(1, 2)):
+                    annos.append({
+                        'user_name': user,
+                        'classification_id': cid,
+                        'question__species': sp,
+                        'question__count': random.choice(counts),
+                        'question__standing': random.choice(['', '0', '1'])})
+            subject_annotations['s{}'.format(random.randint(0, 10**6))] = annos
+        self.assertVectorizedEqualsDictEngine(subject_annotations)
+
+    def testShardedAggregation(self):
+        expected = aggregate_annotations(
+            self.test_subjects,
+            self.questions,
+            self.question_type_map,
+            self.question_main_id)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            annotations_path = os.path.join(tmp_dir, 'annotations.csv')
+            with open(annotations_path, 'w') as f:
+                csv_writer = csv.writer(f, delimiter=',')
+                csv_writer.writerow(['subject_id'] + self.required_fields)
+                for subject_id, annos in self.test_subjects.items():
+                    for anno in annos:
+                        csv_writer.writerow(
+                            [subject_id] +
+                            [anno[x] for x in self.required_fields])
+            for engine in ['dict', 'vectorized']:
+                actual = aggregate_annotations_sharded(
+                    annotations_path,
+                    self.questions,
+                    self.question_type_map,
+                    self.question_main_id,
+                    n_processes=2,
+                    engine=engine)
+                self.assertEqual(actual, expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
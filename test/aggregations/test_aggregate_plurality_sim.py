@@ -0,0 +1,79 @@
+""" Test Plurality Aggregation Simulations """
+import unittest
+import random
+
+from aggregations.aggregate_plurality_sim import (
+    aggregate_subject_annotations,
+    aggregate_subject_annotations_first_n_users,
+    extract_first_n_users_annotations)
+from config.cfg import cfg_default as cfg
+from aggregations import aggregator
+
+
+flags = cfg['plurality_aggregation_flags']
+flags_global = cfg['global_processing_flags']
+
+
+class AggregatePluralitySimTests(unittest.TestCase):
+
+    def setUp(self):
+        self.questions = ['question__species', 'question__count',
+                          'question__standing']
+        self.question_main_id = flags_global['QUESTION_DELIMITER'].join(
+            [flags_global['QUESTION_PREFIX'], flags_global['QUESTION_MAIN']])
+        self.question_type_map = aggregator.create_question_type_map(
+            self.questions, flags, flags_global)
+        self.n_users_to_use = [1, 2, 3, 5, 8, 99, 2]
+
+        random.seed(42)
+        species = ['zebra', 'eland', 'lion', 'blank']
+        self.subjects = list()
+        for _ in range(100):
+            subject_data = list()
+            for user_no in random.sample(range(20), random.randint(1, 10)):
+                for sp in random.sample(species, random.randint(1, 2)):
+                    subject_data.append({
+                        'user_name': 'u{}'.format(user_no),
+                        'classification_id': 'c{}'.format(user_no),
+                        'question__species': sp,
+                        'question__count': random.choice(['', '1', '11-50']),
+                        'question__standing': random.choice(['', '0', '1'])})
+            self.subjects.append(subject_data)
+
+    def aggregateEachN(self, subject_data):
+        records = list()
+        for n_users in self.n_users_to_use:
+            record = aggregate_subject_annotations(
+                extract_first_n_users_annotations(subject_data, n_users),
+                self.questions,
+                self.question_type_map,
+                self.question_main_id)
+            record['aggregation_info']['max_users_used'] = n_users
+            records.append(record)
+        return records
+
+    def testFirstNUsersSinglePass(self):
+        for subject_data in self.subjects:
+            actual = aggregate_subject_annotations_first_n_users(
+                subject_data,
+                self.n_users_to_use,
+                self.questions,
+                self.question_type_map,
+                self.question_main_id)
+            self.assertEqual(actual, self.aggregateEachN(subject_data))
+
+    def testFirstNUsersNonContiguous(self):
+        for subject_data in self.subjects:
+            subject_data = list(subject_data)
+            random.shuffle(subject_data)
+            actual = aggregate_subject_annotations_first_n_users(
+                subject_data,
+                self.n_users_to_use,
+                self.questions,
+                self.question_type_map,
+                self.question_main_id)
+            self.assertEqual(actual, self.aggregateEachN(subject_data))
+
+
+if __name__ == '__main__':
+    unittest.main()
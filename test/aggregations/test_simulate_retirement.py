@@ -0,0 +1,111 @@
+""" Test Retirement Simulations """
+import unittest
+import random
+
+from aggregations.simulate_retirement import (
+    consensus_of_first_n_users,
+    group_user_annotations,
+    simulate_subjects,
+    summarize_simulations)
+from aggregations.aggregate_plurality_sim import (
+    aggregate_subject_annotations,
+    extract_first_n_users_annotations)
+from config.cfg import cfg_default as cfg
+from aggregations import aggregator
+
+
+flags = cfg['plurality_aggregation_flags']
+flags_global = cfg['global_processing_flags']
+
+
+class SimulateRetirementTests(unittest.TestCase):
+
+    def setUp(self):
+        self.questions = ['question__species', 'question__count']
+        self.question_main_id = flags_global['QUESTION_DELIMITER'].join(
+            [flags_global['QUESTION_PREFIX'], flags_global['QUESTION_MAIN']])
+        self.question_type_map = aggregator.create_question_type_map(
+            self.questions, flags, flags_global)
+        self.n_users_to_use = [1, 2, 3, 5, 8, 99]
+
+        random.seed(42)
+        species = ['zebra', 'eland', 'lion', 'blank']
+        self.subjects = dict()
+        for subject_no in range(50):
+            subject_data = list()
+            for user_no in random.sample(range(20), random.randint(1, 10)):
+                for sp in random.sample(species, random.randint(1, 2)):
+                    subject_data.append({
+                        'user_name': 'u{}'.format(user_no),
+                        'classification_id': 'c{}'.format(user_no),
+                        'question__species': sp,
+                        'question__count': random.choice(['', '1', '11-50'])})
+            self.subjects['s{}'.format(subject_no)] = subject_data
+        self.subject_annotations = {
+            subject_id: [
+                (x['user_name'], (x['question__species'],
+                 x['classification_id'], x['question__count']))
+                for x in subject_data]
+            for subject_id, subject_data in self.subjects.items()}
+
+    def testConsensusMatchesPluralityAggregation(self):
+        for subject_id, subject_data in self.subjects.items():
+            users = group_user_annotations(
+                self.subject_annotations[subject_id])
+            results = consensus_of_first_n_users(users, self.n_users_to_use)
+            for n_users, (species, counts, pielou) in zip(
+                    self.n_users_to_use, results):
+                expected = aggregate_subject_annotations(
+                    extract_first_n_users_annotations(subject_data, n_users),
+                    self.questions,
+                    self.question_type_map,
+                    self.question_main_id)
+                self.assertEqual(
+                    list(species), expected['consensus_species'])
+                self.assertEqual(
+                    '{:.2f}'.format(pielou),
+                    expected['aggregation_info']['pielous_evenness_index'])
+                for sp, count in zip(species, counts):
+                    if sp == flags_global['QUESTION_MAIN_EMPTY']:
+                        continue
+                    self.assertEqual(
+                        count,
+                        expected['species_aggregations'][sp]
+                                ['question__count_median'])
+
+    def testSimulationIsDeterministic(self):
+        for mode in ['permutation', 'bootstrap']:
+            serial = simulate_subjects(
+                self.subject_annotations, self.n_users_to_use, 20,
+                mode=mode, seed=1)
+            parallel = simulate_subjects(
+                self.subject_annotations, self.n_users_to_use, 20,
+                mode=mode, seed=1, n_processes=2)
+            self.assertEqual(serial, parallel)
+            # results of a subject do not depend on the other subjects
+            subject_id = 's7'
+            single = simulate_subjects(
+                {subject_id: self.subject_annotations[subject_id]},
+                self.n_users_to_use, 20, mode=mode, seed=1)
+            self.assertEqual(single[0], serial[7])
+
+    def testSummary(self):
+        subject_results = simulate_subjects(
+            self.subject_annotations, self.n_users_to_use, 20, seed=1)
+        summary = summarize_simulations(
+            subject_results, self.n_users_to_use, 20)
+        summary_all = [
+            x for x in summary if x['consensus_species'] == 'all']
+        self.assertEqual(len(summary_all), len(self.n_users_to_use))
+        for row in summary_all:
+            self.assertEqual(row['n_subjects'], len(self.subjects))
+            self.assertLessEqual(
+                float(row['p_consensus_flip_ci_low']),
+                float(row['p_consensus_flip']))
+            self.assertLessEqual(
+                float(row['p_consensus_flip']),
+                float(row['p_consensus_flip_ci_high']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,8 @@ import unittest
 import logging
 from unittest.mock import patch
 
-from pre_processing.actions import apply_action
+from pre_processing.actions import apply_action, apply_actions_batch
+from pre_processing.inventory import ImageInventory
 
 from config.cfg import cfg_default as cfg
 
@@ -151,3 +152,94 @@ class ApplyActionsTests(unittest.TestCase):
                 'action_taken': 'delete',
                 'action_taken_reason': 'corrupt'}
         self.assertEqual(image_data, expected)
+
+
+class ApplyActionsBatchTests(unittest.TestCase):
+    """ Test Batch Application of Actions """
+    def setUp(self):
+        self.captures = {
+            '1.JPG': {'image_name': '1.JPG', 'image_path': '/d/1.JPG',
+                      'datetime': '2000-01-01 00:00:00'},
+            '2.JPG': {'image_name': '2.JPG', 'image_path': '/d/2.JPG',
+                      'datetime': '2000-12-31 23:59:30'},
+            '3.JPG': {'image_name': '3.JPG', 'image_path': '/d/3.JPG',
+                      'datetime': '2000-01-01 00:00:00'}}
+        self.actions = [
+            {'image': '1.JPG', 'action': 'invalidate',
+             'reason': 'all_black', 'shift_time_by_seconds': 0},
+            {'image': '2.JPG', 'action': 'timechange',
+             'reason': 'clock', 'shift_time_by_seconds': 60},
+            {'image': '1.JPG', 'action': 'timechange',
+             'reason': 'clock', 'shift_time_by_seconds': -3600},
+            {'image': '2.JPG', 'action': 'delete',
+             'reason': 'corrupt', 'shift_time_by_seconds': 0},
+            {'image': '1.JPG', 'action': 'mark_datetime_uncertain',
+             'reason': 'unclear', 'shift_time_by_seconds': 0}]
+
+    @patch('pre_processing.actions.os.remove')
+    def testIdenticalToSingleActions(self, mock_remove):
+        expected = {k: dict(v) for k, v in self.captures.items()}
+        for action in self.actions:
+            apply_action(expected[action['image']], action, flags)
+        captures = ImageInventory(self.captures)
+        apply_actions_batch(captures, self.actions, flags)
+        self.assertEqual({k: dict(v) for k, v in captures.items()}, expected)
+        self.assertEqual(captures['2.JPG']['datetime'], '2001-01-01 00:00:30')
+        self.assertNotIn('action_taken', captures['3.JPG'])
+
+    @patch('pre_processing.actions.os.remove')
+    def testAuditTrail(self, mock_remove):
+        captures = ImageInventory(self.captures)
+        audit = apply_actions_batch(captures, self.actions, flags)
+        self.assertIn(
+            ('1.JPG', 'timechange', 'clock', 'datetime',
+             '2000-01-01 00:00:00', '1999-12-31 23:00:00'), audit)
+        self.assertIn(
+            ('2.JPG', 'delete', 'corrupt', '', '/d/2.JPG', 'deleted'), audit)
+        self.assertIn(
+            ('1.JPG', 'invalidate', 'all_black', 'image_is_invalid', '', '1'),
+            audit)
+
+    def testShiftsAreAppliedInTurn(self):
+        actions = [
+            {'image': image, 'action': 'timechange', 'reason': 'clock',
+             'shift_time_by_seconds': seconds}
+            for image, seconds in [
+                ('1.JPG', 0.6), ('3.JPG', 30), ('1.JPG', 0.6),
+                ('1.JPG', -1.5)]]
+        expected = {k: dict(v) for k, v in self.captures.items()}
+        for action in actions:
+            apply_action(expected[action['image']], action, flags)
+        captures = ImageInventory(self.captures)
+        audit = apply_actions_batch(captures, actions, flags)
+        self.assertEqual({k: dict(v) for k, v in captures.items()}, expected)
+        self.assertEqual(captures['1.JPG']['datetime'], '1999-12-31 23:59:58')
+        self.assertEqual(
+            [x[4:] for x in audit if x[0] == '1.JPG'],
+            [('2000-01-01 00:00:00', '2000-01-01 00:00:00'),
+             ('2000-01-01 00:00:00', '2000-01-01 00:00:00'),
+             ('2000-01-01 00:00:00', '1999-12-31 23:59:58')])
+
+    def testInvalidTimesRaiseAsSingleActions(self):
+        action = {'image': '3.JPG', 'action': 'timechange',
+                  'reason': 'clock', 'shift_time_by_seconds': 10}
+        for date_time, error in [
+                ('', ValueError), ('not a time', ValueError),
+                (None, KeyError)]:
+            captures = {k: dict(v) for k, v in self.captures.items()}
+            if date_time is None:
+                del captures['3.JPG']['datetime']
+            else:
+                captures['3.JPG']['datetime'] = date_time
+            with self.assertRaises(error):
+                apply_action(dict(captures['3.JPG']), action, flags)
+            with self.assertRaises(error):
+                apply_actions_batch(
+                    ImageInventory(captures), [action], flags)
+
+    def testUnknownImage(self):
+        captures = ImageInventory(self.captures)
+        action = {'image': '4.JPG', 'action': 'invalidate',
+                  'reason': 'all_black', 'shift_time_by_seconds': 0}
+        with self.assertRaises(KeyError):
+            apply_actions_batch(captures, [action], flags)
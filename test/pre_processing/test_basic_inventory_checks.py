@@ -0,0 +1,68 @@
+import unittest
+import os
+import tempfile
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from pre_processing.basic_inventory_checks import (
+    check_image, check_images, compare_check_scales)
+from config.cfg import cfg
+
+
+flags = cfg['pre_processing_flags']
+
+
+class BasicInventoryChecksTests(unittest.TestCase):
+    """ Test Image Checks """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.expected = dict()
+        images = {
+            'black.jpg': (np.zeros((200, 300, 3)), ('all_black', )),
+            'white.jpg': (np.full((200, 300, 3), 255), ('all_white', )),
+            'normal.jpg': (
+                np.random.RandomState(1).randint(0, 255, (200, 300, 3)),
+                ())}
+        for image_name, (pixels, expected) in images.items():
+            image_path = os.path.join(self.test_dir, image_name)
+            Image.fromarray(pixels.astype(np.uint8)).save(image_path)
+            self.expected[image_path] = expected
+        corrupt_path = os.path.join(self.test_dir, 'corrupt.jpg')
+        with open(corrupt_path, 'w') as f:
+            f.write('not an image')
+        self.expected[corrupt_path] = ('corrupt_file', )
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def testCheckImage(self):
+        for image_path, expected in self.expected.items():
+            actual_path, creation_date, failed_checks = check_image(
+                image_path, 'Africa/Johannesburg')
+            self.assertEqual(actual_path, image_path)
+            self.assertNotEqual(creation_date, '')
+            self.assertEqual(failed_checks, expected)
+
+    def testCheckImagesParallel(self):
+        image_paths = list(self.expected.keys()) * 5
+        expected = [
+            check_image(x, 'Africa/Johannesburg') for x in image_paths]
+        actual = list(check_images(
+            image_paths, 'Africa/Johannesburg', n_processes=2, chunksize=3))
+        self.assertEqual(actual, expected)
+
+    def testCheckImageReducedResolution(self):
+        for image_path, expected in self.expected.items():
+            _, _, failed_checks = check_image(
+                image_path, 'Africa/Johannesburg', scale=8)
+            self.assertEqual(failed_checks, expected)
+        comparison = compare_check_scales(self.expected.keys(), 8)
+        self.assertEqual(comparison['n_images'], 3)
+        self.assertEqual(comparison['n_images_different_result'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import tempfile
+import shutil
+
+from pre_processing.check_for_duplicates import check_for_duplicates
+from utils.hash_index import open_hash_index, get_indexed_hashes
+from utils.utils import get_hash, hash_files, HASH_ALGORITHMS
+
+
+class CheckForDuplicatesTests(unittest.TestCase):
+    """ Test Duplicate Check with Hash Index """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        file_contents = {
+            'a.jpg': b'a' * 2000,
+            'a_copy.jpg': b'a' * 2000,
+            'b.jpg': b'a' * 1999 + b'b',
+            'c.jpg': b'c' * 100}
+        self.paths = list()
+        for file_name, content in file_contents.items():
+            path = os.path.join(self.test_dir, file_name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.paths.append(path)
+        self.hash_index_path = os.path.join(self.test_dir, 'hashes.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def testDuplicatesWithHashIndex(self):
+        expected = check_for_duplicates(self.paths)
+        self.assertEqual(len(expected), 1)
+        hash_index = open_hash_index(self.hash_index_path)
+        actual = check_for_duplicates(self.paths, hash_index=hash_index)
+        hash_index.close()
+        self.assertEqual(actual, expected)
+        # re-use the stored hashes
+        hash_index = open_hash_index(self.hash_index_path)
+        n_indexed = hash_index.execute(
+            "SELECT COUNT(*) FROM file_hashes "
+            "WHERE full_hash IS NOT NULL").fetchone()[0]
+        self.assertEqual(n_indexed, 3)
+        actual = check_for_duplicates(self.paths, hash_index=hash_index)
+        hash_index.close()
+        self.assertEqual(actual, expected)
+
+    def testHashIndexInvalidation(self):
+        hash_index = open_hash_index(self.hash_index_path)
+        path = self.paths[0]
+        self.assertEqual(
+            get_indexed_hashes(hash_index, [path]), [get_hash(path)])
+        with open(path, 'wb') as f:
+            f.write(b'changed')
+        self.assertEqual(
+            get_indexed_hashes(hash_index, [path]), [get_hash(path)])
+        self.assertEqual(
+            get_indexed_hashes(hash_index, [path], first_chunk_only=True),
+            [get_hash(path, first_chunk_only=True)])
+        hash_index.close()
+
+    def testHashFilesParallel(self):
+        paths = self.paths + [os.path.join(self.test_dir, 'missing.jpg')]
+        for hash in HASH_ALGORITHMS.values():
+            for first_chunk_only in [True, False]:
+                expected = [
+                    get_hash(x, first_chunk_only=first_chunk_only, hash=hash)
+                    for x in self.paths] + [None]
+                actual = hash_files(
+                    paths, first_chunk_only=first_chunk_only, hash=hash,
+                    n_threads=3)
+                self.assertEqual(actual, expected)
+        duplicates = check_for_duplicates(
+            self.paths, hash=HASH_ALGORITHMS['blake2b'], n_threads=2)
+        self.assertEqual(len(duplicates), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
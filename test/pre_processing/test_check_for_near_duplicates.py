@@ -0,0 +1,61 @@
+import unittest
+import os
+import random
+import tempfile
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from pre_processing.check_for_near_duplicates import (
+    check_for_near_duplicates, create_bk_tree, bk_tree_add, bk_tree_query,
+    hamming_distance)
+
+
+class CheckForNearDuplicatesTests(unittest.TestCase):
+    """ Test Near-Duplicate Check """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        rand = np.random.RandomState(1)
+        self.paths = list()
+        for image_no in range(3):
+            # smooth random images
+            pixels = rand.randint(0, 255, (6, 8, 3)).astype(np.uint8)
+            img = Image.fromarray(pixels).resize((400, 300), Image.BILINEAR)
+            path = os.path.join(self.test_dir, 'img{}.jpg'.format(image_no))
+            img.save(path, quality=95)
+            self.paths.append(path)
+        # re-encoded and resized copy of the first image
+        img = Image.open(self.paths[0])
+        path = os.path.join(self.test_dir, 'img0_copy.jpg')
+        img.resize((200, 150)).save(path, quality=50)
+        self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def testNearDuplicateClusters(self):
+        for n_processes in [1, 2]:
+            clusters = check_for_near_duplicates(
+                self.paths, max_distance=4, n_processes=n_processes)
+            self.assertEqual(
+                [sorted(x) for x in clusters],
+                [sorted([self.paths[0], self.paths[3]])])
+
+    def testBKTreeQuery(self):
+        random.seed(1)
+        values = [random.getrandbits(16) for _ in range(500)]
+        tree = create_bk_tree()
+        for i, value in enumerate(values):
+            bk_tree_add(tree, value, i)
+        for query in values[0:50]:
+            expected = sorted(
+                (hamming_distance(query, x), i) for i, x in enumerate(values)
+                if hamming_distance(query, x) <= 3)
+            actual = sorted(bk_tree_query(tree, query, 3))
+            self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
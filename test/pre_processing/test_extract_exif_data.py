@@ -0,0 +1,134 @@
+""" Test EXIF Extraction against a Stand-in for exiftool """
+import os
+import sys
+import json
+import types
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# pyexiftool is only required to run exiftool, the tests use a stand-in
+try:
+    import exiftool
+except ImportError:
+    exiftool = types.ModuleType('exiftool')
+    sys.modules['exiftool'] = exiftool
+
+from pre_processing.extract_exif_data import (
+    _execute_exiftool_batch, extract_exif_image_list, read_exif_checkpoint,
+    exif_images_to_extract)
+
+
+class FakeExifTool(object):
+    """ Stand-in for exiftool.ExifTool
+        - SourceFile of images in 'renamed' differs from the requested path
+          in batch calls (as exiftool may normalize paths)
+        - extraction fails for images in 'corrupt'
+    """
+    calls = list()
+
+    def __init__(self, executable_=None, renamed=(), corrupt=()):
+        self.renamed = set(renamed)
+        self.corrupt = set(corrupt)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    def execute_json(self, *image_paths):
+        FakeExifTool.calls.append(image_paths)
+        if any([x in self.corrupt for x in image_paths]):
+            raise ValueError("exiftool failed")
+        results = list()
+        for image_path in image_paths:
+            source_file = image_path
+            if (len(image_paths) > 1) and (image_path in self.renamed):
+                source_file = './' + image_path
+            results.append({
+                'SourceFile': source_file,
+                'EXIF:DateTimeOriginal': '2019:01:01 10:00:00'})
+        return results
+
+
+class ExecuteExiftoolBatchTests(unittest.TestCase):
+    """ Test _execute_exiftool_batch """
+    def setUp(self):
+        FakeExifTool.calls = list()
+        self.image_paths = ['a.JPG', 'b.JPG', 'c.JPG']
+
+    def testBatchIsExtractedInOneCall(self):
+        results = _execute_exiftool_batch(FakeExifTool(), self.image_paths)
+        self.assertEqual(FakeExifTool.calls, [tuple(self.image_paths)])
+        self.assertEqual(list(results.keys()), self.image_paths)
+        self.assertEqual(results['b.JPG']['SourceFile'], 'b.JPG')
+
+    def testUnmatchedSourceFilesAreExtractedOneByOne(self):
+        et = FakeExifTool(renamed=['b.JPG'])
+        results = _execute_exiftool_batch(et, self.image_paths)
+        self.assertEqual(
+            FakeExifTool.calls, [tuple(self.image_paths), ('b.JPG', )])
+        self.assertEqual(list(results.keys()), self.image_paths)
+        self.assertEqual(results['b.JPG']['SourceFile'], 'b.JPG')
+
+    def testFailedBatchFallsBackToSingleImages(self):
+        et = FakeExifTool(corrupt=['c.JPG'])
+        results = _execute_exiftool_batch(et, self.image_paths)
+        self.assertEqual(
+            FakeExifTool.calls[1:], [('a.JPG', ), ('b.JPG', ), ('c.JPG', )])
+        self.assertEqual(results['a.JPG']['SourceFile'], 'a.JPG')
+        self.assertIsNone(results['c.JPG'])
+
+
+class ExifCheckpointTests(unittest.TestCase):
+    """ Test extract_exif_image_list / read_exif_checkpoint """
+    def setUp(self):
+        FakeExifTool.calls = list()
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.image_paths = ['{}.JPG'.format(i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def extract(self, image_paths, file_name):
+        with mock.patch.object(
+                exiftool, 'ExifTool', FakeExifTool, create=True):
+            extract_exif_image_list(
+                0, image_paths, 'exiftool',
+                os.path.join(self.checkpoint_dir, file_name), batch_size=2)
+
+    def testResultsAreCheckpointed(self):
+        self.extract(self.image_paths, 'exif_1_000.jsonl')
+        self.assertEqual(
+            [len(x) for x in FakeExifTool.calls], [2, 2, 1])
+        results = read_exif_checkpoint(self.checkpoint_dir)
+        self.assertEqual(sorted(results.keys()), self.image_paths)
+
+    def testResumeFromCheckpoint(self):
+        self.extract(self.image_paths[:3], 'exif_1_000.jsonl')
+        # a worker crashed while writing the last record
+        with open(os.path.join(
+                self.checkpoint_dir, 'exif_1_001.jsonl'), 'w') as f:
+            f.write(json.dumps(
+                {'image_path': '3.JPG', 'tags': None}) + '\n')
+            f.write('{"image_path": "4.JPG", "ta')
+        results = read_exif_checkpoint(self.checkpoint_dir)
+        self.assertEqual(sorted(results.keys()), self.image_paths[:4])
+        self.assertIsNone(results['3.JPG'])
+        # resume: extract the missing and the failed images
+        missing = exif_images_to_extract(self.image_paths, results)
+        self.assertEqual(missing, ['3.JPG', '4.JPG'])
+        self.extract(missing, 'exif_2_000.jsonl')
+        self.assertEqual(FakeExifTool.calls[-1], ('3.JPG', '4.JPG'))
+        results = read_exif_checkpoint(self.checkpoint_dir)
+        self.assertEqual(sorted(results.keys()), self.image_paths)
+        self.assertEqual(results['3.JPG']['SourceFile'], '3.JPG')
+        self.assertEqual(results['4.JPG']['SourceFile'], '4.JPG')
+        self.assertEqual(
+            exif_images_to_extract(self.image_paths, results), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,9 @@ from collections import OrderedDict
 
 from pre_processing.generate_actions import (
     generate_actions, check_action_is_valid,
-    _check_datetime_format)
+    _check_datetime_format, create_captures_index,
+    find_all_images_for_start_end_image, find_images_for_site_roll,
+    find_images_for_site)
 from config.cfg import cfg_default as cfg
 
 
@@ -250,5 +252,54 @@ class GenerateActionsTests(unittest.TestCase):
         _check_datetime_format(test_correct_format, '%Y-%m-%d %H:%M:%S')
 
 
+class CapturesIndexTests(unittest.TestCase):
+    """ Test Image Lookup via the Captures Index """
+    def setUp(self):
+        self.captures = OrderedDict([
+            ('1.JPG', {'site': 'a', 'roll': '1'}),
+            ('3.JPG', {'site': 'a', 'roll': '2'}),
+            ('5.JPG', {'site': 'a', 'roll': '1'}),
+            ('4.JPG', {'site': 'b', 'roll': '1'}),
+            ('6.JPG', {'site': 'b', 'roll': '1'})])
+        self.captures_index = create_captures_index(self.captures)
+
+    def testImageRange(self):
+        self.assertEqual(
+            find_all_images_for_start_end_image(
+                '3.JPG', '4.JPG', self.captures_index),
+            ['3.JPG', '5.JPG', '4.JPG'])
+        self.assertEqual(
+            find_all_images_for_start_end_image(
+                '5.JPG', '5.JPG', self.captures_index),
+            ['5.JPG'])
+
+    def testImageRangeEndBeforeStartOrMissing(self):
+        """ Range continues to the end of the inventory """
+        self.assertEqual(
+            find_all_images_for_start_end_image(
+                '4.JPG', '3.JPG', self.captures_index),
+            ['4.JPG', '6.JPG'])
+        self.assertEqual(
+            find_all_images_for_start_end_image(
+                '4.JPG', '9.JPG', self.captures_index),
+            ['4.JPG', '6.JPG'])
+        self.assertEqual(
+            find_all_images_for_start_end_image(
+                '9.JPG', '4.JPG', self.captures_index),
+            [])
+
+    def testSiteAndRoll(self):
+        self.assertEqual(
+            find_images_for_site_roll('a', '1', self.captures_index),
+            ['1.JPG', '5.JPG'])
+        self.assertEqual(
+            find_images_for_site('a', self.captures_index),
+            ['1.JPG', '3.JPG', '5.JPG'])
+        self.assertEqual(
+            find_images_for_site_roll('b', '2', self.captures_index), [])
+        self.assertEqual(
+            find_images_for_site('c', self.captures_index), [])
+
+
 if __name__ == '__main__':
     unittest.main()
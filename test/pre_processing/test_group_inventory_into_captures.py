@@ -1,11 +1,17 @@
 import unittest
 import os
+import random
+import tempfile
 from pre_processing.group_inventory_into_captures import (
         calculate_time_deltas, group_images_into_captures,
+        calculate_time_deltas_vectorized,
+        group_images_into_captures_vectorized,
         update_inventory_with_capture_id, update_inventory_with_image_names,
         update_inventory_with_capture_data,
-        create_new_image_path_rel)
-from pre_processing.utils import read_image_inventory
+        create_new_image_path_rel, group_rolls_into_captures,
+        calculate_roll_hashes, find_changed_rolls)
+from pre_processing.utils import (
+    read_image_inventory, export_inventory_to_csv)
 
 from config.cfg import cfg_default as cfg
 
@@ -81,5 +87,97 @@ class GroupCapturesTests(unittest.TestCase):
         self.assertEqual(expected2, actual2)
 
 
+class GroupCapturesVectorizedTests(unittest.TestCase):
+    """ Test Vectorized Engine """
+
+    def testGroupingIntoCaptures(self):
+        file = './test/files/test_inventory.csv'
+        inventory = read_image_inventory(file)
+        time_deltas = calculate_time_deltas_vectorized(inventory, flags)
+        self.assertEqual(
+            time_deltas, calculate_time_deltas(inventory, flags))
+        update_inventory_with_capture_data(inventory, time_deltas)
+        image_to_capture = group_images_into_captures_vectorized(
+            inventory, flags)
+        self.assertEqual(
+            image_to_capture, group_images_into_captures(inventory, flags))
+        update_inventory_with_capture_data(inventory, image_to_capture)
+        for k, v in inventory.items():
+            self.assertEqual('{}'.format(v['capture_expected']),
+                             '{}'.format(v['capture']))
+
+    def testRandomInventory(self):
+        random.seed(23)
+        inventory = dict()
+        for image_no in range(2000):
+            roll = str(random.randint(1, 5))
+            image_path = '/S1/A01/A01_R{}/IMG{:04}.JPG'.format(
+                roll, random.randint(0, 9999))
+            inventory[image_path] = {
+                'season': 'S1',
+                'site': random.choice(['A01', 'B02']),
+                'roll': roll,
+                'datetime': '2019-02-{:02d} 10:{:02d}:{:02d}'.format(
+                    random.randint(1, 3), random.randint(0, 59),
+                    random.randint(0, 59))}
+        time_deltas = calculate_time_deltas_vectorized(inventory, flags)
+        self.assertEqual(
+            time_deltas, calculate_time_deltas(inventory, flags))
+        update_inventory_with_capture_data(inventory, time_deltas)
+        self.assertEqual(
+            group_images_into_captures_vectorized(inventory, flags),
+            group_images_into_captures(inventory, flags))
+
+
+class GroupChangedRollsTests(unittest.TestCase):
+    """ Test re-grouping changed rolls only """
+
+    def setUp(self):
+        inventory = read_image_inventory('./test/files/test_inventory.csv')
+        group_rolls_into_captures(inventory, flags)
+        self.roll_hashes = calculate_roll_hashes(inventory, flags)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.captures_path = os.path.join(self.tmp_dir.name, 'captures.csv')
+        export_inventory_to_csv(inventory, self.captures_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _read_and_shift_time(self):
+        captures = read_image_inventory(self.captures_path)
+        image_data = captures['/my_images/orig/1.JPG']
+        image_data['datetime'] = '2017-10-26 10:00:00'
+        return captures
+
+    def testOnlyChangedRollsAreFound(self):
+        captures = self._read_and_shift_time()
+        changed_rolls = find_changed_rolls(
+            captures, calculate_roll_hashes(captures, flags),
+            self.roll_hashes)
+        self.assertEqual(changed_rolls, {'APN_S2#A1#1'})
+        del captures['/my_images/orig/1.JPG']['capture']
+        changed_rolls = find_changed_rolls(
+            captures, self.roll_hashes, self.roll_hashes)
+        self.assertEqual(changed_rolls, {'APN_S2#A1#1'})
+
+    def testIncrementalGroupingIsIdentical(self):
+        expected = self._read_and_shift_time()
+        group_rolls_into_captures(expected, flags)
+        captures = self._read_and_shift_time()
+        changed_rolls = find_changed_rolls(
+            captures, calculate_roll_hashes(captures, flags),
+            self.roll_hashes)
+        group_rolls_into_captures(
+            captures, flags, changed_rolls=changed_rolls)
+        # identical after export (unchanged rolls keep values read from csv)
+        expected_path = os.path.join(self.tmp_dir.name, 'expected.csv')
+        actual_path = os.path.join(self.tmp_dir.name, 'actual.csv')
+        export_inventory_to_csv(expected, expected_path)
+        export_inventory_to_csv(captures, actual_path)
+        with open(expected_path) as f_expected, open(actual_path) as f_actual:
+            self.assertEqual(f_actual.read(), f_expected.read())
+        self.assertEqual(captures['/my_images/orig/2.JPG']['capture'], 2)
+
+
 if __name__ == '__main__':
     unittest.main()
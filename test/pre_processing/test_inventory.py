@@ -0,0 +1,94 @@
+""" Test the Column Store of Image Inventories """
+import os
+import copy
+import unittest
+import tempfile
+from collections import OrderedDict
+
+import pandas as pd
+
+from pre_processing.inventory import ImageInventory
+from pre_processing.utils import (
+    read_image_inventory, export_inventory_to_csv)
+
+
+class ImageInventoryTests(unittest.TestCase):
+    """ Test ImageInventory """
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'image_name': ['1.JPG', '2.JPG', '3.JPG'],
+            'site': ['a', 'a', 'b'],
+            'roll': ['1', '1', '1']})
+        self.inventory = ImageInventory.from_dataframe(
+            self.df, unique_id='image_name')
+
+    def testRowsBehaveLikeDicts(self):
+        self.assertEqual(list(self.inventory.keys()),
+                         ['1.JPG', '2.JPG', '3.JPG'])
+        row = self.inventory['2.JPG']
+        self.assertEqual(row, {'image_name': '2.JPG', 'site': 'a', 'roll': '1'})
+        row.update({'capture': 1})
+        self.assertEqual(self.inventory['2.JPG']['capture'], 1)
+        self.assertIn('capture', self.inventory['2.JPG'])
+        self.assertNotIn('capture', self.inventory['1.JPG'])
+        with self.assertRaises(KeyError):
+            self.inventory['1.JPG']['capture']
+
+    def testDuplicateIdsKeepLastRow(self):
+        df = pd.DataFrame({
+            'image_name': ['1.JPG', '2.JPG', '1.JPG', '3.JPG'],
+            'site': ['a', 'b', 'c', 'd']})
+        inventory = ImageInventory.from_dataframe(df, unique_id='image_name')
+        inventory_dict = OrderedDict(
+            (row['image_name'], row) for row in df.to_dict('records'))
+        self.assertEqual(len(inventory), 3)
+        self.assertEqual(list(inventory.keys()), list(inventory_dict.keys()))
+        self.assertEqual(inventory.column('site'), ['c', 'b', 'd'])
+        self.assertEqual(dict(inventory), inventory_dict)
+        self.assertTrue(
+            inventory.to_dataframe().equals(
+                pd.DataFrame.from_dict(inventory_dict, orient='index')))
+
+    def testRepeatedValuesAreShared(self):
+        self.assertIs(self.inventory['1.JPG']['site'],
+                      self.inventory['2.JPG']['site'])
+
+    def testSetDeleteAndCopyRows(self):
+        row_copy = copy.deepcopy(self.inventory['1.JPG'])
+        row_copy['site'] = 'c'
+        self.assertEqual(self.inventory['1.JPG']['site'], 'a')
+        self.inventory['1.JPG'] = row_copy
+        self.assertEqual(self.inventory['1.JPG']['site'], 'c')
+        del self.inventory['2.JPG']
+        self.inventory['4.JPG'] = {'image_name': '4.JPG', 'site': 'd'}
+        self.assertEqual(list(self.inventory.keys()),
+                         ['1.JPG', '3.JPG', '4.JPG'])
+        self.assertEqual(self.inventory.column('roll'), ['1', '1', ''])
+
+    def testSubset(self):
+        subset = self.inventory.subset(['3.JPG', '1.JPG'])
+        self.assertEqual(list(subset.keys()), ['3.JPG', '1.JPG'])
+        subset['3.JPG']['site'] = 'c'
+        self.assertEqual(self.inventory['3.JPG']['site'], 'b')
+
+    def testExportIsIdenticalToDictInventory(self):
+        inventory_dict = OrderedDict(
+            (k, dict(v)) for k, v in self.inventory.items())
+        for inventory in (self.inventory, inventory_dict):
+            inventory['1.JPG'].update({'capture': 1, 'datetime': ''})
+            inventory['3.JPG'].update({'capture': 2})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_columns = os.path.join(tmp_dir, 'columns.csv')
+            path_dict = os.path.join(tmp_dir, 'dict.csv')
+            export_inventory_to_csv(self.inventory, path_columns)
+            export_inventory_to_csv(inventory_dict, path_dict)
+            with open(path_columns) as f_columns, open(path_dict) as f_dict:
+                self.assertEqual(f_columns.read(), f_dict.read())
+            inventory = read_image_inventory(
+                path_columns, unique_id='image_name')
+        self.assertEqual(inventory['2.JPG']['capture'], '')
+        self.assertEqual(inventory['3.JPG']['capture'], '2.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import os
+import tempfile
+import shutil
+
+from pre_processing.scan_season_directory import (
+    scan_season_directory, write_scan_manifest, read_scan_manifest,
+    get_scan_records)
+from pre_processing.utils import datetime_file_creation
+
+
+class ScanSeasonDirectoryTests(unittest.TestCase):
+    """ Test Season Directory Scan """
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        for site in ['A01', 'B02']:
+            for roll in ['R1', 'R2']:
+                roll_dir = os.path.join(
+                    self.root_dir, site, '{}_{}'.format(site, roll))
+                os.makedirs(roll_dir)
+                for image_no in range(3):
+                    image_path = os.path.join(
+                        roll_dir, 'IMG{}.JPG'.format(image_no))
+                    with open(image_path, 'w') as f:
+                        f.write('x' * image_no)
+        with open(os.path.join(self.root_dir, 'notes.txt'), 'w') as f:
+            f.write('not a site')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def testScanMatchesListdir(self):
+        records = scan_season_directory(self.root_dir, n_threads=2)
+        expected_files = list()
+        for site in os.listdir(self.root_dir):
+            site_path = os.path.join(self.root_dir, site)
+            if not os.path.isdir(site_path):
+                continue
+            for roll in os.listdir(site_path):
+                roll_path = os.path.join(site_path, roll)
+                for image in os.listdir(roll_path):
+                    expected_files.append(os.path.join(roll_path, image))
+        file_records = [x for x in records if x['level'] == 'file']
+        self.assertEqual([x['path'] for x in file_records], expected_files)
+        for record in file_records:
+            self.assertEqual(record['size'], os.path.getsize(record['path']))
+            self.assertEqual(
+                record['file_creation_time'],
+                datetime_file_creation(record['path']))
+        site_records = [x for x in records if x['level'] == 'site']
+        self.assertEqual(
+            sorted([(x['name'], x['is_dir']) for x in site_records]),
+            [('A01', 1), ('B02', 1), ('notes.txt', 0)])
+        self.assertEqual(
+            len([x for x in records if x['level'] == 'roll']), 4)
+
+    def testManifestRoundTrip(self):
+        records = scan_season_directory(self.root_dir, n_threads=2)
+        manifest = os.path.join(self.root_dir, 'manifest.csv')
+        write_scan_manifest(records, manifest)
+        self.assertEqual(read_scan_manifest(manifest), records)
+
+    def testStaleManifestIsRescanned(self):
+        manifest_dir = tempfile.mkdtemp()
+        manifest = os.path.join(manifest_dir, 'manifest.csv')
+        try:
+            records = get_scan_records(self.root_dir, manifest, n_threads=2)
+            self.assertEqual(
+                get_scan_records(self.root_dir, manifest), records)
+            # rename an image
+            roll_dir = os.path.join(self.root_dir, 'A01', 'A01_R1')
+            os.rename(os.path.join(roll_dir, 'IMG0.JPG'),
+                      os.path.join(roll_dir, 'IMG9.JPG'))
+            records = get_scan_records(self.root_dir, manifest)
+            file_names = [x['name'] for x in records
+                          if x['roll_directory'] == 'A01_R1']
+            self.assertIn('IMG9.JPG', file_names)
+            self.assertNotIn('IMG0.JPG', file_names)
+            self.assertEqual(read_scan_manifest(manifest), records)
+            # the root directory of the manifest is checked without root_dir
+            os.remove(os.path.join(roll_dir, 'IMG9.JPG'))
+            records = get_scan_records(None, manifest)
+            self.assertNotIn('IMG9.JPG', [x['name'] for x in records])
+            self.assertEqual(read_scan_manifest(manifest), records)
+            # a manifest of a different root_dir is not re-used
+            other_root_dir = os.path.join(manifest_dir, 'other')
+            shutil.copytree(self.root_dir, other_root_dir)
+            records = get_scan_records(other_root_dir, manifest)
+            self.assertTrue(all([
+                x['path'].startswith(other_root_dir) for x in records]))
+        finally:
+            shutil.rmtree(manifest_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
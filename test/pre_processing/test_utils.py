@@ -1,8 +1,12 @@
 import unittest
 from datetime import datetime
 
+import numpy as np
+
 from pre_processing.utils import (
-    convert_datetime_utc_to_timezone, convert_ctime_to_datetime)
+    convert_datetime_utc_to_timezone, convert_ctime_to_datetime,
+    p_pixels_below_threshold, p_pixels_above_threshold,
+    p_pixels_below_and_above_threshold)
 
 from config.cfg import cfg
 
@@ -41,3 +45,15 @@ class PreProcessingUtilsTests(unittest.TestCase):
         expected1 = "2016-02-13 05:26:07"
         expected2 = "2016-02-13 05:26:08"
         self.assertIn(actual, [expected1, expected2])
+
+    def testPixelsBelowAndAboveThreshold(self):
+        pixel_data = np.random.RandomState(1).randint(
+            0, 256, (301, 200, 3)).astype(np.uint8)
+        pixel_data[0:100] = 10
+        pixel_data[100:150] = 240
+        expected = (
+            p_pixels_below_threshold(pixel_data, 30),
+            p_pixels_above_threshold(pixel_data, 200))
+        actual = p_pixels_below_and_above_threshold(
+            pixel_data, 30, 200, block_rows=64)
+        self.assertEqual(actual, expected)
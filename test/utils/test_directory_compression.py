@@ -0,0 +1,90 @@
+""" Test Resumable Compression of Directories of Images """
+import os
+import unittest
+import tempfile
+
+from PIL import Image
+
+from utils.directory_compression import (
+    compress_directory, read_checkpoint, default_checkpoint_file)
+
+
+class CompressDirectoryTests(unittest.TestCase):
+    """ Test compress_directory """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        source_dir = os.path.join(self.tmp_dir.name, 'source')
+        dest_dir = os.path.join(self.tmp_dir.name, 'dest')
+        os.makedirs(source_dir)
+        os.makedirs(dest_dir)
+        self.sources = list()
+        self.dests = list()
+        for i in range(6):
+            image_name = '{}.JPG'.format(i)
+            source = os.path.join(source_dir, image_name)
+            Image.new('RGB', (400, 300), color=(i * 40, 0, 0)).save(
+                source, format='JPEG')
+            self.sources.append(source)
+            self.dests.append(os.path.join(dest_dir, image_name))
+        self.checkpoint_file = os.path.join(dest_dir, 'checkpoint.txt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def compress(self, **kwargs):
+        params = {'save_quality': 50, 'max_pixel_of_largest_side': 100,
+                  'n_processes': 1, 'checkpoint_file': self.checkpoint_file}
+        params.update(kwargs)
+        return compress_directory(self.sources, self.dests, **params)
+
+    def testImagesAreCompressed(self):
+        for n_processes in [1, 2]:
+            result = self.compress(
+                n_processes=n_processes, checkpoint_file=None)
+            self.assertEqual(result['compressed'], 6)
+            for dest in self.dests:
+                self.assertEqual(Image.open(dest).size, (100, 75))
+
+    def testCompressionIsResumed(self):
+        self.compress()
+        self.assertEqual(
+            read_checkpoint(self.checkpoint_file, 50, 100), set(self.sources))
+        # an interrupted compression: last image not completed
+        with open(self.checkpoint_file, 'r') as f:
+            lines = f.readlines()
+        with open(self.checkpoint_file, 'w') as f:
+            f.writelines(lines[:-1])
+            f.write(lines[-1][:-3])
+        os.remove(self.dests[0])
+        result = self.compress(n_processes=2)
+        self.assertEqual(result['skipped'], 4)
+        self.assertEqual(result['compressed'], 2)
+        self.assertEqual(
+            read_checkpoint(self.checkpoint_file, 50, 100), set(self.sources))
+        # changed settings - compress everything again
+        result = self.compress(max_pixel_of_largest_side=200)
+        self.assertEqual(result['compressed'], 6)
+        self.assertEqual(Image.open(self.dests[0]).size, (200, 150))
+
+    def testFailedImagesAreNotCheckpointed(self):
+        with open(self.sources[2], 'w') as f:
+            f.write('not an image')
+        result = self.compress()
+        self.assertEqual(result['failed'], 1)
+        self.assertNotIn(
+            self.sources[2], read_checkpoint(self.checkpoint_file, 50, 100))
+
+    def testDefaultCheckpointIsOutsideOutputDir(self):
+        dest_dir = os.path.dirname(self.dests[0])
+        for output_dir in [dest_dir, dest_dir + os.sep]:
+            checkpoint_file = default_checkpoint_file(output_dir)
+            self.assertEqual(
+                os.path.dirname(checkpoint_file), self.tmp_dir.name)
+        self.compress(checkpoint_file=checkpoint_file)
+        self.assertEqual(
+            sorted(os.listdir(dest_dir)),
+            sorted([os.path.basename(x) for x in self.dests]))
+
+
+if __name__ == '__main__':
+    unittest.main()
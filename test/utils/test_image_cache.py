@@ -0,0 +1,154 @@
+""" Test the On-Disk Cache of Compressed Images """
+import os
+import io
+import time
+import unittest
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from utils.image_cache import CompressedImageCache
+from utils.resize_and_compress_images import compress_images_to_bytes
+from utils.directory_compression import compress_directory
+
+
+# CompressedImageCache of a worker process
+_worker_cache = None
+
+
+def _init_worker(cache):
+    global _worker_cache
+    _worker_cache = cache
+
+
+def _put_entries(source_paths):
+    """ Put 2 KB per source path - returns the max size of the cache """
+    max_size = 0
+    for source_path in source_paths:
+        _worker_cache.put(source_path, 100, 50, b'x' * 2048)
+        max_size = max(max_size, _worker_cache.size_bytes())
+    return max_size
+
+
+class CompressedImageCacheTests(unittest.TestCase):
+    """ Test CompressedImageCache """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.image_paths = list()
+        for i in range(3):
+            image_path = os.path.join(self.tmp_dir.name, '{}.JPG'.format(i))
+            Image.new('RGB', (400, 300), color=(i * 50, 0, 0)).save(
+                image_path, format='JPEG')
+            self.image_paths.append(image_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def testKeyDependsOnSourceAndParameters(self):
+        cache = CompressedImageCache(self.cache_dir)
+        cache.put(self.image_paths[0], 100, 50, b'compressed')
+        self.assertEqual(cache.get(self.image_paths[0], 100, 50),
+                         b'compressed')
+        self.assertIsNone(cache.get(self.image_paths[0], 100, 60))
+        self.assertIsNone(cache.get(self.image_paths[0], 200, 50))
+        self.assertIsNone(cache.get(self.image_paths[1], 100, 50))
+        # a modified source is a cache miss
+        stat = os.stat(self.image_paths[0])
+        os.utime(self.image_paths[0],
+                 ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(cache.get(self.image_paths[0], 100, 50))
+
+    def testLeastRecentlyUsedAreEvicted(self):
+        cache = CompressedImageCache(self.cache_dir, max_size_bytes=250)
+        for image_path in self.image_paths[:2]:
+            cache.put(image_path, 100, 50, b'x' * 100)
+            # make access times distinguishable
+            time.sleep(0.01)
+        cache.get(self.image_paths[0], 100, 50)
+        time.sleep(0.01)
+        cache.put(self.image_paths[2], 100, 50, b'x' * 100)
+        self.assertLessEqual(cache.size_bytes(), 250)
+        self.assertIsNotNone(cache.get(self.image_paths[0], 100, 50))
+        self.assertIsNone(cache.get(self.image_paths[1], 100, 50))
+        self.assertIsNotNone(cache.get(self.image_paths[2], 100, 50))
+
+    def testOverwrittenEntriesAreNotCountedTwice(self):
+        cache = CompressedImageCache(self.cache_dir, max_size_bytes=250)
+        cache.put(self.image_paths[0], 100, 50, b'x' * 100)
+        cache.put(self.image_paths[1], 100, 50, b'x' * 100)
+        cache.put(self.image_paths[1], 100, 50, b'x' * 100)
+        self.assertIsNotNone(cache.get(self.image_paths[0], 100, 50))
+        self.assertEqual(cache._size_bytes + cache._added_bytes, 200)
+
+    def testSizeIsBoundedAcrossProcesses(self):
+        n_processes = 4
+        cache = CompressedImageCache(
+            self.cache_dir, max_size_bytes=100 * 1024,
+            n_processes=n_processes)
+        source_dir = os.path.join(self.tmp_dir.name, 'sources')
+        os.makedirs(source_dir)
+        source_lists = [list() for _ in range(n_processes)]
+        for i in range(n_processes * 50):
+            source = os.path.join(source_dir, '{}.JPG'.format(i))
+            with open(source, 'w') as f:
+                f.write(str(i))
+            source_lists[i % n_processes].append(source)
+        with ProcessPoolExecutor(
+                max_workers=n_processes, initializer=_init_worker,
+                initargs=(cache, )) as executor:
+            max_sizes = list(executor.map(_put_entries, source_lists))
+        # each process writes 100 KB, the cache exceeds its limit at most
+        # by the entries written while the others scan
+        self.assertLessEqual(max(max_sizes), 110 * 1024)
+        self.assertLessEqual(cache.size_bytes(), 100 * 1024)
+
+    def testCompressImagesToBytesUsesCache(self):
+        cache = CompressedImageCache(self.cache_dir)
+        expected = compress_images_to_bytes(self.image_paths, 100, 50)
+        first = compress_images_to_bytes(
+            self.image_paths, 100, 50, cache=cache)
+        self.assertEqual(first, expected)
+        cache.put(self.image_paths[0], 100, 50, b'cached')
+        second = compress_images_to_bytes(
+            self.image_paths, 100, 50, cache=cache)
+        self.assertEqual(second, [b'cached'] + expected[1:])
+        self.assertEqual(
+            Image.open(io.BytesIO(second[1])).size, (100, 75))
+
+    def testCompressDirectoryUsesCache(self):
+        cache = CompressedImageCache(self.cache_dir)
+        dest_dir = os.path.join(self.tmp_dir.name, 'dest')
+        os.makedirs(dest_dir)
+        dest_paths = [os.path.join(dest_dir, os.path.basename(x))
+                      for x in self.image_paths]
+        compress_directory(
+            self.image_paths, dest_paths, 50, 100, n_processes=1,
+            cache=cache)
+        with open(dest_paths[0], 'rb') as f:
+            self.assertEqual(
+                f.read(), cache.get(self.image_paths[0], 100, 50, 'file.jpg'))
+        # files are cached separately from the compressed upload images
+        self.assertIsNone(cache.get(self.image_paths[0], 100, 50))
+        cache.put(self.image_paths[0], 100, 50, b'cached', 'file.jpg')
+        # workers of the pool use the cache too
+        compress_directory(
+            self.image_paths, dest_paths, 50, 100, n_processes=2,
+            cache=cache)
+        with open(dest_paths[0], 'rb') as f:
+            self.assertEqual(f.read(), b'cached')
+
+    def testFailedQualityChangeIsNotCached(self):
+        cache = CompressedImageCache(self.cache_dir)
+        source = os.path.join(self.tmp_dir.name, 'rgba.png')
+        Image.new('RGBA', (400, 300)).save(source, format='PNG')
+        dest = os.path.join(self.tmp_dir.name, 'dest.png')
+        compress_directory(
+            [source], [dest], 50, 100, n_processes=1, cache=cache)
+        self.assertEqual(Image.open(dest).format, 'PNG')
+        self.assertIsNone(cache.get(source, 100, 50, 'file.png'))
+        self.assertEqual(cache.size_bytes(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
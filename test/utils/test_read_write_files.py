@@ -0,0 +1,107 @@
+""" Test Reading and Writing csv / Parquet Files """
+import os
+import unittest
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.utils import (
+    read_df, write_df, read_header_and_rows, write_rows_to_parquet)
+
+
+class ReadWriteDfTests(unittest.TestCase):
+    """ Test read_df / write_df """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame({
+            'subject_id': ['1', '2', '3'],
+            'species': ['zebra', '', 'lionfemale'],
+            'count': ['1', '11-50', '']})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def testRoundTrip(self):
+        for file_name in ['df.csv', 'df.parquet']:
+            path = os.path.join(self.tmp_dir.name, file_name)
+            write_df(self.df, path, categorical_cols=['species'])
+            df = read_df(path)
+            self.assertTrue(df.equals(self.df))
+            df = read_df(path, index_col='subject_id')
+            self.assertEqual(list(df.index), ['1', '2', '3'])
+
+    def testParquetTypes(self):
+        path = os.path.join(self.tmp_dir.name, 'df.parquet')
+        df = self.df.copy()
+        df['n_users'] = [1, 2, 3]
+        write_df(df, path, categorical_cols=['species'])
+        schema = pq.read_schema(path)
+        self.assertTrue(pa.types.is_dictionary(schema.field('species').type))
+        self.assertTrue(pa.types.is_integer(schema.field('n_users').type))
+        self.assertEqual(list(read_df(path)['n_users']), ['1', '2', '3'])
+
+
+class ReadWriteRowsTests(unittest.TestCase):
+    """ Test read_header_and_rows / write_rows_to_parquet """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'rows.parquet')
+        self.header = ['classification_id', 'user_id', 'species', 'count']
+        self.rows = [
+            ['1', '', 'zebra', '11-50'],
+            ['2', '10', 'blank', ''],
+            ['3', '11', 'zebra', '1']]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, rows, append=False):
+        return write_rows_to_parquet(
+            rows, self.header, self.path, categorical_cols=['species'],
+            int_cols=['classification_id', 'user_id'], append=append,
+            batch_size=2)
+
+    def testRoundTrip(self):
+        self.assertEqual(self.write(self.rows), 3)
+        schema = pq.read_schema(self.path)
+        self.assertEqual(schema.field('user_id').type, pa.int64())
+        self.assertEqual(schema.field('count').type, pa.string())
+        self.assertTrue(pa.types.is_dictionary(schema.field('species').type))
+        header, rows = read_header_and_rows(self.path, batch_size=2)
+        self.assertEqual(header, self.header)
+        self.assertEqual(list(rows), self.rows)
+        self.assertEqual(
+            list(read_df(self.path)['user_id']), ['', '10', '11'])
+
+    def testCsvRows(self):
+        path = os.path.join(self.tmp_dir.name, 'rows.csv')
+        pd.DataFrame(self.rows, columns=self.header).to_csv(
+            path, index=False)
+        header, rows = read_header_and_rows(path)
+        self.assertEqual(header, self.header)
+        self.assertEqual(list(rows), self.rows)
+
+    def testAppend(self):
+        self.write(self.rows[:1])
+        self.assertEqual(self.write(self.rows[1:], append=True), 2)
+        self.assertEqual(list(read_header_and_rows(self.path)[1]), self.rows)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['rows.parquet'])
+
+    def testFailedAppendKeepsExistingFile(self):
+        self.write(self.rows[:2])
+
+        def failing_rows():
+            yield self.rows[2]
+            raise IOError("interrupted")
+
+        with self.assertRaises(IOError):
+            self.write(failing_rows(), append=True)
+        self.assertEqual(
+            list(read_header_and_rows(self.path)[1]), self.rows[:2])
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['rows.parquet'])
+
+
+if __name__ == '__main__':
+    unittest.main()
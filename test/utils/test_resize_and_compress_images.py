@@ -0,0 +1,46 @@
+""" Test Resizing and Compressing Images """
+import os
+import unittest
+import tempfile
+
+from PIL import Image
+
+from utils.resize_and_compress_images import resize_and_compress_single_image
+
+
+class ResizeAndCompressSingleImageTests(unittest.TestCase):
+    """ Test resize_and_compress_single_image """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.tmp_dir.name, 'large.JPG')
+        img = Image.linear_gradient('L').resize((1600, 1000)).convert('RGB')
+        img.save(self.image_path, format='JPEG', quality=95)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def testDraftResizeHasSameSize(self):
+        for draft in [False, True]:
+            output = resize_and_compress_single_image(
+                self.image_path, 300, 50, draft=draft)
+            self.assertEqual(output.tell(), 0)
+            img = Image.open(output)
+            self.assertEqual(img.format, 'JPEG')
+            self.assertEqual(img.size, (300, 188))
+
+    def testDraftResizeKeepsSaveQuality(self):
+        sizes = list()
+        for save_quality in [10, 95]:
+            output = resize_and_compress_single_image(
+                self.image_path, 400, save_quality, draft=True)
+            sizes.append(len(output.getvalue()))
+        self.assertLess(sizes[0], sizes[1])
+
+    def testSmallImagesAreNotResized(self):
+        output = resize_and_compress_single_image(
+            self.image_path, 2000, 50, draft=True)
+        self.assertEqual(Image.open(output).size, (1600, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,20 @@
 """ Test Extraction of Annotations """
+import os
 import unittest
+import tempfile
 import logging
 import json
 import csv
 from collections import Counter
 
-from zooniverse_exports.extract_annotations import extract_raw_classification
+import pandas as pd
+
+from utils.utils import read_df, write_df
+from zooniverse_exports.extract_annotations import (
+    extract_raw_classification, extract_classifications,
+    extract_classifications_parallel, create_extraction_state,
+    write_extraction_state, read_extraction_state,
+    output_size, truncate_output)
 
 from zooniverse_exports import extractor
 
@@ -73,6 +82,8 @@ class ExtractClassificationsTests(unittest.TestCase):
                     args,
                     stats)
             self.extracted_classifications += extracted
+        self.file_classifications = file_classifications
+        self.args = args
 
     def orderListofSingleKeyDicts(self, dict_list):
         return sorted(dict_list, key=lambda x: list(x.keys())[0])
@@ -340,6 +351,83 @@ class ExtractClassificationsTests(unittest.TestCase):
                 {'count': '1'},
                 {'species': 'rhinoceros'}]))
 
+    def testExtractClassificationsGenerator(self):
+        """ Test Streaming Extraction yields the same Classifications """
+        streamed = list()
+        for extracted in extract_classifications(
+                self.file_classifications, self.args, Counter()):
+            streamed += extracted
+        self.assertEqual(streamed, self.extracted_classifications)
+
+    def testExtractClassificationsParallel(self):
+        """ Test Parallel Extraction yields the same Classifications """
+        stats_serial = Counter()
+        serial = list(extract_classifications(
+            self.file_classifications, self.args, stats_serial))
+        for n_chunks in [1, 3, 50]:
+            stats_parallel = Counter()
+            parallel = list(extract_classifications_parallel(
+                self.file_classifications, self.args, stats_parallel,
+                n_processes=2, n_chunks=n_chunks))
+            self.assertEqual(parallel, serial)
+            self.assertEqual(stats_parallel, stats_serial)
+
+    def testExtractClassificationsIncremental(self):
+        """ Test that classifications of a previous extraction are skipped """
+        state = create_extraction_state()
+        extracted = list(extract_classifications(
+            self.file_classifications, self.args, Counter(), state))
+        self.assertEqual(
+            [x for cl in extracted for x in cl],
+            self.extracted_classifications)
+        self.assertEqual(
+            state['last_classification_id'],
+            max([int(x['classification_id'])
+                 for x in self.raw_classifications]))
+        stats = Counter()
+        self.assertEqual(list(extract_classifications(
+            self.file_classifications, self.args, stats, state)), [])
+        self.assertEqual(
+            stats['n_already_extracted'], len(self.raw_classifications))
+        stats_parallel = Counter()
+        self.assertEqual(list(extract_classifications_parallel(
+            self.file_classifications, self.args, stats_parallel, state,
+            n_processes=2)), [])
+        self.assertEqual(stats_parallel, stats)
+
+
+class ExtractionStateTests(unittest.TestCase):
+    """ Test the State of Incremental Extractions """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def testStateIsWrittenAndRead(self):
+        state_path = os.path.join(self.tmp_dir.name, 'out.csv.state.json')
+        state = create_extraction_state()
+        state['last_classification_id'] = 10
+        state['duplicate_tracker'].add(('user', '1', '2'))
+        state['output_size'] = 100
+        write_extraction_state(state, state_path)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['out.csv.state.json'])
+        self.assertEqual(read_extraction_state(state_path), state)
+
+    def testOutputIsTruncatedToStateSize(self):
+        df = pd.DataFrame({'classification_id': ['1', '2', '3']})
+        for file_name in ['out.csv', 'out.parquet']:
+            path = os.path.join(self.tmp_dir.name, file_name)
+            write_df(df.iloc[:2], path)
+            size = output_size(path)
+            # rows appended by an interrupted extraction
+            write_df(df, path)
+            self.assertGreater(output_size(path), size)
+            truncate_output(path, size)
+            self.assertEqual(output_size(path), size)
+            self.assertEqual(
+                list(read_df(path)['classification_id']), ['1', '2'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,172 @@
+""" Test Pipelined Upload against a Local Stand-in for the API """
+import os
+import io
+import unittest
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from zooniverse_uploads.upload_pipeline import upload_subjects_pipelined
+from utils.resize_and_compress_images import ImageCompressionService
+from utils.image_cache import CompressedImageCache
+
+
+def get_images(capture_id, capture_data):
+    return ['{}.JPG'.format(x) for x in capture_data['images']]
+
+
+class FakeSubject(object):
+    def __init__(self, _id):
+        self.id = _id
+
+
+class FakePanoptes(object):
+    """ Local stand-in for the subject / subject set API """
+    def __init__(self, fail_for=None, upload_latency=0):
+        self.lock = threading.Lock()
+        self.subjects = dict()
+        self.linked = list()
+        self.tracker = list()
+        self.deleted = list()
+        self.fail_for = fail_for
+        self.upload_latency = upload_latency
+
+    def create_subject(self, capture_id, capture_data, images):
+        time.sleep(self.upload_latency)
+        if capture_id == self.fail_for:
+            raise OSError("Received HTTP status code 504 from API")
+        if len(images) == 0:
+            return None
+        with self.lock:
+            subject = FakeSubject(str(len(self.subjects)))
+            self.subjects[subject.id] = (capture_id, images)
+        return subject
+
+    def link_batch(self, subjects):
+        self.linked += [x.id for x in subjects]
+
+    def update_tracker(self, capture_ids, subject_ids):
+        self.tracker += list(zip(capture_ids, subject_ids))
+
+    def rollback(self, subjects):
+        self.deleted += [x.id for x in subjects]
+
+    def upload(self, captures, **kwargs):
+        return upload_subjects_pipelined(
+            captures, get_images, self.create_subject,
+            self.link_batch, self.update_tracker, self.rollback, **kwargs)
+
+
+class UploadPipelineTests(unittest.TestCase):
+    """ Test upload_subjects_pipelined """
+    def setUp(self):
+        self.captures = [
+            ('capture_{}'.format(i), {'images': [i, i + 1000]})
+            for i in range(25)]
+
+    def testAllCapturesAreLinked(self):
+        api = FakePanoptes()
+        n_linked = api.upload(
+            self.captures, upload_batch_size=10, n_upload_workers=3)
+        self.assertEqual(n_linked, 25)
+        self.assertEqual(sorted(api.linked), sorted(api.subjects.keys()))
+        self.assertEqual(
+            {k: v for k, v in api.tracker},
+            {v[0]: k for k, v in api.subjects.items()})
+        self.assertEqual(
+            api.subjects[dict(api.tracker)['capture_3']][1],
+            ['3.JPG', '1003.JPG'])
+        self.assertEqual(api.deleted, [])
+
+    def testCapturesWithoutImagesAreSkipped(self):
+        api = FakePanoptes()
+        captures = self.captures + [('capture_empty', {'images': []})]
+        n_linked = api.upload(captures, n_upload_workers=2)
+        self.assertEqual(n_linked, 25)
+        self.assertNotIn('capture_empty', dict(api.tracker))
+
+    def testFailureRollsBackUnlinkedSubjects(self):
+        api = FakePanoptes(fail_for='capture_17')
+        with self.assertRaises(OSError):
+            api.upload(
+                self.captures, upload_batch_size=5, n_upload_workers=3)
+        # every created subject is either linked (and tracked) or removed
+        self.assertEqual(
+            sorted(api.linked + api.deleted), sorted(api.subjects.keys()))
+        self.assertEqual(
+            sorted(api.linked), sorted([x[1] for x in api.tracker]))
+        self.assertNotIn('capture_17', dict(api.tracker))
+        self.assertEqual(len(api.linked) % 5, 0)
+
+    def testUploadsAreConcurrent(self):
+        api = FakePanoptes(upload_latency=0.05)
+        start_time = time.time()
+        api.upload(self.captures, n_upload_workers=5)
+        # sequential uploads would take 25 * 0.05 seconds
+        self.assertLess(time.time() - start_time, 25 * 0.05 / 2)
+        self.assertEqual(len(api.linked), 25)
+
+
+class ImageCompressionServiceTests(unittest.TestCase):
+    """ Test ImageCompressionService """
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.image_paths = list()
+        for i in range(3):
+            image_path = os.path.join(self.tmp_dir.name, '{}.JPG'.format(i))
+            Image.new('RGB', (400, 300), color=(i * 50, 0, 0)).save(
+                image_path, format='JPEG')
+            self.image_paths.append(image_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def testImagesAreCompressed(self):
+        missing = os.path.join(self.tmp_dir.name, 'missing.JPG')
+        with ImageCompressionService(
+                n_processes=2, max_pixel_of_largest_side=100,
+                save_quality=50) as service:
+            futures = [service.submit(self.image_paths),
+                       service.submit([missing, self.image_paths[0]])]
+            results = [future.result() for future in futures]
+        self.assertEqual(len(results[0]), 3)
+        for image_bytes in results[0] + results[1][1:]:
+            img = Image.open(io.BytesIO(image_bytes))
+            self.assertEqual(img.format, 'JPEG')
+            self.assertEqual(img.size, (100, 75))
+        self.assertIsNone(results[1][0])
+
+    def testWorkersUseCache(self):
+        cache = CompressedImageCache(os.path.join(self.tmp_dir.name, 'cache'))
+        cache.put(self.image_paths[0], 100, 50, b'cached')
+        with ImageCompressionService(
+                n_processes=2, max_pixel_of_largest_side=100,
+                save_quality=50, cache=cache) as service:
+            results = service.submit(self.image_paths).result()
+        self.assertEqual(results[0], b'cached')
+        for image_path, image_bytes in zip(
+                self.image_paths[1:], results[1:]):
+            self.assertEqual(cache.get(image_path, 100, 50), image_bytes)
+
+    def testPipelineUploadsCompressedImages(self):
+        api = FakePanoptes()
+        captures = [
+            ('capture_{}'.format(i), {'images': [i]}) for i in range(3)]
+        with ImageCompressionService(
+                n_processes=1, max_pixel_of_largest_side=100) as service:
+            n_linked = upload_subjects_pipelined(
+                captures,
+                lambda capture_id, capture_data: [
+                    self.image_paths[x] for x in capture_data['images']],
+                api.create_subject, api.link_batch, api.update_tracker,
+                api.rollback, compression_service=service, queue_size=2)
+        self.assertEqual(n_linked, 3)
+        for capture_id, images in api.subjects.values():
+            self.assertEqual(len(images), 1)
+            self.assertEqual(Image.open(images[0]).size, (100, 75))
+
+
+if __name__ == '__main__':
+    unittest.main()
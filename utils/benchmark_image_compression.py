@@ -0,0 +1,87 @@
+""" Benchmark Image Compression
+    - compares the default resize and the draft (decoder downscaling)
+      resize of resize_and_compress_single_image
+    - reports throughput (images/s) and mean output size
+"""
+import os
+import re
+import time
+import argparse
+
+from utils.resize_and_compress_images import resize_and_compress_single_image
+
+
+# python3 -m utils.benchmark_image_compression \
+# --image_dir /home/packerc/shared/albums/RUA/RUA_S1/A01/A01_R1/ \
+# --n_images 200 \
+# --max_pixel_of_largest_side 1440 \
+# --save_quality 50
+
+
+def find_images(image_dir, n_images, ext='jpg|jpeg'):
+    """ Find the first 'n_images' images in 'image_dir' """
+    image_paths = list()
+    for root, dirs, files in os.walk(image_dir):
+        for file_name in sorted(files):
+            if re.search(r'\.(?:' + ext + ')$', file_name, re.IGNORECASE):
+                image_paths.append(os.path.join(root, file_name))
+            if len(image_paths) >= n_images:
+                return image_paths
+    return image_paths
+
+
+def benchmark_compression(
+        image_paths, max_pixel_of_largest_side, save_quality, draft,
+        n_repeats=1):
+    """ Compress all images 'n_repeats' times
+        Returns: dict with images_per_second and mean_output_bytes
+    """
+    n_bytes = 0
+    start_time = time.time()
+    for _ in range(n_repeats):
+        for image_path in image_paths:
+            n_bytes += len(resize_and_compress_single_image(
+                image_path, max_pixel_of_largest_side, save_quality,
+                draft=draft).getvalue())
+    seconds = time.time() - start_time
+    n_images = len(image_paths) * n_repeats
+    return {
+        'images_per_second': n_images / seconds if seconds > 0 else 0,
+        'mean_output_bytes': n_bytes / max(n_images, 1)}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image_dir", type=str, required=True)
+    parser.add_argument("--n_images", type=int, default=100)
+    parser.add_argument("--n_repeats", type=int, default=1)
+    parser.add_argument("--max_pixel_of_largest_side", type=int, default=1440)
+    parser.add_argument("--save_quality", type=int, default=50)
+
+    args = vars(parser.parse_args())
+
+    image_paths = find_images(args['image_dir'], args['n_images'])
+
+    if len(image_paths) == 0:
+        raise FileNotFoundError(
+            "no images found in {}".format(args['image_dir']))
+
+    print("Benchmarking {} images (x{})".format(
+          len(image_paths), args['n_repeats']))
+
+    results = dict()
+    for mode, draft in [('default', False), ('draft', True)]:
+        results[mode] = benchmark_compression(
+            image_paths,
+            args['max_pixel_of_largest_side'],
+            args['save_quality'],
+            draft=draft,
+            n_repeats=args['n_repeats'])
+        print("{:8} {:8.1f} images/s - mean output size: {:.1f} KB".format(
+              mode, results[mode]['images_per_second'],
+              results[mode]['mean_output_bytes'] / 1024))
+
+    print("Speedup of draft: {:.2f}x".format(
+          results['draft']['images_per_second'] /
+          results['default']['images_per_second']))
@@ -4,89 +4,20 @@
 """
 import re
 import os
-import sys
 import argparse
-from PIL import Image
 from collections import OrderedDict
-import time
 
-from utils.utils import estimate_remaining_time
+from utils.image_cache import CompressedImageCache
+from utils.directory_compression import (
+    compress_directory, default_checkpoint_file, CHECKPOINT_FILE_SUFFIX)
 
 
 # python3 -m utils.compress_directory_with_images \
 # --input_image_dir '/home/packerc/shared/snapshot_websites/SpeciesImages_Master/' \
 # --output_image_dir '/home/packerc/shared/snapshot_websites/SpeciesImages_Master_Compressed/' \
 # --max_image_pixel_side 1200 \
-# --image_quality 50
-
-###############################
-# Image Compression and
-# multiprocessing Functions
-###############################
-
-
-def compress_images(image_source_list,
-                    image_dest_list,
-                    save_quality=None,
-                    max_pixel_of_largest_side=None):
-    """ Compresses images for use with multiprocessing
-
-        Arguments:
-        -----------
-        image_source_list (list):
-            image source paths
-        image_source_list (list):
-            image destination paths
-        save_quality (int):
-            compression quality of images
-        max_pixel_of_largest_side (int):
-            max allowed size in pixels of largest side of an image,
-            if an image exceeds this, its largest side is resized to this
-            while preserving the aspect ratio
-    """
-    # Check Input
-    assert any([save_quality, max_pixel_of_largest_side]) is not None,\
-        "At least one of save_quality or max_pixel_of_largest_side must be \
-         specified"
-    if save_quality is not None:
-        assert (save_quality <= 100) and (save_quality > 0), \
-            "save_quality must be between 1 and 100"
-    # Loop over all images and process each
-    counter = 0
-    n_tot = len(image_source_list)
-    start_time = time.time()
-    for source, dest in zip(image_source_list, image_dest_list):
-        if (counter % 2000) == 0:
-            print("Done %s/%s - estimated time remaining: %s" %
-                  (counter, n_tot,
-                   estimate_remaining_time(start_time, n_tot, counter)))
-            sys.stdout.flush()
-        try:
-            img = Image.open(source)
-            # Check largest side of image and resize if necessary
-            if max_pixel_of_largest_side is not None:
-                if any([x > max_pixel_of_largest_side for x in img.size]):
-                    img.thumbnail(size=[max_pixel_of_largest_side,
-                                        max_pixel_of_largest_side],
-                                  resample=1)
-            if save_quality is not None:
-                try:
-                    img.save(dest, "JPEG",
-                             quality=save_quality)
-                except:
-                    img.save(dest)
-                    print("Failed to change save_quality of {}".format(dest))
-
-            else:
-                img.save(dest)
-            img.close()
-            # save result "Successful Compression"
-        except:
-            # save result "Not Compressed"
-            print("Failed to compress %s" % source)
-        counter += 1
-    # Print process end status
-    print("Finished")
+# --image_quality 50 \
+# --n_processes 4
 
 
 def find_images_in_dir(dirpath, ext='jpg|jpeg'):
@@ -107,6 +38,17 @@ if __name__ == "__main__":
     parser.add_argument("--max_image_pixel_side", type=int, default=1440)
     parser.add_argument("--image_quality", type=int, default=50)
     parser.add_argument("--image_types", type=str, default='jpg|jpeg|png')
+    parser.add_argument("--image_cache_dir", type=str, default=None)
+    parser.add_argument("--image_cache_max_gb", type=float, default=20)
+    parser.add_argument("--n_processes", type=int, default=4)
+    parser.add_argument(
+        "--checkpoint_file", type=str, default=None,
+        help="File to record compressed images in to resume an interrupted \
+        compression (default: output_image_dir name + '{}', next to \
+        output_image_dir)".format(CHECKPOINT_FILE_SUFFIX))
+    parser.add_argument(
+        "--restart", action='store_true',
+        help="Compress all images, ignoring the checkpoint file.")
 
     args = vars(parser.parse_args())
 
@@ -153,11 +95,28 @@ if __name__ == "__main__":
         image_source_path_list.append(value['source'])
         image_dest_path_list.append(value['dest'])
 
-    compress_images(
+    image_cache = None
+    if args['image_cache_dir'] is not None:
+        image_cache = CompressedImageCache(
+            args['image_cache_dir'],
+            max_size_bytes=int(args['image_cache_max_gb'] * 1024 ** 3),
+            n_processes=args['n_processes'])
+
+    if args['checkpoint_file'] is None:
+        args['checkpoint_file'] = default_checkpoint_file(
+            args['output_image_dir'])
+
+    if args['restart'] and os.path.isfile(args['checkpoint_file']):
+        os.remove(args['checkpoint_file'])
+
+    compress_directory(
         image_source_list=image_source_path_list,
         image_dest_list=image_dest_path_list,
         save_quality=args['image_quality'],
-        max_pixel_of_largest_side=args['max_image_pixel_side'])
+        max_pixel_of_largest_side=args['max_image_pixel_side'],
+        n_processes=args['n_processes'],
+        checkpoint_file=args['checkpoint_file'],
+        cache=image_cache)
 
     # set r/w permissions of all images to group
     print("Setting file permissions for all images")
@@ -1,13 +1,27 @@
 """ Compress a directory of images
     - input: a directory containing images
     - output: a different directory with compressed images
+    - an interrupted compression is resumed when run again (set
+      'restart' to compress all images again)
+    - run directly or from the repository root:
+      python utils/compress_directory_with_images_manual.py
+      python -m utils.compress_directory_with_images_manual
 """
 import re
 import os
 import sys
-from PIL import Image
 from collections import OrderedDict
 
+# when run directly, import from the repository root (not from 'utils',
+# which contains utils.py)
+if not __package__:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [x for x in sys.path if os.path.abspath(x) != script_dir]
+    sys.path.insert(0, os.path.dirname(script_dir))
+
+from utils.directory_compression import (
+    compress_directory, default_checkpoint_file)
+
 ###############################
 # Parameter
 ###############################
@@ -18,68 +32,15 @@ args['output_image_dir'] = 'C:\\my_compressed_images\\'
 args['max_image_pixel_side'] = 1440
 args['image_quality'] = 50
 args['image_types'] = 'jpg|jpeg|png'
+args['n_processes'] = 4
+# compress all images, ignoring the checkpoint file
+args['restart'] = False
 
 
 ###############################
-# Image Compression
+# Functions
 ###############################
 
-def compress_images(image_source_list,
-                    image_dest_list,
-                    save_quality=None,
-                    max_pixel_of_largest_side=None):
-    """ Compresses images for use with multiprocessing
-
-        Arguments:
-        -----------
-        image_source_list (list):
-            image source paths
-        image_source_list (list):
-            image destination paths
-        save_quality (int):
-            compression quality of images
-        max_pixel_of_largest_side (int):
-            max allowed size in pixels of largest side of an image,
-            if an image exceeds this, its largest side is resized to this
-            while preserving the aspect ratio
-    """
-    # Check Input
-    assert any([save_quality, max_pixel_of_largest_side]) is not None,\
-        "At least one of save_quality or max_pixel_of_largest_side must be \
-         specified"
-    if save_quality is not None:
-        assert (save_quality <= 100) and (save_quality > 0), \
-            "save_quality must be between 1 and 100"
-    # Loop over all images and process each
-    counter = 0
-    n_tot = len(image_source_list)
-    for source, dest in zip(image_source_list, image_dest_list):
-        if (counter % 2000) == 0:
-            print("Done %s/%s" % (counter, n_tot))
-            sys.stdout.flush()
-        try:
-            img = Image.open(source)
-            # Check largest side of image and resize if necessary
-            if max_pixel_of_largest_side is not None:
-                if any([x > max_pixel_of_largest_side for x in img.size]):
-                    img.thumbnail(size=[max_pixel_of_largest_side,
-                                        max_pixel_of_largest_side],
-                                  resample=1)
-            if save_quality is not None:
-                img.save(dest, "JPEG",
-                         quality=save_quality)
-            else:
-                img.save(dest)
-            img.close()
-            # save result "Successful Compression"
-        except:
-            # save result "Not Compressed"
-            print("Failed to compress %s" % source)
-        counter += 1
-    # Print process end status
-    print("Finished")
-
-
 def find_images_in_dir(dirpath, ext='jpg|jpeg'):
     """ get all files in dirpath with ending """
     all = os.listdir(dirpath)
@@ -89,50 +50,61 @@ def find_images_in_dir(dirpath, ext='jpg|jpeg'):
     return all_images
 
 
-for k, v in args.items():
-    print("Argument %s: %s" % (k, v))
+# worker processes re-import this module
+if __name__ == '__main__':
+
+    for k, v in args.items():
+        print("Argument %s: %s" % (k, v))
+
+    # Check Inputs
+    if not os.path.isdir(args['input_image_dir']):
+        raise FileNotFoundError("input_image_dir: %s is not a directory" %
+                                args['input_image_dir'])
+
+    if not os.path.isdir(args['output_image_dir']):
+        raise FileNotFoundError("output_image_dir: %s is not a directory" %
+                                args['output_image_dir'])
 
-# Check Inputs
-if not os.path.isdir(args['input_image_dir']):
-    raise FileNotFoundError("input_image_dir: %s is not a directory" %
-                            args['input_image_dir'])
+    if args['input_image_dir'] == args['output_image_dir']:
+        raise ValueError("input_image_dir is the same as output_image_dir,\
+                          must be different")
 
-if not os.path.isdir(args['output_image_dir']):
-    raise FileNotFoundError("output_image_dir: %s is not a directory" %
-                            args['output_image_dir'])
+    if not ((args['image_quality'] > 0) and (args['image_quality'] <= 100)):
+        raise ValueError("image_quality has to be between 1 and 100")
 
-if args['input_image_dir'] == args['output_image_dir']:
-    raise ValueError("input_image_dir is the same as output_image_dir,\
-                      must be different")
+    # Read Season Captures CSV
+    image_names = find_images_in_dir(
+        args['input_image_dir'], args['image_types'])
 
-if not ((args['image_quality'] > 0) and (args['image_quality'] <= 100)):
-    raise ValueError("image_quality has to be between 1 and 100")
+    print("Found %s images in %s" %
+          (len(image_names), args['input_image_dir']))
 
-# Read Season Captures CSV
-image_names = find_images_in_dir(args['input_image_dir'], args['image_types'])
+    # Define source and destination paths for all images
+    images = OrderedDict()
+    n_duplicates = 0
+    for img in image_names:
+        images[img] = {
+            'source': os.path.join(args['input_image_dir'], img),
+            'dest': os.path.join(args['output_image_dir'], img)
+            }
 
-print("Found %s images in %s" %
-      (len(image_names), args['input_image_dir']))
+    # Create source and destination lists
+    image_source_path_list = list()
+    image_dest_path_list = list()
 
-# Define source and destination paths for all images
-images = OrderedDict()
-n_duplicates = 0
-for img in image_names:
-    images[img] = {
-        'source': os.path.join(args['input_image_dir'], img),
-        'dest': os.path.join(args['output_image_dir'], img)
-        }
+    for value in images.values():
+        image_source_path_list.append(value['source'])
+        image_dest_path_list.append(value['dest'])
 
-# Create source and destination lists
-image_source_path_list = list()
-image_dest_path_list = list()
+    checkpoint_file = default_checkpoint_file(args['output_image_dir'])
 
-for value in images.values():
-    image_source_path_list.append(value['source'])
-    image_dest_path_list.append(value['dest'])
+    if args['restart'] and os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
 
-compress_images(
-    image_source_list=image_source_path_list,
-    image_dest_list=image_dest_path_list,
-    save_quality=args['image_quality'],
-    max_pixel_of_largest_side=args['max_image_pixel_side'])
+    compress_directory(
+        image_source_list=image_source_path_list,
+        image_dest_list=image_dest_path_list,
+        save_quality=args['image_quality'],
+        max_pixel_of_largest_side=args['max_image_pixel_side'],
+        n_processes=args['n_processes'],
+        checkpoint_file=checkpoint_file)
@@ -0,0 +1,237 @@
+""" Resumable Compression of Directories of Images
+    - worker processes take images from a shared task queue (no static
+      slices, fast workers process more images)
+    - completed images are appended to a checkpoint file, images that
+      are in the checkpoint and whose destination is up to date are
+      skipped when the compression is resumed
+    - progress is reported in images/s across all workers
+"""
+import os
+import sys
+import time
+import signal
+from functools import partial
+from multiprocessing import Pool
+
+from PIL import Image
+
+from utils.utils import estimate_remaining_time
+
+
+# the checkpoint is stored next to (not in) the output directory
+CHECKPOINT_FILE_SUFFIX = '_compression_checkpoint.txt'
+
+# CompressedImageCache of a worker process (set by _init_worker)
+_worker_cache = None
+
+
+def default_checkpoint_file(output_dir):
+    """ Default checkpoint file of 'output_dir', e.g.
+        'images/' -> 'images_compression_checkpoint.txt'
+    """
+    return os.path.normpath(output_dir) + CHECKPOINT_FILE_SUFFIX
+
+
+def compress_image_to_file(
+        source, dest, save_quality=None, max_pixel_of_largest_side=None,
+        cache=None):
+    """ Compress a single image and save it to 'dest' - re-use
+        previously compressed images if 'cache' (CompressedImageCache)
+        is specified
+    """
+    # files differ from the compressed images of the uploads (the
+    # format of 'dest' is kept), they are cached separately
+    variant = 'file{}'.format(os.path.splitext(dest)[1].lower())
+    if cache is not None:
+        cached = cache.get(
+            source, max_pixel_of_largest_side, save_quality, variant)
+        if cached is not None:
+            with open(dest, 'wb') as f:
+                f.write(cached)
+            return
+    img = Image.open(source)
+    # Check largest side of image and resize if necessary
+    if max_pixel_of_largest_side is not None:
+        if any([x > max_pixel_of_largest_side for x in img.size]):
+            img.thumbnail(size=[max_pixel_of_largest_side,
+                                max_pixel_of_largest_side],
+                          resample=1)
+    saved_with_quality = True
+    if save_quality is not None:
+        try:
+            img.save(dest, "JPEG", quality=save_quality)
+        except:
+            img.save(dest)
+            saved_with_quality = False
+            print("Failed to change save_quality of {}".format(dest))
+    else:
+        img.save(dest)
+    img.close()
+    # images that could not be saved with 'save_quality' are not cached
+    if (cache is not None) and saved_with_quality:
+        with open(dest, 'rb') as f:
+            cache.put(source, max_pixel_of_largest_side, save_quality,
+                      f.read(), variant)
+
+
+def destination_is_up_to_date(source, dest):
+    """ Check if 'dest' exists and is newer than 'source' """
+    try:
+        dest_stat = os.stat(dest)
+        source_stat = os.stat(source)
+    except OSError:
+        return False
+    return (dest_stat.st_size > 0) and \
+        (dest_stat.st_mtime_ns >= source_stat.st_mtime_ns)
+
+
+def _checkpoint_header(save_quality, max_pixel_of_largest_side):
+    return '# save_quality={} max_pixel_of_largest_side={}\n'.format(
+        save_quality, max_pixel_of_largest_side)
+
+
+def read_checkpoint(checkpoint_file, save_quality, max_pixel_of_largest_side):
+    """ Read completed source paths from a checkpoint file - entries
+        created with different compression settings are ignored
+        Returns: set of source paths
+    """
+    if not os.path.isfile(checkpoint_file):
+        return set()
+    with open(checkpoint_file, 'r') as f:
+        header = f.readline()
+        if header != _checkpoint_header(
+                save_quality, max_pixel_of_largest_side):
+            return set()
+        # ignore an incompletely written last line
+        return set([x[:-1] for x in f if x.endswith('\n')])
+
+
+def open_checkpoint(
+        checkpoint_file, save_quality, max_pixel_of_largest_side, completed):
+    """ Open a checkpoint file for appending completed source paths - the
+        file is re-written with the 'completed' source paths (removes an
+        incompletely written last line)
+    """
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(_checkpoint_header(save_quality, max_pixel_of_largest_side))
+        for source in sorted(completed):
+            f.write(source + '\n')
+    os.replace(tmp_file, checkpoint_file)
+    return open(checkpoint_file, 'a')
+
+
+def _init_worker(cache):
+    """ Initialize a worker process - let the parent process handle
+        Ctrl+C and store the cache (sent once per worker, not with
+        every task)
+    """
+    global _worker_cache
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_cache = cache
+
+
+def _compress_task(task, cache=None):
+    """ Compress an image - returns (source, success) """
+    source, dest, save_quality, max_pixel_of_largest_side = task
+    try:
+        compress_image_to_file(
+            source, dest, save_quality, max_pixel_of_largest_side, cache)
+        return source, True
+    except Exception:
+        return source, False
+
+
+def _compress_task_in_worker(task):
+    """ Compress an image with the cache of the worker process """
+    return _compress_task(task, _worker_cache)
+
+
+def compress_directory(
+        image_source_list,
+        image_dest_list,
+        save_quality=None,
+        max_pixel_of_largest_side=None,
+        n_processes=4,
+        checkpoint_file=None,
+        cache=None,
+        report_every_seconds=30):
+    """ Compress images with a pool of processes and resume from
+        'checkpoint_file' (if specified)
+        Returns: dict with the number of compressed, skipped and
+                 failed images
+    """
+    # Check Input
+    assert (save_quality is not None) or \
+        (max_pixel_of_largest_side is not None), \
+        "At least one of save_quality or max_pixel_of_largest_side must be \
+         specified"
+    if save_quality is not None:
+        assert (save_quality <= 100) and (save_quality > 0), \
+            "save_quality must be between 1 and 100"
+    completed = set()
+    if checkpoint_file is not None:
+        completed = read_checkpoint(
+            checkpoint_file, save_quality, max_pixel_of_largest_side)
+    tasks = list()
+    n_skipped = 0
+    for source, dest in zip(image_source_list, image_dest_list):
+        if (source in completed) and destination_is_up_to_date(source, dest):
+            n_skipped += 1
+            continue
+        tasks.append((source, dest, save_quality, max_pixel_of_largest_side))
+    n_tot = len(tasks)
+    print("Skipping {} already compressed images - compressing {}".format(
+          n_skipped, n_tot))
+    checkpoint = None
+    if checkpoint_file is not None:
+        checkpoint = open_checkpoint(
+            checkpoint_file, save_quality, max_pixel_of_largest_side,
+            completed)
+    counter = 0
+    n_failed = 0
+    start_time = time.time()
+    last_report_time = start_time
+    pool = None
+    try:
+        if n_processes > 1:
+            pool = Pool(
+                n_processes, initializer=_init_worker, initargs=(cache, ))
+            # small chunks: idle workers take the next images
+            results = pool.imap_unordered(
+                _compress_task_in_worker, tasks, chunksize=4)
+        else:
+            results = map(partial(_compress_task, cache=cache), tasks)
+        for source, success in results:
+            counter += 1
+            if success:
+                if checkpoint is not None:
+                    checkpoint.write(source + '\n')
+            else:
+                n_failed += 1
+                print("Failed to compress {}".format(source))
+            if (time.time() - last_report_time) >= report_every_seconds:
+                last_report_time = time.time()
+                if checkpoint is not None:
+                    checkpoint.flush()
+                print(("Done {}/{} - {:.1f} images/s - "
+                       "estimated time remaining: {}").format(
+                      counter, n_tot,
+                      counter / (last_report_time - start_time),
+                      estimate_remaining_time(start_time, n_tot, counter)))
+                sys.stdout.flush()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if checkpoint is not None:
+            checkpoint.close()
+    seconds = time.time() - start_time
+    print(("Finished - compressed {} images in {:.0f}s "
+           "({:.1f} images/s), {} failed").format(
+          counter - n_failed, seconds,
+          counter / seconds if seconds > 0 else 0, n_failed))
+    return {'compressed': counter - n_failed, 'skipped': n_skipped,
+            'failed': n_failed}
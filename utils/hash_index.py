@@ -0,0 +1,75 @@
+""" Persistent Index of File Hashes (SQLite)
+    - stores path, size, mtime, first-chunk hash and full hash of files
+    - entries are invalid if size or mtime of a file changed
+"""
+import os
+import sqlite3
+import hashlib
+
+from utils.utils import hash_files
+
+
+def open_hash_index(path):
+    """ Open (or create) a hash index """
+    hash_index = sqlite3.connect(path, timeout=60)
+    hash_index.execute(
+        "CREATE TABLE IF NOT EXISTS file_hashes ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+        "first_chunk_hash BLOB, full_hash BLOB)")
+    hash_index.commit()
+    return hash_index
+
+
+def get_indexed_hashes(
+        hash_index, paths, first_chunk_only=False, hash=hashlib.sha1,
+        n_threads=8):
+    """ Get the hashes of multiple files from the index - files that are
+        not indexed or changed are hashed in parallel and stored
+        Returns: list of hashes (in input order) - None if a file
+                 could not be read
+    """
+    if hash_index is None:
+        return hash_files(
+            paths, first_chunk_only=first_chunk_only, hash=hash,
+            n_threads=n_threads)
+    if hash is not hashlib.sha1:
+        raise ValueError("hash index only supports sha1 hashes")
+    hash_col = 'first_chunk_hash' if first_chunk_only else 'full_hash'
+    hashes = [None] * len(paths)
+    to_hash = list()
+    for i, path in enumerate(paths):
+        try:
+            stat = os.stat(path)
+        except (OSError,):
+            continue
+        row = hash_index.execute(
+            "SELECT size, mtime, {} FROM file_hashes "
+            "WHERE path = ?".format(hash_col), (path, )).fetchone()
+        if row is not None and row[2] is not None and \
+                row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            hashes[i] = row[2]
+        else:
+            to_hash.append((i, path, stat))
+    new_hashes = hash_files(
+        [x[1] for x in to_hash], first_chunk_only=first_chunk_only,
+        hash=hash, n_threads=n_threads)
+    for (i, path, stat), file_hash in zip(to_hash, new_hashes):
+        hashes[i] = file_hash
+        if file_hash is None:
+            continue
+        row = hash_index.execute(
+            "SELECT size, mtime FROM file_hashes WHERE path = ?",
+            (path, )).fetchone()
+        if row is not None and \
+                row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            hash_index.execute(
+                "UPDATE file_hashes SET {} = ? "
+                "WHERE path = ?".format(hash_col), (file_hash, path))
+        else:
+            hash_index.execute(
+                "INSERT OR REPLACE INTO file_hashes "
+                "(path, size, mtime, {}) VALUES (?, ?, ?, ?)".format(
+                    hash_col),
+                (path, stat.st_size, stat.st_mtime_ns, file_hash))
+    hash_index.commit()
+    return hashes
@@ -0,0 +1,157 @@
+""" On-Disk Cache of Compressed Images
+    - stores compressed images keyed by source path, size and mtime of
+      the source and the compression parameters (and an optional
+      variant, e.g. the resize method)
+    - entries of changed sources are never hit (the key changes)
+    - the cache is size-bounded, least recently used entries are evicted
+    - safe to share between processes (writes are atomic, eviction
+      tolerates files removed by other processes) - each of the
+      'n_processes' writing processes may add a 1/n_processes share of
+      the free space it last saw before the cache directory is scanned
+      again, which keeps the total size (approximately) within the limit
+"""
+import os
+import uuid
+import hashlib
+
+
+CACHE_FILE_EXT = '.jpg'
+
+
+class CompressedImageCache(object):
+    """ Size-bounded LRU cache of compressed images in 'cache_dir'
+        - get(source_path, ...) returns bytes or None
+        - put(source_path, ..., data) stores bytes
+        - get_or_compress(source_path, ..., compress) returns bytes and
+          calls compress(source_path) -> bytes on a cache miss
+    """
+    def __init__(self, cache_dir, max_size_bytes=20 * 1024 ** 3,
+                 n_processes=1):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        # number of processes that write to the cache concurrently
+        self.n_processes = max(n_processes, 1)
+        os.makedirs(cache_dir, exist_ok=True)
+        # size of the cache at the last scan, bytes added since then
+        self._size_bytes = None
+        self._added_bytes = 0
+
+    def __getstate__(self):
+        # the size is scanned in each process (on its first put)
+        return {'cache_dir': self.cache_dir,
+                'max_size_bytes': self.max_size_bytes,
+                'n_processes': self.n_processes,
+                '_size_bytes': None,
+                '_added_bytes': 0}
+
+    def key(self, source_path, max_pixel_of_largest_side, save_quality,
+            variant=None):
+        """ Cache key of a source image and compression parameters """
+        stat = os.stat(source_path)
+        key_parts = [
+            os.path.abspath(source_path), str(stat.st_size),
+            str(stat.st_mtime_ns), str(max_pixel_of_largest_side),
+            str(save_quality)]
+        if variant is not None:
+            key_parts.append(str(variant))
+        key_data = '|'.join(key_parts)
+        return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_FILE_EXT)
+
+    def get(self, source_path, max_pixel_of_largest_side, save_quality,
+            variant=None):
+        """ Get cached bytes of a compressed image (None if not cached) """
+        path = self._path(self.key(
+            source_path, max_pixel_of_largest_side, save_quality, variant))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, source_path, max_pixel_of_largest_side, save_quality, data,
+            variant=None):
+        """ Store bytes of a compressed image """
+        path = self._path(self.key(
+            source_path, max_pixel_of_largest_side, save_quality, variant))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            # an overwritten entry does not add its size again
+            replaced_bytes = os.path.getsize(path)
+        except OSError:
+            replaced_bytes = 0
+        os.replace(tmp_path, path)
+        if self._size_bytes is None:
+            self._size_bytes = self.size_bytes()
+            self._added_bytes = 0
+        else:
+            self._added_bytes += len(data) - replaced_bytes
+        # other processes are assumed to add as much as this one
+        estimated_size = \
+            self._size_bytes + self.n_processes * self._added_bytes
+        if estimated_size > self.max_size_bytes:
+            self.evict()
+
+    def get_or_compress(
+            self, source_path, max_pixel_of_largest_side, save_quality,
+            compress, variant=None):
+        """ Get cached bytes of a compressed image - compress and
+            store them on a cache miss
+        """
+        data = self.get(
+            source_path, max_pixel_of_largest_side, save_quality, variant)
+        if data is None:
+            data = compress(source_path)
+            self.put(
+                source_path, max_pixel_of_largest_side, save_quality, data,
+                variant)
+        return data
+
+    def _entries(self):
+        """ List of (mtime, size, path) of all cache entries """
+        entries = list()
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if not entry.name.endswith(CACHE_FILE_EXT):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size_bytes(self):
+        """ Total size of all cache entries """
+        return sum([x[1] for x in self._entries()])
+
+    def evict(self, target_fraction=0.9):
+        """ Scan the cache and remove least recently used entries until
+            the cache is below 'target_fraction' of its max size (if it
+            exceeds its max size)
+        """
+        entries = sorted(self._entries())
+        size_bytes = sum([x[1] for x in entries])
+        target_size = self.max_size_bytes * target_fraction
+        if size_bytes <= self.max_size_bytes:
+            target_size = size_bytes
+        for _, entry_size, path in entries:
+            if size_bytes <= target_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size_bytes -= entry_size
+        self._size_bytes = size_bytes
+        self._added_bytes = 0
@@ -2,10 +2,13 @@
     - single images
     - list of images
     - multiprocessing
+    - a long-lived compression service (reusable worker pool)
 """
 from PIL import Image
 import traceback
-from multiprocessing import Process, Manager
+import signal
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import io
 
 from utils.utils import slice_generator
@@ -19,6 +22,33 @@ def aspect_preserving_max_side_resize(img, max_side):
         img.thumbnail(size=[max_side, max_side], resample=1)
 
 
+def _max_side_size(size, max_side):
+    """ Size of an image after resizing its largest side to 'max_side' """
+    width, height = size
+    scale = max_side / max(width, height)
+    return (max(int(round(width * scale)), 1),
+            max(int(round(height * scale)), 1))
+
+
+def draft_max_side_resize(img, max_side):
+    """ Resize image object to the largest side having 'max_side'
+        number of pixels - JPEGs are first downscaled by a power of two
+        by the decoder (fast) to at least the final size
+        Returns: the resized image object
+    """
+    if not any([x > max_side for x in img.size]):
+        return img
+    size = _max_side_size(img.size, max_side)
+    # decoder downscaling (only has an effect on not yet loaded JPEGs)
+    img.draft(img.mode, size)
+    if img.size != size:
+        resized = img.resize(size, resample=1)
+        # keep the source format (determines how it is saved)
+        resized.format = img.format
+        img = resized
+    return img
+
+
 def save_and_compress_image(img, output_bytes, quality=None):
     """ Compress image object (only JPEG) """
     if (quality is not None) and (img.format == 'JPEG'):
@@ -30,19 +60,26 @@ def save_and_compress_image(img, output_bytes, quality=None):
 def resize_and_compress_single_image(
         image_path,
         max_pixel_of_largest_side=None,
-        save_quality=None):
-    """ Resize and compress a single image and return Byte object """
+        save_quality=None,
+        draft=False):
+    """ Resize and compress a single image and return Byte object
+        - draft: use decoder downscaling to resize (faster)
+    """
     # Read the file from disk
     with open(image_path, 'rb') as f:
         img = Image.open(io.BytesIO(f.read()))
         # resize if necessary
         if max_pixel_of_largest_side is not None:
-            aspect_preserving_max_side_resize(img, max_pixel_of_largest_side)
+            if draft:
+                img = draft_max_side_resize(img, max_pixel_of_largest_side)
+            else:
+                aspect_preserving_max_side_resize(
+                    img, max_pixel_of_largest_side)
         # Save to Bytes and Change quality (only for JPEG)
         bytes_obj = io.BytesIO()
         save_and_compress_image(img, bytes_obj, save_quality)
-        readable_bytes = io.BytesIO(bytes_obj.getvalue())
-    return readable_bytes
+        bytes_obj.seek(0)
+    return bytes_obj
 
 
 def resize_and_compress_list_of_images(
@@ -69,6 +106,16 @@ def resize_and_compress_list_of_images(
         print("Finished process: {:2}".format(process_id))
 
 
+def _process_images_list_to_dict(
+        image_process_function, image_source_list, process_id,
+        print_status, kwargs):
+    """ Run 'image_process_function' and return its results """
+    results_dict = dict()
+    image_process_function(
+        image_source_list, results_dict, process_id, print_status, **kwargs)
+    return results_dict
+
+
 def process_images_list_multiprocess(
         image_source_list,
         image_process_function,
@@ -82,31 +129,28 @@ def process_images_list_multiprocess(
             list of source image paths
         image_process_function (func):
             a function to process images, takes as input:
-            pid (int), image_source_list, image_dest_list,
-            status_messages (dict), additional keyword arguments
+            image_source_list, results_dict, pid (int),
+            print_status, additional keyword arguments
         n_processes (int): the number of processes to use
     """
     n_records = len(image_source_list)
-    n_processes = min(n_processes, n_records)
-    # Shared dictionary to store results
-    manager = Manager()
-    results_dict = manager.dict()
-    for image_source in image_source_list:
-        results_dict[image_source] = None
-    try:
-        processes_list = list()
+    n_processes = max(min(n_processes, n_records), 1)
+    # results are returned by the processes (no shared dictionary)
+    results_dict = {x: None for x in image_source_list}
+    with ProcessPoolExecutor(max_workers=n_processes) as executor:
+        futures = list()
         slices = slice_generator(n_records, n_processes)
         for i, (start_i, end_i) in enumerate(slices):
-            pr = Process(target=image_process_function,
-                         args=(image_source_list[start_i:end_i],
-                               results_dict, i, print_status),
-                         kwargs=kwargs)
-            pr.start()
-            processes_list.append(pr)
-        for p in processes_list:
-            p.join()
-    except Exception:
-        print(traceback.format_exc())
+            futures.append(executor.submit(
+                _process_images_list_to_dict,
+                image_process_function,
+                image_source_list[start_i:end_i],
+                i, print_status, kwargs))
+        for future in futures:
+            try:
+                results_dict.update(future.result())
+            except Exception:
+                print(traceback.format_exc())
 
     # convert result to a list
     results_list = list()
@@ -114,3 +158,108 @@ def process_images_list_multiprocess(
         results_list.append(results_dict[image_source])
 
     return results_list
+
+
+def _compress_image_to_bytes(
+        image_path, max_pixel_of_largest_side, save_quality, draft):
+    return resize_and_compress_single_image(
+        image_path, max_pixel_of_largest_side, save_quality,
+        draft).getvalue()
+
+
+def compress_images_to_bytes(
+        image_paths,
+        max_pixel_of_largest_side=None,
+        save_quality=None,
+        cache=None,
+        draft=False):
+    """ Compress a list of images - use a CompressedImageCache
+        to re-use previously compressed images if 'cache' is specified
+        Returns: list of bytes (None if an image failed to process)
+    """
+    compress = partial(
+        _compress_image_to_bytes,
+        max_pixel_of_largest_side=max_pixel_of_largest_side,
+        save_quality=save_quality,
+        draft=draft)
+    results = list()
+    for image_path in image_paths:
+        try:
+            if cache is None:
+                results.append(compress(image_path))
+            else:
+                results.append(cache.get_or_compress(
+                    image_path, max_pixel_of_largest_side, save_quality,
+                    compress, variant='draft' if draft else None))
+        except Exception:
+            print("Failed to compress: {}".format(image_path))
+            results.append(None)
+    return results
+
+
+def _ignore_interrupts():
+    """ Let the parent process handle Ctrl+C """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# CompressedImageCache of a worker process of an ImageCompressionService
+_worker_cache = None
+
+
+def _init_compression_worker(cache):
+    """ Initialize a worker process - the cache is sent once per worker
+        (not with every task)
+    """
+    global _worker_cache
+    _ignore_interrupts()
+    _worker_cache = cache
+
+
+def _compress_images_in_worker(
+        image_paths, max_pixel_of_largest_side, save_quality, draft):
+    """ Compress images with the cache of the worker process """
+    return compress_images_to_bytes(
+        image_paths, max_pixel_of_largest_side, save_quality,
+        _worker_cache, draft)
+
+
+class ImageCompressionService(object):
+    """ Long-lived pool of processes to compress images
+        - submit(image_paths) returns a Future of the list of
+          compressed images (bytes, None if an image failed to process)
+        - results are returned directly by the workers
+        - compressed images are re-used from 'cache' (CompressedImageCache)
+          if specified
+        - draft: use decoder downscaling to resize (faster)
+        - use as context manager or call shutdown()
+    """
+    def __init__(
+            self, n_processes=4,
+            max_pixel_of_largest_side=None,
+            save_quality=None,
+            cache=None,
+            draft=False):
+        self.max_pixel_of_largest_side = max_pixel_of_largest_side
+        self.save_quality = save_quality
+        self.cache = cache
+        self.draft = draft
+        self.executor = ProcessPoolExecutor(
+            max_workers=max(n_processes, 1),
+            initializer=_init_compression_worker,
+            initargs=(cache, ))
+
+    def submit(self, image_paths):
+        """ Compress images in a worker process """
+        return self.executor.submit(
+            _compress_images_in_worker, list(image_paths),
+            self.max_pixel_of_largest_side, self.save_quality, self.draft)
+
+    def shutdown(self, wait=True):
+        """ Stop the worker processes """
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.shutdown(wait=exc_type is None)
@@ -4,13 +4,16 @@ import os
 import time
 import datetime
 import json
+import csv
 import hashlib
 import random
+import threading
 import pandas as pd
 from hashlib import md5
 import logging
 import configparser
 from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 logger = logging.getLogger(__name__)
@@ -119,6 +122,213 @@ def slice_generator(sequence_length, n_blocks):
             for b in range(1, n_blocks+1))
 
 
+def csv_record_byte_ranges(path, n_chunks, block_size=2**20):
+    """ Split a csv file into byte ranges that are aligned to record
+        boundaries, i.e., each range starts at the beginning of a record
+        and ends after a record - the header line is excluded
+        - a record boundary is a newline outside of a quoted field, that is,
+          after an even number of quote characters
+        - newlines within quoted fields (multi-line records) are handled
+        Returns: list of (start, end) byte offsets
+    """
+    file_size = os.path.getsize(path)
+    # approximate (unaligned) start offsets of the chunks
+    targets = [int(i * file_size / n_chunks) for i in range(1, n_chunks)]
+    # the first boundary is the end of the header
+    targets.insert(0, 0)
+    boundaries = list()
+    n_quotes = 0
+    block_start = 0
+    with open(path, 'rb') as f:
+        while len(boundaries) < len(targets):
+            block = f.read(block_size)
+            if not block:
+                break
+            search_from = 0
+            while len(boundaries) < len(targets):
+                target = targets[len(boundaries)]
+                if len(boundaries) > 0:
+                    target = max(target, boundaries[-1])
+                search_from = max(search_from, target - block_start)
+                if search_from >= len(block):
+                    break
+                newline = block.find(b'\n', search_from)
+                if newline == -1:
+                    break
+                quotes_before = n_quotes + block.count(b'"', 0, newline)
+                if (quotes_before % 2) == 0:
+                    boundaries.append(block_start + newline + 1)
+                search_from = newline + 1
+            n_quotes += block.count(b'"')
+            block_start += len(block)
+    boundaries.append(file_size)
+    byte_ranges = [
+        (start, end) for start, end in zip(boundaries[:-1], boundaries[1:])
+        if start < end]
+    return byte_ranges
+
+
+def is_parquet_file(path):
+    """ Check if a file is (to be) stored in the columnar Parquet format """
+    return os.path.splitext(path)[1].lower() in ('.parquet', '.pq')
+
+
+def _parquet_column_to_str(values):
+    """ Convert a column read from Parquet to str (missing values to '') """
+    missing = values.isna()
+    values = values.astype(object).astype(str)
+    values[missing] = ''
+    return values
+
+
+def read_df(path, index_col=None):
+    """ Read a csv or Parquet file (determined by the file extension)
+        into a df with str columns ('' for missing values)
+    """
+    if is_parquet_file(path):
+        import pyarrow.parquet as pq
+        # keep int columns with missing values as int (not float)
+        df = pq.read_table(path).to_pandas(integer_object_nulls=True)
+        for col in df.columns:
+            df[col] = _parquet_column_to_str(df[col])
+        if index_col is not None:
+            df.set_index(index_col, inplace=True)
+    else:
+        df = pd.read_csv(path, dtype='str', index_col=index_col)
+        df.fillna('', inplace=True)
+    return df
+
+
+def _df_to_parquet_types(df, categorical_cols=()):
+    """ Prepare the column types of a df for a Parquet export
+        - numeric columns are kept as they are
+        - categorical_cols are dictionary-encoded
+        - all other columns are converted to str
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col in categorical_cols:
+            df[col] = df[col].fillna('').astype(str).astype('category')
+            continue
+        inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+        if inferred not in (
+                'integer', 'floating', 'mixed-integer-float',
+                'boolean', 'string', 'empty'):
+            df[col] = df[col].fillna('').astype(str)
+    return df
+
+
+def write_df(df, path, categorical_cols=()):
+    """ Write a df to a csv or Parquet file (determined by the file
+        extension) - the index is not exported
+    """
+    if is_parquet_file(path):
+        df = _df_to_parquet_types(df, categorical_cols)
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_header_and_rows(path, batch_size=65536):
+    """ Read the header and a generator over all rows (lists of str)
+        of a csv or Parquet file
+    """
+    if is_parquet_file(path):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        header = parquet_file.schema_arrow.names
+
+        def _rows():
+            for batch in parquet_file.iter_batches(batch_size=batch_size):
+                columns = [
+                    ['' if x is None else str(x) for x in col.to_pylist()]
+                    for col in batch.columns]
+                for row in zip(*columns):
+                    yield list(row)
+        return header, _rows()
+
+    def _csv_rows():
+        with open(path, "r") as ins:
+            csv_reader = csv.reader(ins, delimiter=',', quotechar='"')
+            next(csv_reader)
+            for line in csv_reader:
+                yield line
+
+    with open(path, "r") as ins:
+        csv_reader = csv.reader(ins, delimiter=',', quotechar='"')
+        header = next(csv_reader)
+    return header, _csv_rows()
+
+
+def _parquet_column_type(col, categorical_cols, int_cols):
+    import pyarrow as pa
+    if col in categorical_cols:
+        return pa.dictionary(pa.int32(), pa.string())
+    if col in int_cols:
+        return pa.int64()
+    return pa.string()
+
+
+def write_rows_to_parquet(
+        rows, header, path, categorical_cols=(), int_cols=(),
+        append=False, batch_size=65536):
+    """ Write rows (lists of str) to a Parquet file in batches
+        - memory usage is bound by the batch size
+        - categorical_cols are dictionary-encoded
+        - int_cols are stored as int64 ('' as missing value)
+        - append: add the rows to the rows of an existing file
+        - the file is written to a temporary file first and then replaces
+          'path' (an existing file is kept if writing fails)
+        Returns: number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    types = [_parquet_column_type(col, categorical_cols, int_cols)
+             for col in header]
+    schema = pa.schema(list(zip(header, types)))
+    n_written = 0
+
+    def _to_array(values, col_type):
+        if pa.types.is_integer(col_type):
+            return pa.array(
+                [None if x == '' else int(x) for x in values],
+                type=col_type)
+        return pa.array(values, type=pa.string()).cast(col_type)
+
+    def _write_batch(writer, batch):
+        columns = list(zip(*batch))
+        table = pa.Table.from_arrays(
+            [_to_array(col, col_type)
+             for col, col_type in zip(columns, types)],
+            schema=schema)
+        writer.write_table(table)
+
+    tmp_path = path + '.tmp'
+    try:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            if append:
+                existing = pq.ParquetFile(path)
+                for existing_batch in existing.iter_batches(
+                        batch_size=batch_size):
+                    writer.write_table(
+                        pa.Table.from_batches([existing_batch]).cast(schema))
+            batch = list()
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    _write_batch(writer, batch)
+                    n_written += len(batch)
+                    batch = list()
+            if len(batch) > 0:
+                _write_batch(writer, batch)
+                n_written += len(batch)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+    return n_written
+
+
 def read_config_file(cfg_file_path):
     """ Reads a cfg (.ini) file """
     # replace ~ in path
@@ -304,8 +514,7 @@ def remove_images_from_df(
 
 
 def read_cleaned_season_file_df(path):
-    df = pd.read_csv(path, dtype='str', index_col=None)
-    df.fillna('', inplace=True)
+    df = read_df(path)
     required_header_cols = ('capture_id', 'season', 'site', 'roll', 'capture',
                             'path')
     if 'path' not in df.columns:
@@ -408,16 +617,12 @@ def balanced_sample_best_effort(y, n_samples):
 def merge_csvs(base_csv, to_add_csv, key, merge_new_cols_to_right=True):
     """ Merge two csvs and return a df """
 
-    df_base = pd.read_csv(
-        base_csv, dtype='str')
-    df_base.fillna('', inplace=True)
+    df_base = read_df(base_csv)
 
     assert key in df_base.columns.tolist(), \
         "column {} not found in {}".format(key, base_csv)
 
-    df_add = pd.read_csv(
-        to_add_csv, dtype='str', index_col=key)
-    df_add.fillna('', inplace=True)
+    df_add = read_df(to_add_csv, index_col=key)
     df_add.index = df_add.index.astype('str')
 
     # drop duplicate cols
@@ -477,8 +682,82 @@ def get_hash(filename, first_chunk_only=False, hash=hashlib.sha1):
     if first_chunk_only:
         hashobj.update(file_object.read(1024))
     else:
-        for chunk in chunk_reader(file_object):
+        for chunk in chunk_reader(file_object, chunk_size=2**20):
             hashobj.update(chunk)
     hashed = hashobj.digest()
     file_object.close()
     return hashed
+
+
+HASH_ALGORITHMS = {
+    'sha1': hashlib.sha1,
+    'md5': hashlib.md5,
+    'blake2b': hashlib.blake2b,
+    'sha256': hashlib.sha256}
+
+
+# read buffers of the hashing threads (one per thread)
+_hash_buffers = threading.local()
+
+
+def _get_hash_buffer(buffer_size):
+    """ Get the read buffer of the current thread """
+    buffer = getattr(_hash_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != buffer_size:
+        buffer = bytearray(buffer_size)
+        _hash_buffers.buffer = buffer
+    return buffer
+
+
+def _hash_file_buffered(
+        filename, first_chunk_only=False, hash=hashlib.sha1,
+        buffer_size=2**22):
+    """ Hash a file (same result as get_hash) by reading it into a
+        buffer re-used by the thread - hashlib releases the GIL for large buffers
+        Returns: tuple of hash and number of bytes read
+    """
+    hashobj = hash()
+    if first_chunk_only:
+        with open(filename, 'rb') as f:
+            chunk = f.read(1024)
+        hashobj.update(chunk)
+        return hashobj.digest(), len(chunk)
+    buffer = _get_hash_buffer(buffer_size)
+    view = memoryview(buffer)
+    n_bytes_total = 0
+    with open(filename, 'rb', buffering=0) as f:
+        while True:
+            n_bytes = f.readinto(buffer)
+            if not n_bytes:
+                break
+            hashobj.update(view[:n_bytes])
+            n_bytes_total += n_bytes
+    return hashobj.digest(), n_bytes_total
+
+
+def hash_files(
+        filenames, first_chunk_only=False, hash=hashlib.sha1, n_threads=8):
+    """ Hash files using a pool of threads (overlaps I/O)
+        Returns: list of hashes (in input order) - None if a file
+                 could not be read
+    """
+    def _hash(filename):
+        try:
+            return _hash_file_buffered(
+                filename, first_chunk_only=first_chunk_only, hash=hash)
+        except (OSError,):
+            return None, 0
+
+    start_time = time.time()
+    if n_threads > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            results = list(executor.map(_hash, filenames))
+    else:
+        results = [_hash(x) for x in filenames]
+    time_elapsed = max(time.time() - start_time, 1e-9)
+    n_mb_total = sum(x[1] for x in results) / 2**20
+    logger.info(
+        "Hashed {} files ({:.1f} MB) in {:.1f}s - {:.1f} MB/s".format(
+            len(results), n_mb_total, time_elapsed,
+            n_mb_total / time_elapsed))
+    return [x[0] for x in results]
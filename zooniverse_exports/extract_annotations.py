@@ -14,7 +14,13 @@
             4,0,1,0,0,1,1,wildebeest,
 """
 import csv
+import io
+import copy
+import math
+import itertools
 from collections import Counter, defaultdict
+from functools import partial
+from multiprocessing import Pool
 import traceback
 import os
 import argparse
@@ -24,7 +30,9 @@ import json
 
 from utils.logger import set_logging
 from zooniverse_exports import extractor
-from utils.utils import print_nested_dict, set_file_permission
+from utils.utils import (
+    print_nested_dict, set_file_permission, csv_record_byte_ranges,
+    is_parquet_file, write_rows_to_parquet)
 from config.cfg import cfg
 
 
@@ -32,6 +40,9 @@ flags = cfg['extractor_flags']
 flags_global = cfg['global_processing_flags']
 logger = logging.getLogger(__name__)
 
+# max size of the chunks processed by one worker if n_processes > 1
+MAX_CHUNK_SIZE_BYTES = 64 * 1024 * 1024
+
 # # Cedar Creek
 # args = dict()
 # args['classification_csv'] = '/home/packerc/shared/zooniverse/Exports/CC/CC_S1_classifications.csv'
@@ -96,6 +107,523 @@ def extract_raw_classification(
     return extracted_annotations
 
 
+def classification_passes_filters(cls_dict, args, stats):
+    """ Check whether a classification passes all filters (except the
+        duplicate check, which depends on all previous classifications)
+        cls_dict: dict of raw classification
+        args: dict with configuration
+        stats: Counter object to track stats
+    """
+    if not extractor.is_eligible_workflow(
+            cls_dict,
+            args['workflow_id'],
+            args['workflow_version_min']):
+        stats.update({'n_not_eligible_workflow'})
+        return False
+
+    if not extractor.is_in_date_range(
+            cls_dict,
+            args['no_earlier_than_date'],
+            args['no_later_than_date']):
+        stats.update({'n_not_in_date_range'})
+        return False
+
+    metadata = json.loads(cls_dict['metadata'])
+    if not extractor.project_is_live(metadata):
+        if not args['include_non_live_classifications']:
+            stats.update({'n_project_is_not_live'})
+            return False
+
+    if args['filter_by_season'] != '':
+        subject_data = json.loads(cls_dict['subject_data'])
+        season_id = extractor.get_season_from_subject_data(
+            subject_data, cls_dict['subject_ids'])
+        if season_id != args['filter_by_season']:
+            stats.update({'n_season_does_not_match'})
+            return False
+
+    if extractor.subject_already_seen(cls_dict):
+        msg = "Removed classification_id: {} due to \
+               'seen_before' flag".format(
+             cls_dict['classification_id'])
+        logger.debug(textwrap.shorten(msg, width=99))
+        stats.update({'n_seen_before'})
+        return False
+
+    return True
+
+
+def _remove_duplicate(classification_id, stats):
+    """ Log and count a duplicate classification """
+    msg = "Removed classification_id: {} is duplicate".format(
+           classification_id)
+    logger.debug(textwrap.shorten(msg, width=150))
+    stats.update({'n_duplicate_classifications_removed'})
+
+
+def classification_is_eligible(cls_dict, args, stats, duplicate_tracker):
+    """ Check whether a classification passes all filters
+        cls_dict: dict of raw classification
+        args: dict with configuration
+        stats: Counter object to track stats
+        duplicate_tracker: set of unique keys of classifications seen so far
+    """
+    if not classification_passes_filters(cls_dict, args, stats):
+        return False
+
+    if extractor.classification_is_duplicate(
+            cls_dict, duplicate_tracker):
+        _remove_duplicate(cls_dict['classification_id'], stats)
+        return False
+
+    return True
+
+
+def _log_extraction_failure(line_no, cls_dict, error):
+    logger.warning(
+        "Failed to extract classification number {}".format(
+            line_no
+        ))
+    logger.warning(
+        "Full data {}".format(
+            cls_dict
+        ))
+    logger.warning(error)
+
+
+def _log_invalid_classification(line_no, cls_dict):
+    logger.warning(
+        "Classification on line {} not valid, data: {}".format(
+            line_no, cls_dict
+        ))
+
+
+def create_extraction_state(filters=None):
+    """ Create the state of an extraction that allows to continue it
+        incrementally: the last classification extracted (watermark),
+        the keys of the duplicate tracker, the csv header / questions
+        and the size of the output (to detect interrupted appends)
+    """
+    return {
+        'last_classification_id': None,
+        'duplicate_tracker': set(),
+        'output_size': None,
+        'filters': filters,
+        'question_answer_pairs': dict(),
+        'question_types': dict(),
+        'question_header': None}
+
+
+def extraction_filters(args):
+    """ Arguments that determine which classifications are extracted """
+    filters = {k: args[k] for k in [
+        'workflow_id', 'workflow_version_min', 'filter_by_season',
+        'include_non_live_classifications']}
+    for date_arg in ['no_earlier_than_date', 'no_later_than_date']:
+        if args[date_arg] is None:
+            filters[date_arg] = None
+        else:
+            filters[date_arg] = str(args[date_arg])
+    return filters
+
+
+def extraction_state_path(output_csv):
+    """ Path of the sidecar file storing the extraction state """
+    return output_csv + '.state.json'
+
+
+def write_extraction_state(state, path):
+    """ Write the extraction state to a json file (atomically) """
+    state_to_write = dict(state)
+    state_to_write['duplicate_tracker'] = sorted(
+        [list(x) for x in state['duplicate_tracker']])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state_to_write, f)
+    os.replace(tmp_path, path)
+    set_file_permission(path)
+
+
+def read_extraction_state(path):
+    """ Read the extraction state from a json file """
+    with open(path, 'r') as f:
+        state = json.load(f)
+    state['duplicate_tracker'] = set(
+        [tuple(x) for x in state['duplicate_tracker']])
+    return state
+
+
+def update_extraction_watermark(state, classification_id):
+    """ Update the last classification_id seen """
+    classification_id = int(classification_id)
+    if state['last_classification_id'] is None or \
+            classification_id > state['last_classification_id']:
+        state['last_classification_id'] = classification_id
+
+
+def output_size(path):
+    """ Size of an output file: number of rows (Parquet) or bytes (csv) """
+    if is_parquet_file(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return os.path.getsize(path)
+
+
+def truncate_output(path, size):
+    """ Truncate an output file to 'size' (see output_size) """
+    if is_parquet_file(path):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path).slice(0, size)
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    else:
+        with open(path, 'r+') as f:
+            f.truncate(size)
+
+
+def classification_already_extracted(cls_dict, last_classification_id):
+    """ Check if a classification is at or below the watermark of a
+        previous extraction
+    """
+    if last_classification_id is None:
+        return False
+    return int(cls_dict['classification_id']) <= last_classification_id
+
+
+def extract_classifications(classification_csv, args, stats, state=None):
+    """ Read a classification csv and extract all eligible classifications
+        - generator that yields the extracted annotations (list) of each
+          eligible classification in the order of the input file
+        - only one classification is held in memory at a time
+        - state: extraction state of a previous extraction (optional),
+          classifications at or below its watermark are skipped, the
+          state is updated with the classifications read
+    """
+    if state is None:
+        state = create_extraction_state()
+    last_classification_id = state['last_classification_id']
+
+    with open(classification_csv, "r") as ins:
+        csv_reader = csv.reader(ins, delimiter=',', quotechar='"')
+        header = next(csv_reader)
+
+        # keep track of potential duplicates
+        duplicate_tracker = state['duplicate_tracker']
+
+        for line_no, line in enumerate(csv_reader):
+            # print status
+            if ((line_no % 10000) == 0) and (line_no > 0):
+                print("Processed {:,} classifications".format(line_no))
+
+            stats.update({'n_classifications_processed'})
+
+            # create dictionary from input line
+            cls_dict = {header[i]: x for i, x in enumerate(line)}
+
+            try:
+                if classification_already_extracted(
+                        cls_dict, last_classification_id):
+                    stats.update({'n_already_extracted'})
+                    continue
+
+                update_extraction_watermark(
+                    state, cls_dict['classification_id'])
+
+                if not extractor.classification_is_valid(cls_dict):
+                    _log_invalid_classification(line_no, cls_dict)
+
+                if not classification_is_eligible(
+                        cls_dict, args, stats, duplicate_tracker):
+                    continue
+
+                extracted_classification = extract_raw_classification(
+                    cls_dict, args, stats)
+
+            except Exception:
+                _log_extraction_failure(
+                    line_no, cls_dict, traceback.format_exc())
+                stats.update({'n_exceptions'})
+                continue
+
+            yield extracted_classification
+
+
+def _extract_classifications_chunk(
+        classification_csv, header, args, last_classification_id,
+        byte_range):
+    """ Filter and extract the classifications in a byte range of the
+        classification csv - worker of 'extract_classifications_parallel'
+        - the duplicate check is left to the caller because it depends on
+          the classifications of all previous chunks
+        Returns: dict with the number of lines, stats, invalid
+                 classifications and one candidate per classification that
+                 passed the filters (or failed with an exception)
+    """
+    start, end = byte_range
+    with open(classification_csv, 'rb') as f:
+        f.seek(start)
+        chunk = io.TextIOWrapper(io.BytesIO(f.read(end - start)))
+    csv_reader = csv.reader(chunk, delimiter=',', quotechar='"')
+    stats = Counter()
+    watermark = create_extraction_state()
+    invalid = list()
+    candidates = list()
+    n_lines = 0
+    for line_no, line in enumerate(csv_reader):
+        n_lines += 1
+        stats.update({'n_classifications_processed'})
+        cls_dict = {header[i]: x for i, x in enumerate(line)}
+        candidate = {
+            'line_no': line_no, 'unique_key': None,
+            'classification_id': None, 'extracted': None,
+            'stats': None, 'error': None, 'cls_dict': None}
+        try:
+            if classification_already_extracted(
+                    cls_dict, last_classification_id):
+                stats.update({'n_already_extracted'})
+                continue
+            update_extraction_watermark(
+                watermark, cls_dict['classification_id'])
+            if not extractor.classification_is_valid(cls_dict):
+                invalid.append((line_no, cls_dict))
+            if not classification_passes_filters(cls_dict, args, stats):
+                continue
+            candidate['unique_key'] = \
+                extractor.get_classification_unqiue_key(cls_dict)
+            candidate['classification_id'] = cls_dict['classification_id']
+            # stats of the extraction are only counted if the
+            # classification is not a duplicate
+            candidate['stats'] = Counter()
+            candidate['extracted'] = extract_raw_classification(
+                cls_dict, args, candidate['stats'])
+        except Exception:
+            candidate['error'] = traceback.format_exc()
+            candidate['cls_dict'] = cls_dict
+        candidates.append(candidate)
+    return {
+        'n_lines': n_lines, 'stats': stats,
+        'last_classification_id': watermark['last_classification_id'],
+        'invalid': invalid, 'candidates': candidates}
+
+
+def extract_classifications_parallel(
+        classification_csv, args, stats, state=None,
+        n_processes=2, n_chunks=None):
+    """ Read a classification csv and extract all eligible classifications
+        using multiple processes - yields exactly the same as
+        'extract_classifications' (and updates the state the same way)
+        - the csv is split into byte ranges aligned to record boundaries,
+          each range is filtered and extracted by a worker
+        - chunk results are merged in the order of the input file to
+          determine duplicates across chunks
+    """
+    with open(classification_csv, "r") as ins:
+        csv_reader = csv.reader(ins, delimiter=',', quotechar='"')
+        header = next(csv_reader)
+
+    if n_chunks is None:
+        file_size = os.path.getsize(classification_csv)
+        n_chunks = max(
+            n_processes * 4,
+            int(math.ceil(file_size / MAX_CHUNK_SIZE_BYTES)))
+
+    byte_ranges = csv_record_byte_ranges(classification_csv, n_chunks)
+
+    if state is None:
+        state = create_extraction_state()
+
+    # keep track of potential duplicates
+    duplicate_tracker = state['duplicate_tracker']
+
+    n_lines_before = 0
+    with Pool(n_processes) as pool:
+        chunk_results = pool.imap(
+            partial(_extract_classifications_chunk,
+                    classification_csv, header, args,
+                    state['last_classification_id']),
+            byte_ranges)
+        for chunk_result in chunk_results:
+            stats.update(chunk_result['stats'])
+            if chunk_result['last_classification_id'] is not None:
+                update_extraction_watermark(
+                    state, chunk_result['last_classification_id'])
+            for line_no, cls_dict in chunk_result['invalid']:
+                _log_invalid_classification(n_lines_before + line_no, cls_dict)
+            for candidate in chunk_result['candidates']:
+                unique_key = candidate['unique_key']
+                if unique_key is not None:
+                    if unique_key in duplicate_tracker:
+                        _remove_duplicate(candidate['classification_id'], stats)
+                        continue
+                    duplicate_tracker.add(unique_key)
+                if candidate['error'] is not None:
+                    _log_extraction_failure(
+                        n_lines_before + candidate['line_no'],
+                        candidate['cls_dict'], candidate['error'])
+                    stats.update({'n_exceptions'})
+                    continue
+                stats.update(candidate['stats'])
+                yield candidate['extracted']
+            n_lines_before += chunk_result['n_lines']
+            print("Processed {:,} classifications".format(n_lines_before))
+
+
+def create_annotation_stats():
+    """ Create containers to collect stats of extracted annotations """
+    return {
+        'question_stats': defaultdict(Counter),
+        'question_types': dict(),
+        'workflow_stats': defaultdict(Counter),
+        'general_stats': Counter(),
+        'user_stats': Counter(),
+        'n_annotations': 0}
+
+
+def update_annotation_stats(annotation_stats, record):
+    """ Update stats with a single extracted annotation record """
+    annotation_stats['n_annotations'] += 1
+    # get question/answer stats
+    extractor.update_question_answer_counts(
+        annotation_stats['question_stats'], record)
+    extractor.update_question_types(
+        annotation_stats['question_types'], record)
+    try:
+        annotation_stats['workflow_stats'][record['workflow_id']].update(
+                {record['workflow_version']}
+        )
+    except:
+        pass
+    try:
+        not_log = record['user_name'].startswith('not-logged-in-')
+        if record['user_id'] == '' and not_log:
+            annotation_stats['general_stats'].update({'n_not_logged_in'})
+        else:
+            annotation_stats['user_stats'].update({record['user_name']})
+    except:
+        pass
+
+
+def log_annotation_stats(annotation_stats):
+    """ Print stats of extracted annotations """
+    question_stats = annotation_stats['question_stats']
+    workflow_stats = annotation_stats['workflow_stats']
+    general_stats = annotation_stats['general_stats']
+    user_stats = annotation_stats['user_stats']
+
+    # Print Stats
+    logger.info("Found the following questions/tasks: {}".format(
+        [x for x in question_stats.keys()]))
+
+    # Stats not-logged-in users
+    logger.info("Number of classifications by not logged in users: {}".format(
+        general_stats['n_not_logged_in']))
+
+    # print label stats
+    for question, answer_data in question_stats.items():
+        logger.info("Stats for question: %s" % question)
+        total = sum([x for x in answer_data.values()])
+        for answer, count in answer_data.most_common():
+            logger.info(
+                "Answer: {:20} -- counts: {:10} / {} ({:.2f} %)".format(
+                 answer, count, total, 100*count/total))
+
+    # workflow stats
+    logger.info("Workflow stats:")
+    for workflow_id, workflow_version_data in workflow_stats.items():
+        for workflow_version, count in workflow_version_data.items():
+            logger.info(
+                "Workflow id: {:7} Workflow version: {:10} -- counts: {}".format(
+                  workflow_id, workflow_version, count))
+
+    logger.info("The top-10 most active users are:")
+    for i, (user, count) in enumerate(user_stats.most_common(10)):
+        logger.info("Rank {:3} - User: {:20} - Classifications: {}".format(
+            i+1, user, count))
+
+
+def collect_annotations(args, classification_extractor, state):
+    """ Extract all eligible classifications and collect their stats
+        - in streaming mode only the stats are collected, the annotations
+          are extracted again (from a copy of the initial state) while
+          they are being written
+        Returns: stats, annotation_stats, annotations (list / iterator)
+    """
+    if args['streaming']:
+        initial_state = copy.deepcopy(state)
+        logger.info("Streaming mode - determining questions/answers ...")
+    stats = Counter()
+    annotation_stats = create_annotation_stats()
+    annotations = list()
+    for extracted_classification in classification_extractor(
+            args['classification_csv'], args, stats, state):
+        for record in extracted_classification:
+            update_annotation_stats(annotation_stats, record)
+        if not args['streaming']:
+            annotations += extracted_classification
+    if args['streaming']:
+        annotations = itertools.chain.from_iterable(
+            classification_extractor(
+                args['classification_csv'], args, Counter(), initial_state))
+    return stats, annotation_stats, annotations
+
+
+def merge_question_answer_pairs(question_answer_pairs, question_stats):
+    """ Add answers of question_stats to question_answer_pairs
+        (new questions/answers are added after the existing ones)
+    """
+    merged = {k: list(v) for k, v in question_answer_pairs.items()}
+    for question, answer_counts in question_stats.items():
+        if question not in merged:
+            merged[question] = list()
+        for answer in answer_counts.keys():
+            if answer not in merged[question]:
+                merged[question].append(answer)
+    return merged
+
+
+def build_ordered_question_header(question_answer_pairs, question_types):
+    """ Build the (ordered) question header for the csv export """
+    question_header = extractor.build_question_header(
+        question_answer_pairs, question_types)
+
+    # order questions if possible
+    try:
+        question_header_first = [
+            x for x in flags['QUESTIONS_OUTPUT_ORDER'] if x in question_header]
+        question_header_last = [
+            x for x in question_header if x not in question_header_first]
+        question_header = question_header_first + question_header_last
+    except:
+        pass
+    return question_header
+
+
+def build_classification_header():
+    """ Build the classification-level part of the csv header """
+    classification_header_cols = flags['CLASSIFICATION_INFO_TO_ADD']
+    classification_header_cols = [
+        flags['CLASSIFICATION_INFO_MAPPER'][x] if x
+        in flags['CLASSIFICATION_INFO_MAPPER'] else x for
+        x in classification_header_cols]
+    return classification_header_cols
+
+
+def create_output_row(
+        record, classification_header_cols, question_header,
+        question_types, question_answer_pairs):
+    """ Create a csv row from an extracted annotation record """
+    # get classification info data
+    class_data = [record[x] for x in classification_header_cols]
+    # get annotation info data
+    answers = extractor.flatten_annotations(
+        record['annos'], question_types,  question_answer_pairs)
+    answers_ordered = [
+        answers[x] if x in answers else '' for x
+        in question_header]
+    return class_data + answers_ordered
+
+
 if __name__ == '__main__':
 
     # Parse command line arguments
@@ -130,6 +658,29 @@ if __name__ == '__main__':
         action='store_true',
         help="Wherther to include classifications that were made during \
               the non-live phase of a project")
+    parser.add_argument(
+        "--streaming",
+        action='store_true',
+        help="Read the classification_csv twice instead of storing all \
+              extracted classifications in memory: first to determine the \
+              questions/answers (the csv header), then to write each \
+              classification directly to the output_csv. Use for very large \
+              exports, memory usage does not grow with the export size.")
+    parser.add_argument(
+        "--n_processes",
+        type=int,
+        default=1,
+        help="Number of processes to filter and extract classifications in \
+              parallel (default 1). The output is identical to a \
+              single-process extraction.")
+    parser.add_argument(
+        "--incremental",
+        action='store_true',
+        help="Extract only classifications newer than those of the previous \
+              extraction (stored in a state file next to the output_csv) \
+              and append them to the output_csv. Falls back to a full \
+              extraction if the questions/answers (the csv header) changed. \
+              The state file is only written in this mode.")
 
     args = vars(parser.parse_args())
 
@@ -177,104 +728,104 @@ if __name__ == '__main__':
                     date))
         args['no_earlier_than_date'] = no_earlier_than_date
 
+    if args['n_processes'] < 1:
+        raise ValueError(
+            "'n_processes' must be at least 1, is {}".format(
+                args['n_processes']))
+
     ######################################
     # Extract Classifications
     ######################################
 
-    # store all extracted classifications
-    all_extracted_classifications = list()
-
-    # keep track of statistics
-    stats = Counter()
-
-    with open(args['classification_csv'], "r") as ins:
-        csv_reader = csv.reader(ins, delimiter=',', quotechar='"')
-        header = next(csv_reader)
-
-        # keep track of potential duplicates
-        duplicate_tracker = set()
-
-        for line_no, line in enumerate(csv_reader):
-            # print status
-            if ((line_no % 10000) == 0) and (line_no > 0):
-                print("Processed {:,} classifications".format(line_no))
-
-            # create dictionary from input line
-            cls_dict = {header[i]: x for i, x in enumerate(line)}
-
-            try:
-                if not extractor.classification_is_valid(cls_dict):
-                    logger.warning(
-                        "Classification on line {} not valid, data: {}".format(
-                            line_no, cls_dict
-                        ))
-
-                if not extractor.is_eligible_workflow(
-                        cls_dict,
-                        args['workflow_id'],
-                        args['workflow_version_min']):
-                    stats.update({'n_not_eligible_workflow'})
-                    continue
+    if args['n_processes'] > 1:
+        classification_extractor = partial(
+            extract_classifications_parallel,
+            n_processes=args['n_processes'])
+    else:
+        classification_extractor = extract_classifications
+
+    # state of the previous extraction for incremental runs
+    state_path = extraction_state_path(args['output_csv'])
+    filters = extraction_filters(args)
+    state = None
+    if args['incremental']:
+        if not os.path.isfile(state_path):
+            logger.info(
+                "No extraction state found at {} - extracting all "
+                "classifications".format(state_path))
+        elif not os.path.isfile(args['output_csv']):
+            logger.info(
+                "output_csv {} not found - extracting all "
+                "classifications".format(args['output_csv']))
+        else:
+            state = read_extraction_state(state_path)
+            current_output_size = output_size(args['output_csv'])
+            if state['filters'] != filters:
+                logger.warning(
+                    "Filters differ from the previous extraction ({}) - "
+                    "extracting all classifications".format(
+                        state['filters']))
+                state = None
+            elif (state.get('output_size') is None) or \
+                    (current_output_size < state['output_size']):
+                logger.warning(
+                    "output_csv {} does not match the extraction state - "
+                    "extracting all classifications".format(
+                        args['output_csv']))
+                state = None
+            elif current_output_size > state['output_size']:
+                # rows appended by an interrupted extraction
+                logger.warning(
+                    "Removing output appended after the previous "
+                    "extraction state was written from {}".format(
+                        args['output_csv']))
+                truncate_output(args['output_csv'], state['output_size'])
 
-                if not extractor.is_in_date_range(
-                        cls_dict,
-                        args['no_earlier_than_date'],
-                        args['no_later_than_date']):
-                    stats.update({'n_not_in_date_range'})
-                    continue
+    incremental = state is not None
 
-                metadata = json.loads(cls_dict['metadata'])
-                if not extractor.project_is_live(metadata):
-                    if not args['include_non_live_classifications']:
-                        stats.update({'n_project_is_not_live'})
-                        continue
+    if incremental:
+        logger.info(
+            "Incremental mode - extracting classifications after "
+            "classification_id {}".format(state['last_classification_id']))
+    else:
+        state = create_extraction_state(filters)
 
-                if args['filter_by_season'] != '':
-                    subject_data = json.loads(cls_dict['subject_data'])
-                    season_id = extractor.get_season_from_subject_data(
-                        subject_data, cls_dict['subject_ids'])
-                    if season_id != args['filter_by_season']:
-                        stats.update({'n_season_does_not_match'})
-                        continue
+    stats, annotation_stats, annotations = collect_annotations(
+        args, classification_extractor, state)
 
-                if extractor.subject_already_seen(cls_dict):
-                    msg = "Removed classification_id: {} due to \
-                           'seen_before' flag".format(
-                         cls_dict['classification_id'])
-                    logger.debug(textwrap.shorten(msg, width=99))
-                    stats.update({'n_seen_before'})
-                    continue
-
-                if extractor.classification_is_duplicate(
-                        cls_dict, duplicate_tracker):
-                    # generate logging message
-                    msg = "Removed classification_id: {} is duplicate".format(
-                           cls_dict['classification_id'])
-                    logger.debug(textwrap.shorten(msg, width=150))
-                    stats.update({'n_duplicate_classifications_removed'})
-                    continue
+    # get all possible answers to the questions
+    question_answer_pairs = merge_question_answer_pairs(
+        state['question_answer_pairs'], annotation_stats['question_stats'])
 
-                extracted_classification = extract_raw_classification(
-                    cls_dict, args, stats)
+    # analyze the question types
+    question_types = dict(state['question_types'])
+    question_types.update(annotation_stats['question_types'])
 
-            except Exception:
-                logger.warning(
-                    "Failed to extract classification number {}".format(
-                        line_no
-                    ))
-                logger.warning(
-                    "Full data {}".format(
-                        cls_dict
-                    ))
-                logger.warning(traceback.format_exc())
-                stats.update({'n_exceptions'})
+    # build question header for csv export
+    question_header = build_ordered_question_header(
+        question_answer_pairs, question_types)
 
-            all_extracted_classifications += extracted_classification
+    # new questions/answers change the csv header, requiring a full run
+    if incremental and (question_header != state['question_header']):
+        logger.info(
+            "Questions/answers changed since the previous extraction - "
+            "extracting all classifications")
+        incremental = False
+        state = create_extraction_state(filters)
+        stats, annotation_stats, annotations = collect_annotations(
+            args, classification_extractor, state)
+        question_answer_pairs = merge_question_answer_pairs(
+            state['question_answer_pairs'],
+            annotation_stats['question_stats'])
+        question_types = annotation_stats['question_types']
+        question_header = build_ordered_question_header(
+            question_answer_pairs, question_types)
 
     # print statistics
-    logger.info("Processed {:,} classifications".format(line_no))
+    logger.info("Processed {:,} classifications".format(
+        stats['n_classifications_processed']))
     logger.info("Extracted {:,} identifications".format(
-        len(all_extracted_classifications)))
+        annotation_stats['n_annotations']))
 
     for stats_name, count in stats.items():
         logger.info('{}: {:,}'.format(stats_name, count))
@@ -283,86 +834,7 @@ if __name__ == '__main__':
     # Analyse Classifications
     ######################################
 
-    question_stats = defaultdict(Counter)
-    workflow_stats = defaultdict(Counter)
-    general_stats = Counter()
-    user_stats = Counter()
-
-    for classification in all_extracted_classifications:
-        # get annotation information
-        for anno in classification['annos']:
-            # get question/answer stats
-            for question, answers in anno.items():
-                if not isinstance(answers, list):
-                    question_stats[question].update([answers])
-                else:
-                    question_stats[question].update(answers)
-        try:
-            workflow_stats[classification['workflow_id']].update(
-                    {classification['workflow_version']}
-            )
-        except:
-            pass
-        try:
-            not_log = classification['user_name'].startswith('not-logged-in-')
-            if classification['user_id'] == '' and not_log:
-                general_stats.update({'n_not_logged_in'})
-            else:
-                user_stats.update({classification['user_name']})
-        except:
-            pass
-
-    # Print Stats
-    logger.info("Found the following questions/tasks: {}".format(
-        [x for x in question_stats.keys()]))
-
-    # Stats not-logged-in users
-    logger.info("Number of classifications by not logged in users: {}".format(
-        general_stats['n_not_logged_in']))
-
-    # print label stats
-    for question, answer_data in question_stats.items():
-        logger.info("Stats for question: %s" % question)
-        total = sum([x for x in answer_data.values()])
-        for answer, count in answer_data.most_common():
-            logger.info(
-                "Answer: {:20} -- counts: {:10} / {} ({:.2f} %)".format(
-                 answer, count, total, 100*count/total))
-
-    # workflow stats
-    logger.info("Workflow stats:")
-    for workflow_id, workflow_version_data in workflow_stats.items():
-        for workflow_version, count in workflow_version_data.items():
-            logger.info(
-                "Workflow id: {:7} Workflow version: {:10} -- counts: {}".format(
-                  workflow_id, workflow_version, count))
-
-    logger.info("The top-10 most active users are:")
-    for i, (user, count) in enumerate(user_stats.most_common(10)):
-        logger.info("Rank {:3} - User: {:20} - Classifications: {}".format(
-            i+1, user, count))
-
-    # get all possible answers to the questions
-    question_answer_pairs = extractor.find_question_answer_pairs(
-        all_extracted_classifications)
-
-    # analyze the question types
-    question_types = extractor.analyze_question_types(
-        all_extracted_classifications)
-
-    # build question header for csv export
-    question_header = extractor.build_question_header(
-        question_answer_pairs, question_types)
-
-    # order questions if possible
-    try:
-        question_header_first = [
-            x for x in flags['QUESTIONS_OUTPUT_ORDER'] if x in question_header]
-        question_header_last = [
-            x for x in question_header if x not in question_header_first]
-        question_header = question_header_first + question_header_last
-    except:
-        pass
+    log_annotation_stats(annotation_stats)
 
     # modify question column names as specified
     question_header_print = list()
@@ -382,35 +854,68 @@ if __name__ == '__main__':
     ######################################
 
     # build full csv header
-    classification_header_cols = flags['CLASSIFICATION_INFO_TO_ADD']
-    classification_header_cols = [
-        flags['CLASSIFICATION_INFO_MAPPER'][x] if x
-        in flags['CLASSIFICATION_INFO_MAPPER'] else x for
-        x in classification_header_cols]
+    classification_header_cols = build_classification_header()
 
     header = classification_header_cols + question_header_print
 
     logger.info("Automatically generated output header: {}".format(
         header))
 
-    with open(args['output_csv'], 'w') as f:
-        csv_writer = csv.writer(f, delimiter=',')
+    if args['streaming']:
+        logger.info("Streaming mode - extracting and writing ...")
+
+    if incremental:
+        logger.info("Appending output to {}".format(args['output_csv']))
+        write_mode = 'a'
+    else:
         logger.info("Writing output to {}".format(args['output_csv']))
-        csv_writer.writerow(header)
-        tot = len(all_extracted_classifications)
-        for line_no, record in enumerate(all_extracted_classifications):
-            # get classification info data
-            class_data = [record[x] for x in classification_header_cols]
-            # get annotation info data
-            answers = extractor.flatten_annotations(
-                record['annos'], question_types,  question_answer_pairs)
-            answers_ordered = [
-                answers[x] if x in answers else '' for x
-                in question_header]
-            csv_writer.writerow(
-                class_data + answers_ordered)
-        logger.info("Wrote {} annotations to {}".format(
-            line_no+1, args['output_csv']))
+        write_mode = 'w'
+        # a state of a previous extraction does not match the new output
+        if os.path.isfile(state_path):
+            os.remove(state_path)
+
+    output_rows = (
+        create_output_row(
+            record, classification_header_cols, question_header,
+            question_types, question_answer_pairs)
+        for record in annotations)
+
+    if is_parquet_file(args['output_csv']):
+        # indicator (0/1) columns of questions with multiple answers
+        multi_answers = set([
+            answer for question, question_type in question_types.items()
+            if question_type == 'multi'
+            for answer in question_answer_pairs[question]])
+        int_cols = flags_global['PARQUET_INTEGER_COLUMNS'] + [
+            col for col, question
+            in zip(question_header_print, question_header)
+            if question in multi_answers]
+        n_written = write_rows_to_parquet(
+            output_rows, header, args['output_csv'],
+            categorical_cols=flags_global['PARQUET_CATEGORICAL_COLUMNS'],
+            int_cols=int_cols,
+            append=incremental)
+    else:
+        with open(args['output_csv'], write_mode) as f:
+            csv_writer = csv.writer(f, delimiter=',')
+            if not incremental:
+                csv_writer.writerow(header)
+            n_written = 0
+            for row in output_rows:
+                csv_writer.writerow(row)
+                n_written += 1
+    logger.info("Wrote {} annotations to {}".format(
+        n_written, args['output_csv']))
 
     # change permmissions to read/write for group
     set_file_permission(args['output_csv'])
+
+    # save the state to allow for incremental extractions - the output
+    # size allows to remove rows appended after the state was written
+    if args['incremental']:
+        state['question_answer_pairs'] = question_answer_pairs
+        state['question_types'] = question_types
+        state['question_header'] = question_header
+        state['output_size'] = output_size(args['output_csv'])
+        write_extraction_state(state, state_path)
+        logger.info("Wrote extraction state to {}".format(state_path))
@@ -292,16 +292,22 @@ def analyze_question_types(all_records):
     """
     question_types = dict()
     for record in all_records:
-        annos = record['annos']
-        for anno in annos:
-            for question, answers in anno.items():
-                if isinstance(answers, str):
-                    question_types[question] = 'single'
-                elif isinstance(answers, list):
-                    question_types[question] = 'multi'
+        update_question_types(question_types, record)
     return question_types
 
 
+def update_question_types(question_types, record):
+    """ Update question types with the annotations of a single record
+        (allows to analyze question types without storing all records)
+    """
+    for anno in record['annos']:
+        for question, answers in anno.items():
+            if isinstance(answers, str):
+                question_types[question] = 'single'
+            elif isinstance(answers, list):
+                question_types[question] = 'multi'
+
+
 def deduplicate_answers(classification_answers, flags):
     """ De-duplicate multiple identical answers in the same classification
         This only happens if there are two or more tasks that allow for the
@@ -341,16 +347,22 @@ def find_question_answer_pairs(all_records):
     """
     pairs = defaultdict(Counter)
     for record in all_records:
-        annos = record['annos']
-        for anno in annos:
-            for question, answers in anno.items():
-                if isinstance(answers, list):
-                    pairs[question].update(answers)
-                else:
-                    pairs[question].update({answers})
+        update_question_answer_counts(pairs, record)
     return {k: list(v.keys()) for k, v in pairs.items()}
 
 
+def update_question_answer_counts(question_answer_counts, record):
+    """ Update question/answer counts with the annotations of a single record
+        question_answer_counts: defaultdict(Counter)
+    """
+    for anno in record['annos']:
+        for question, answers in anno.items():
+            if isinstance(answers, list):
+                question_answer_counts[question].update(answers)
+            else:
+                question_answer_counts[question].update({answers})
+
+
 def build_question_header(question_answer_pairs, question_types):
     """ Build a header based on question type an answers
         Output: ['species', 'count', 'eating', 'interacting',
@@ -4,7 +4,12 @@ import logging
 import argparse
 
 from utils.logger import setup_logger
-from utils.utils import merge_csvs, sort_df_by_capture_id, set_file_permission
+from utils.utils import (
+    merge_csvs, sort_df_by_capture_id, set_file_permission, write_df)
+from config.cfg import cfg
+
+
+flags_global = cfg['global_processing_flags']
 
 
 if __name__ == '__main__':
@@ -51,7 +56,9 @@ if __name__ == '__main__':
     if args['key'] == 'capture_id':
         sort_df_by_capture_id(df)
 
-    df.to_csv(args['output_csv'], index=False)
+    write_df(
+        df, args['output_csv'],
+        categorical_cols=flags_global['PARQUET_CATEGORICAL_COLUMNS'])
 
     logger.info("Wrote {} records to {}".format(
         df.shape[0], args['output_csv']))
@@ -5,8 +5,8 @@ import argparse
 import time
 import datetime
 import textwrap
-import signal
 import logging
+from functools import partial
 
 from panoptes_client import Project, Panoptes, SubjectSet
 from panoptes_client.panoptes import PanoptesAPIException
@@ -14,17 +14,18 @@ from redo import retry
 
 from utils.logger import set_logging
 from zooniverse_uploads import uploader
-from utils.resize_and_compress_images import (
-    process_images_list_multiprocess,
-    resize_and_compress_list_of_images)
+from zooniverse_uploads.upload_pipeline import upload_subjects_pipelined
+from utils.resize_and_compress_images import ImageCompressionService
+from utils.image_cache import CompressedImageCache
 from utils.utils import (
     read_config_file, estimate_remaining_time,
-    current_time_str, export_dict_to_json_with_newlines,
+    export_dict_to_json_with_newlines,
     file_path_splitter, file_path_generator, set_file_permission)
 
 
 logger = logging.getLogger(__name__)
 
+MAX_RETRIES_PER_BATCH = 5
 
 # python3 -m zooniverse_uploads.upload_manifest_v6 \
 # --manifest /home/packerc/shared/zooniverse/Manifests/GRU_TEST/GRU_S1__batch_17__manifest.json \
@@ -63,12 +64,6 @@ def add_subject_data_to_manifest(subject_set, capture_id, subject_id, data):
     data['info']['anonymized_capture_id'] = uploader.anonymize_id(capture_id)
 
 
-def batch_data_storage():
-    return {'subjects_to_link': list(),
-            'capture_ids': list(),
-            'subject_ids': list()}
-
-
 def connect_to_panoptes():
     """ connect to panoptes -- uses global config dict """
     logger.info("Connecting to Panoptes")
@@ -87,22 +82,6 @@ def get_images_list_from_capture_data(capture_data):
     return images
 
 
-def compress_images(images_to_upload, args):
-    """ Compress a list of images and return list of Byte strings """
-    images_to_upload = \
-        process_images_list_multiprocess(
-                images_to_upload,
-                resize_and_compress_list_of_images,
-                n_processes=args['n_processes'],
-                print_status=False,
-                max_pixel_of_largest_side=args['max_pixel_of_largest_side'],
-                save_quality=args['save_quality'])
-    # remove images that failed to process
-    images_to_upload = [
-        x for x in images_to_upload if x is not None]
-    return images_to_upload
-
-
 def get_subject_set(subject_set_id, subject_set_name):
     """ Get an existing subject set """
     my_set = SubjectSet().find(subject_set_id)
@@ -123,8 +102,8 @@ def get_subject_set(subject_set_id, subject_set_name):
     return my_set
 
 
-def create_subject(capture_id, capture_data, args):
-    """ Create a Subject """
+def get_capture_image_paths(capture_id, capture_data, image_root_path=None):
+    """ Get the image paths of a capture """
     images_to_upload = get_images_list_from_capture_data(capture_data)
 
     if len(images_to_upload) == 0:
@@ -132,19 +111,25 @@ def create_subject(capture_id, capture_data, args):
             capture_id))
 
     # add root path if specified
-    if args['image_root_path'] is not None:
-        images_to_upload = [os.path.join(args['image_root_path'], x)
+    if image_root_path is not None:
+        images_to_upload = [os.path.join(image_root_path, x)
                             for x in images_to_upload]
 
-    # Compress images if specified
-    if not args['dont_compress_images']:
-        images_to_upload = compress_images(images_to_upload, args)
+    return images_to_upload
 
+
+def create_subject(capture_id, capture_data, images_to_upload):
+    """ Create a Subject """
     # skip subject if no images present
     if len(images_to_upload) == 0:
         logger.warning("capture_id {} has no valid images".format(capture_id))
         return None
 
+    # re-read compressed images if the upload is retried
+    for image in images_to_upload:
+        if hasattr(image, 'seek'):
+            image.seek(0)
+
     # add meta-data to the subject required for the subject upload
     metadata = capture_data['upload_metadata']
     metadata['#original_images'] = \
@@ -159,6 +144,20 @@ def create_subject(capture_id, capture_data, args):
     return subject
 
 
+def create_subject_with_retry(capture_id, capture_data, images_to_upload):
+    """ Create a subject - retry on connection issues """
+    return retry(
+        create_subject,
+        attempts=MAX_RETRIES_PER_BATCH,
+        sleeptime=60,
+        retry_exceptions=(OSError, PanoptesAPIException),
+        cleanup=connect_to_panoptes,
+        args=(capture_id,
+              capture_data,
+              images_to_upload),
+        log_args=False,)
+
+
 if __name__ == "__main__":
 
     # Parse command line arguments
@@ -208,6 +207,30 @@ if __name__ == "__main__":
         help="The number of processes to use in parallel if\
         '--dont_compress_images' is not specified.")
 
+    parser.add_argument(
+        "--draft_resize", action='store_true',
+        help="Resize images using JPEG decoder downscaling (faster, \
+        slightly lower quality than the default resizing).")
+
+    parser.add_argument(
+        "--image_cache_dir", type=str, default=None,
+        help="Directory to cache compressed images in - images uploaded \
+        again (with the same compression settings) are not re-compressed.")
+
+    parser.add_argument(
+        "--image_cache_max_gb", type=float, default=20,
+        help="The max. size of the image cache (least recently used \
+        images are removed).")
+
+    parser.add_argument(
+        "--n_upload_workers", type=int, default=4,
+        help="The number of subjects to create concurrently.")
+
+    parser.add_argument(
+        "--upload_queue_size", type=int, default=None,
+        help="The max. number of captures whose images are compressed \
+        ahead of the uploads (default: 2 * n_upload_workers).")
+
     parser.add_argument(
         "--upload_batch_size", type=int, default=100,
         help="The number of subjects to create before linking them.")
@@ -354,124 +377,71 @@ if __name__ == "__main__":
     n_tot = len(capture_ids_all)
     n_tot_remaining = n_tot - n_in_tracker_file
 
-    ###################################
-    # Create Signal Handler
-    ###################################
-
-    # handle (Ctrl+C) keyboard interrupt
-    def signal_handler(*args):
-        logger.info('You pressed Ctrl+C! - attempting to clean up gracefully')
-        remaining_subjects_to_link = len(batch_data['subjects_to_link'])
-        try:
-            logger.info("Linking {} remaining uploaded subjects".format(
-                        remaining_subjects_to_link))
-            uploader.add_batch_to_subject_set(
-                my_set, batch_data['subjects_to_link'])
-            uploader.update_tracker_file(
-                tracker_file_path, batch_data['capture_ids'],
-                batch_data['subject_ids'])
-        except PanoptesAPIException as e:
-            logger.error('Failed to link {} remaining subjects'.format(
-                         remaining_subjects_to_link))
-            uploader.handle_batch_failure(batch_data['subjects_to_link'])
-        finally:
-            raise SystemExit
-
-    # register the handler for interrupt signal
-    signal.signal(signal.SIGINT, signal_handler)
-
     ###################################
     # Iterate over Manifest and
     # upload Captures
     ###################################
 
-    MAX_RETRIES_PER_BATCH = 5
-    batch_data = batch_data_storage()
-
-    for _no, capture_id in enumerate(capture_ids_all):
-
-        # skip if capture_id arleady in tracker_file / uploaded
-        if capture_id in tracker_data:
-            logger.debug("capture_id {} alreday uploaded".format(capture_id))
-            continue
-
-        try:
-            # current capture data
-            capture_data = mani[capture_id]
-
-            # Create subject - retry on connection issues
-            subject = retry(
-                create_subject,
-                attempts=MAX_RETRIES_PER_BATCH,
-                sleeptime=60,
-                retry_exceptions=(OSError, PanoptesAPIException),
-                cleanup=connect_to_panoptes,
-                args=(capture_id,
-                      capture_data,
-                      args),
-                log_args=False,)
-
-            if subject is None:
-                logger.warning(
-                    "subject creation for capture_id {} failed".format(
-                        capture_id))
-                continue
-
-            # get and store information about the created subject
-            batch_data['subjects_to_link'].append(subject)
-            batch_data['capture_ids'].append(capture_id)
-            batch_data['subject_ids'].append(subject.id)
-
-            logger.debug("finished saving capture_id {} - {}".format(
-                         capture_id, current_time_str()))
-
-        except Exception as e:
-            logger.info(
-                'Error while creating subject for capture_id: {}'.format(
-                    capture_id))
-            logger.info('Details of error: {}'.format(e))
-            uploader.handle_batch_failure(batch_data['subjects_to_link'])
-            raise
-
-        # link current batch to subject set
-        if len(batch_data['subjects_to_link']) >= args['upload_batch_size']:
-            uploader.add_batch_to_subject_set(
-                my_set, batch_data['subjects_to_link'])
-            total_uploaded_subjects += len(batch_data['subjects_to_link'])
-
-            # update upload tracker
-            uploader.update_tracker_file(
-                tracker_file_path,
-                batch_data['capture_ids'],
-                batch_data['subject_ids'])
-
-            batch_data = batch_data_storage()
-
-            # print progress information
-            ts = time.time()
-            tr = estimate_remaining_time(
-                time_start,
-                n_tot_remaining,
-                max(0, total_uploaded_subjects-n_in_tracker_file))
-            st = datetime.datetime.fromtimestamp(ts).strftime('%H:%M:%S')
-            msg = "Saved {:5}/{:5} ({:4} %) - Current Time: {} - \
-                   Estimated Time Remaining: {}".format(
-                   total_uploaded_subjects, n_tot,
-                   round((total_uploaded_subjects/n_tot) * 100, 2), st, tr)
-            logger.info(textwrap.shorten(msg, width=99))
-
-    ###################################
-    # Link any remaining subjects
-    ###################################
-
-    if len(batch_data['subjects_to_link']) > 0:
-        uploader.add_batch_to_subject_set(
-            my_set, batch_data['subjects_to_link'])
-        total_uploaded_subjects += len(batch_data['subjects_to_link'])
+    def update_tracker_and_log_progress(capture_ids, subject_ids):
+        """ Update the tracker after linking a batch """
+        global total_uploaded_subjects
         uploader.update_tracker_file(
-            tracker_file_path,
-            batch_data['capture_ids'],
-            batch_data['subject_ids'])
+            tracker_file_path, capture_ids, subject_ids)
+        total_uploaded_subjects += len(capture_ids)
+        # print progress information
+        ts = time.time()
+        tr = estimate_remaining_time(
+            time_start,
+            n_tot_remaining,
+            max(0, total_uploaded_subjects-n_in_tracker_file))
+        st = datetime.datetime.fromtimestamp(ts).strftime('%H:%M:%S')
+        msg = "Saved {:5}/{:5} ({:4} %) - Current Time: {} - \
+               Estimated Time Remaining: {}".format(
+               total_uploaded_subjects, n_tot,
+               round((total_uploaded_subjects/n_tot) * 100, 2), st, tr)
+        logger.info(textwrap.shorten(msg, width=99))
+
+    # skip capture_ids arleady in tracker_file / uploaded
+    captures_to_upload = (
+        (capture_id, mani[capture_id]) for capture_id in capture_ids_all
+        if capture_id not in tracker_data)
+
+    # persistent worker processes to compress images
+    compression_service = None
+    if not args['dont_compress_images']:
+        image_cache = None
+        if args['image_cache_dir'] is not None:
+            image_cache = CompressedImageCache(
+                args['image_cache_dir'],
+                max_size_bytes=int(args['image_cache_max_gb'] * 1024 ** 3),
+                n_processes=args['n_processes'])
+        compression_service = ImageCompressionService(
+            n_processes=args['n_processes'],
+            max_pixel_of_largest_side=args['max_pixel_of_largest_side'],
+            save_quality=args['save_quality'],
+            cache=image_cache,
+            draft=args['draft_resize'])
+
+    try:
+        upload_subjects_pipelined(
+            captures_to_upload,
+            get_images=partial(
+                get_capture_image_paths,
+                image_root_path=args['image_root_path']),
+            create_subject=create_subject_with_retry,
+            link_batch=partial(uploader.add_batch_to_subject_set, my_set),
+            on_linked=update_tracker_and_log_progress,
+            rollback=uploader.handle_batch_failure,
+            upload_batch_size=args['upload_batch_size'],
+            n_upload_workers=args['n_upload_workers'],
+            compression_service=compression_service,
+            queue_size=args['upload_queue_size'],
+            worker_initializer=connect_to_panoptes)
+    except KeyboardInterrupt:
+        raise SystemExit
+    finally:
+        if compression_service is not None:
+            compression_service.shutdown()
 
     ###################################
     # Update Manifest
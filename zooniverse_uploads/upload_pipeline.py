@@ -0,0 +1,211 @@
+""" Pipelined Upload of Subjects
+    - compression workers (an ImageCompressionService) compress the
+      images of the next captures while subjects are being uploaded,
+      they run at most 'queue_size' captures ahead
+    - upload workers (threads) create subjects concurrently
+    - the linker (the calling thread) links created subjects in batches
+      to the subject set
+    - the Zooniverse API is only accessed via the functions passed in,
+      e.g. to run the pipeline against a local stand-in
+"""
+import io
+import queue
+import logging
+import threading
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+# marks the end of a queue
+_STOP = object()
+
+
+def _compressed_images(future):
+    """ Compressed images of a capture - images that failed to
+        process are removed
+    """
+    return [io.BytesIO(x) for x in future.result() if x is not None]
+
+
+def _prepare_ahead(captures, get_images, compression_service, queue_size):
+    """ Compress the images of captures - at most 'queue_size' captures
+        ahead of the consumer
+        Yields: tuple of capture_id, capture_data, images
+    """
+    pending = deque()
+    for capture_id, capture_data in captures:
+        images = get_images(capture_id, capture_data)
+        if compression_service is None:
+            yield capture_id, capture_data, images
+            continue
+        pending.append((
+            capture_id, capture_data, compression_service.submit(images)))
+        if len(pending) >= queue_size:
+            capture_id, capture_data, future = pending.popleft()
+            yield capture_id, capture_data, _compressed_images(future)
+    while len(pending) > 0:
+        capture_id, capture_data, future = pending.popleft()
+        yield capture_id, capture_data, _compressed_images(future)
+
+
+def _feed_uploads(
+        captures, get_images, compression_service, queue_size, upload_queue,
+        created_queue, stop_event, n_upload_workers):
+    """ Put captures with (compressed) images into the upload queue """
+    try:
+        for item in _prepare_ahead(
+                captures, get_images, compression_service, queue_size):
+            if stop_event.is_set():
+                break
+            upload_queue.put(item)
+    except BaseException as e:
+        stop_event.set()
+        created_queue.put(('error', None, e))
+    finally:
+        for _ in range(n_upload_workers):
+            upload_queue.put(_STOP)
+
+
+def _upload_worker(
+        upload_queue, created_queue, create_subject, stop_event,
+        worker_initializer):
+    """ Create subjects until the upload queue is exhausted """
+    try:
+        if worker_initializer is not None:
+            worker_initializer()
+        while True:
+            item = upload_queue.get()
+            if item is _STOP:
+                break
+            # drain remaining captures after a failure
+            if stop_event.is_set():
+                continue
+            capture_id, capture_data, images = item
+            try:
+                subject = create_subject(capture_id, capture_data, images)
+            except BaseException as e:
+                stop_event.set()
+                created_queue.put(('error', capture_id, e))
+                continue
+            created_queue.put(('created', capture_id, subject))
+    except BaseException as e:
+        stop_event.set()
+        created_queue.put(('error', None, e))
+        # unblock the feeder
+        while upload_queue.get() is not _STOP:
+            pass
+    finally:
+        created_queue.put(_STOP)
+
+
+def _link(batch, link_batch, on_linked):
+    link_batch([x[1] for x in batch])
+    on_linked([x[0] for x in batch], [x[1].id for x in batch])
+
+
+def upload_subjects_pipelined(
+        captures, get_images, create_subject,
+        link_batch, on_linked, rollback,
+        upload_batch_size=100, n_upload_workers=4,
+        compression_service=None, queue_size=None,
+        worker_initializer=None):
+    """ Upload subjects with concurrent compression, subject creation
+        and linking
+        captures: iterable of (capture_id, capture_data) to upload
+        get_images: function(capture_id, capture_data) returning the
+            images (paths) of a capture
+        create_subject: function(capture_id, capture_data, images)
+            returning the created subject (None to skip the capture),
+            runs in the upload threads
+        link_batch: function(subjects) linking subjects to the set
+        on_linked: function(capture_ids, subject_ids) called after a batch
+            was linked (e.g. to update the tracker file)
+        rollback: function(subjects) to remove created subjects that
+            were not linked if the upload fails
+        compression_service: ImageCompressionService to compress the
+            images (images are uploaded as they are if None)
+        worker_initializer: called once in each upload thread
+            (e.g. to connect to the API)
+        Returns: number of linked subjects
+    """
+    if queue_size is None:
+        queue_size = max(2 * n_upload_workers, 1)
+    upload_queue = queue.Queue(maxsize=queue_size)
+    created_queue = queue.Queue()
+    stop_event = threading.Event()
+    feeder = threading.Thread(
+        target=_feed_uploads,
+        args=(captures, get_images, compression_service, queue_size,
+              upload_queue, created_queue, stop_event, n_upload_workers),
+        daemon=True)
+    workers = [
+        threading.Thread(
+            target=_upload_worker,
+            args=(upload_queue, created_queue, create_subject, stop_event,
+                  worker_initializer),
+            daemon=True)
+        for _ in range(n_upload_workers)]
+    feeder.start()
+    for worker in workers:
+        worker.start()
+    batch = list()
+    error = None
+    n_linked = 0
+    n_workers_running = n_upload_workers
+    try:
+        while n_workers_running > 0:
+            item = created_queue.get()
+            if item is _STOP:
+                n_workers_running -= 1
+                continue
+            status, capture_id, result = item
+            if status == 'error':
+                logger.info(
+                    'Error while creating subject for capture_id: {}'.format(
+                        capture_id))
+                logger.info('Details of error: {}'.format(result))
+                if error is None:
+                    error = result
+                continue
+            if result is None:
+                logger.warning(
+                    "subject creation for capture_id {} failed".format(
+                        capture_id))
+                continue
+            batch.append((capture_id, result))
+            # link current batch to subject set
+            if error is None and len(batch) >= upload_batch_size:
+                _link(batch, link_batch, on_linked)
+                n_linked += len(batch)
+                batch = list()
+    except KeyboardInterrupt:
+        logger.info('Interrupted - attempting to clean up gracefully')
+        stop_event.set()
+        # wait for subjects that are being created
+        while n_workers_running > 0:
+            item = created_queue.get()
+            if item is _STOP:
+                n_workers_running -= 1
+            elif item[0] == 'created' and item[2] is not None:
+                batch.append((item[1], item[2]))
+        try:
+            logger.info("Linking {} remaining uploaded subjects".format(
+                        len(batch)))
+            _link(batch, link_batch, on_linked)
+        except Exception:
+            logger.error('Failed to link {} remaining subjects'.format(
+                         len(batch)))
+            rollback([x[1] for x in batch])
+        raise
+    finally:
+        stop_event.set()
+    if error is not None:
+        rollback([x[1] for x in batch])
+        raise error
+    # link any remaining subjects
+    if len(batch) > 0:
+        _link(batch, link_batch, on_linked)
+        n_linked += len(batch)
+    return n_linked